@@ -1,46 +1,89 @@
 import os
+import asyncio
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage, SystemMessage
 from dotenv import load_dotenv
-from functions import get_products, place_order, check_order_status, process_return, compare_products_serper, manage_session_chat_history
+from functions import get_products, retrieve_products, place_order, check_order_status, process_return, compare_products_serper
+from async_functions import aget_products, aretrieve_products, aplace_order, acheck_order_status, aprocess_return, acompare_products_serper
+from intent_classifier import PRODUCT_KEYWORDS
+from serper_cache import serper_cache
+from token_budget import take_within_budget
 load_dotenv()
 
-class ProductDetailsAgent:
-    """AI Agent for handling product information requests using get_products"""
-    
+# Most relevant products retrieved per message, instead of the whole catalog
+PRODUCT_RETRIEVAL_TOP_K = int(os.getenv("PRODUCT_RETRIEVAL_TOP_K", "20"))
+# Hard cap on the product listing's share of the prompt; retrieval order decides what's cut
+PRODUCT_PROMPT_TOKEN_BUDGET = int(os.getenv("PRODUCT_PROMPT_TOKEN_BUDGET", "800"))
+
+class _AsyncGeneration:
+    """Async generation shared by the agents; each agent builds its prompt in _aprepare_messages"""
+
+    # Speculative data read for the customer; only valid once the customer turns out to exist
+    speculation_needs_customer = False
+
+    async def aprocess_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context="", prefetched=None):
+        """Async process_message"""
+        messages = await self._aprepare_messages(user_message, phone_no, customer_data, chat_context, prefetched)
+
+        self.generation_calls += 1
+        response = await self.llm.ainvoke(messages)
+        return response.content
+
+    async def astream_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context="", prefetched=None):
+        """aprocess_message that yields the response text as Gemini generates it"""
+        messages = await self._aprepare_messages(user_message, phone_no, customer_data, chat_context, prefetched)
+
+        self.generation_calls += 1
+        async for chunk in self.llm.astream(messages):
+            if chunk.content:
+                yield chunk.content
+
+
+class ProductDetailsAgent(_AsyncGeneration):
+    """AI Agent for handling product information requests using retrieve_products"""
+
     def __init__(self):
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-2.0-flash",
             google_api_key=os.getenv("GOOGLE_API_KEY"),
             temperature=0.3,
         )
-    
-    def process_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context=""):
-        """Process product details requests"""
+        # LLM calls made by this agent, exposed through IntentRouter.call_stats()
+        self.generation_calls = 0
 
+    def _product_query(self, user_message):
+        """Pick the product name filter for this message (None = rank the whole catalog)"""
         user_lower = user_message.lower()
-        product_keywords = ['iphone', 'macbook', 'ipad', 'airpods', 'levi', 'nike', 'puma', 'adidas']
-        
         product_name = None
-        for keyword in product_keywords:
+        for keyword in PRODUCT_KEYWORDS:
             if keyword in user_lower:
                 product_name = keyword
                 break
 
         if any(word in user_lower for word in ['all', 'catalog', 'everything', 'show me']):
-            product_data = get_products()
-        elif product_name:
-            product_data = get_products(product_name)
-        else:
-            product_data = get_products()
+            return None
+        return product_name
 
+    def _retrieve(self, user_message):
+        return retrieve_products(user_message, self._product_query(user_message), PRODUCT_RETRIEVAL_TOP_K)
+
+    async def _aretrieve(self, user_message):
+        return await aretrieve_products(user_message, self._product_query(user_message), PRODUCT_RETRIEVAL_TOP_K)
+
+    def _build_messages(self, user_message, phone_no, customer_data, chat_context, product_data):
         if product_data and product_data.get('found'):
-            products_info = f"Found {product_data['total_products']} products:\n\n"
+            blocks = []
             for product in product_data['products']:
                 status = "✅ Available" if product['available'] else "❌ Out of Stock"
-                products_info += f"• {product['product_name']} ({product['size']})\n"
-                products_info += f"  Price: ${product['price']:.2f}\n"
-                products_info += f"  Stock: {product['stock_quantity']} units {status}\n\n"
+                block = f"• {product['product_name']} ({product['size']})\n"
+                block += f"  Price: ${product['price']:.2f}\n"
+                block += f"  Stock: {product['stock_quantity']} units {status}\n\n"
+                blocks.append(block)
+            blocks, _ = take_within_budget(blocks, PRODUCT_PROMPT_TOKEN_BUDGET)
+
+            total_matches = product_data.get('total_matches', product_data['total_products'])
+            products_info = f"Showing {len(blocks)} of {total_matches} matching products, most relevant first:\n\n"
+            products_info += "".join(blocks)
         else:
             products_info = "No products found or unable to retrieve product information."
 
@@ -64,33 +107,72 @@ Phone: {phone_no}
 
 Respond to their inquiry about products in a helpful and engaging way."""
 
-        messages = [
+        return [
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_message)
         ]
-        
+
+    def speculative_fetch(self, user_message, phone_no):
+        """Read-only data process_message will need, fetched before the intent is known"""
+        return {"products": self._retrieve(user_message)}
+
+    async def aspeculative_fetch(self, user_message, phone_no):
+        """Async speculative_fetch"""
+        return {"products": await self._aretrieve(user_message)}
+
+    def process_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context="", prefetched=None):
+        """Process product details requests"""
+        product_data = prefetched["products"] if prefetched else self._retrieve(user_message)
+        messages = self._build_messages(user_message, phone_no, customer_data, chat_context, product_data)
+
+        self.generation_calls += 1
         response = self.llm.invoke(messages)
         return response.content
 
+    async def _aprepare_messages(self, user_message, phone_no, customer_data, chat_context, prefetched):
+        product_data = prefetched["products"] if prefetched else await self._aretrieve(user_message)
+        return self._build_messages(user_message, phone_no, customer_data, chat_context, product_data)
+
 
-class InventoryManagementAgent:
+class InventoryManagementAgent(_AsyncGeneration):
     """AI Agent for handling orders, returns, and inventory management"""
-    
+
+    speculation_needs_customer = True
+
     def __init__(self):
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-2.0-flash",
             google_api_key=os.getenv("GOOGLE_API_KEY"),
             temperature=0.3,
         )
-    
-    def process_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context=""):
-        """Process inventory management requests"""
-        
+        # LLM calls made by this agent, exposed through IntentRouter.call_stats()
+        self.generation_calls = 0
+
+    def _plan_operation(self, user_message, phone_no, customer_data):
+        """Decide which inventory operation the message asks for: (operation, kwargs)"""
         user_lower = user_message.lower()
-        operation_result = ""
 
         if any(keyword in user_lower for keyword in ['order status', 'check order', 'my orders', 'track']):
-            order_data = check_order_status(phone_no)
+            return "order_status", {"phone_no": phone_no, "customer_data": customer_data}
+
+        elif any(keyword in user_lower for keyword in ['return', 'refund', 'send back']):
+            return "return", {"phone_no": phone_no, "customer_data": customer_data}
+
+        elif any(keyword in user_lower for keyword in ['buy', 'order', 'purchase', 'want to buy']):
+            if 'levi' in user_lower and 't-shirt' in user_lower:
+                size = 'M' if ' m ' in user_lower or user_lower.endswith(' m') else 'L'
+                return "place_order", {"phone_no": phone_no, "product_name": "Levi's T-Shirt", "size": size, "quantity": 1, "customer_name": customer_data.get('customer_name'), "customer_data": customer_data}
+            elif 'nike' in user_lower and 'shoes' in user_lower:
+                size = '42' if '42' in user_message else '44'
+                return "place_order", {"phone_no": phone_no, "product_name": "Nike Running Shoes", "size": size, "quantity": 1, "customer_name": customer_data.get('customer_name'), "customer_data": customer_data}
+            return "unspecified_order", None
+
+        return "help", None
+
+    def _describe_operation(self, operation, data):
+        """Render an operation's result for the system prompt"""
+        if operation == "order_status":
+            order_data = data
             if order_data['found']:
                 operation_result = f"ORDER STATUS for {order_data['customer_name']}:\n"
                 operation_result += f"Total Orders: {order_data['order_count']}\n\n"
@@ -103,9 +185,10 @@ class InventoryManagementAgent:
                     operation_result += f"   Date: {order['order_date']}\n\n"
             else:
                 operation_result = f"ORDER STATUS: {order_data['message']}"
-                
-        elif any(keyword in user_lower for keyword in ['return', 'refund', 'send back']):
-            return_data = process_return(phone_no)
+            return operation_result
+
+        if operation == "return":
+            return_data = data
             if return_data['success']:
                 operation_result = f"RETURN PROCESSED:\n"
                 operation_result += f"Return ID: #{return_data['return_id']}\n"
@@ -117,18 +200,10 @@ class InventoryManagementAgent:
                 operation_result += f"Reason: {return_data['reason']}\n"
             else:
                 operation_result = f"RETURN ERROR: {return_data['message']}"
-                
-        elif any(keyword in user_lower for keyword in ['buy', 'order', 'purchase', 'want to buy']):
-            if 'levi' in user_lower and 't-shirt' in user_lower:
-                size = 'M' if ' m ' in user_lower or user_lower.endswith(' m') else 'L'
-                order_data = place_order(phone_no, "Levi's T-Shirt", size, 1, customer_data.get('customer_name'))
-            elif 'nike' in user_lower and 'shoes' in user_lower:
-                size = '42' if '42' in user_message else '44'
-                order_data = place_order(phone_no, "Nike Running Shoes", size, 1, customer_data.get('customer_name'))
-            else:
-                operation_result = "PLACE ORDER: Please specify the product name and size you want to order."
-                order_data = {"success": False}
-            
+            return operation_result
+
+        if operation == "place_order":
+            order_data = data
             if order_data.get("success"):
                 operation_result = f"ORDER PLACED SUCCESSFULLY:\n"
                 operation_result += f"Order ID: #{order_data['order_id']}\n"
@@ -137,11 +212,16 @@ class InventoryManagementAgent:
                 operation_result += f"Unit Price: ${order_data['unit_price']:.2f}\n"
                 operation_result += f"Total: ${order_data['total_amount']:.2f}\n"
                 operation_result += f"Status: {order_data['status']}\n"
-            elif 'Please specify' not in operation_result:
+            else:
                 operation_result = f"ORDER ERROR: {order_data.get('message', 'Unknown error')}"
-        else:
-            operation_result = "I can help you with:\n- Checking order status\n- Placing new orders\n- Processing returns\n\nWhat would you like to do?"
+            return operation_result
+
+        if operation == "unspecified_order":
+            return "PLACE ORDER: Please specify the product name and size you want to order."
 
+        return "I can help you with:\n- Checking order status\n- Placing new orders\n- Processing returns\n\nWhat would you like to do?"
+
+    def _build_messages(self, user_message, phone_no, customer_data, chat_context, operation_result):
         system_prompt = f"""You are an Inventory Management Specialist for our e-commerce store.
 
 CHAT CONTEXT:
@@ -161,34 +241,81 @@ Your role:
 
 Respond to the customer's request based on the operation result above."""
 
-        messages = [
+        return [
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_message)
         ]
-        
+
+    def speculative_fetch(self, user_message, phone_no):
+        """Order status for status questions; orders and returns change data and never run speculatively"""
+        operation, _ = self._plan_operation(user_message, phone_no, {})
+        if operation != "order_status":
+            return None
+        return {"order_status": check_order_status(phone_no)}
+
+    async def aspeculative_fetch(self, user_message, phone_no):
+        """Async speculative_fetch"""
+        operation, _ = self._plan_operation(user_message, phone_no, {})
+        if operation != "order_status":
+            return None
+        return {"order_status": await acheck_order_status(phone_no)}
+
+    def process_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context="", prefetched=None):
+        """Process inventory management requests"""
+        operations = {
+            "order_status": check_order_status,
+            "return": process_return,
+            "place_order": place_order
+        }
+
+        operation, kwargs = self._plan_operation(user_message, phone_no, customer_data)
+        if prefetched and operation in prefetched:
+            data = prefetched[operation]
+        else:
+            data = operations[operation](**kwargs) if operation in operations else None
+        operation_result = self._describe_operation(operation, data)
+        messages = self._build_messages(user_message, phone_no, customer_data, chat_context, operation_result)
+
+        self.generation_calls += 1
         response = self.llm.invoke(messages)
         return response.content
 
+    async def _aprepare_messages(self, user_message, phone_no, customer_data, chat_context, prefetched):
+        operations = {
+            "order_status": acheck_order_status,
+            "return": aprocess_return,
+            "place_order": aplace_order
+        }
+
+        operation, kwargs = self._plan_operation(user_message, phone_no, customer_data)
+        if prefetched and operation in prefetched:
+            data = prefetched[operation]
+        else:
+            data = await operations[operation](**kwargs) if operation in operations else None
+        operation_result = self._describe_operation(operation, data)
+        return self._build_messages(user_message, phone_no, customer_data, chat_context, operation_result)
+
 
-class ProductComparisonAgent:
+class ProductComparisonAgent(_AsyncGeneration):
     """AI Agent for handling product comparisons using compare_products_serper"""
-    
+
     def __init__(self):
         self.llm = ChatGoogleGenerativeAI(
             model="gemini-2.0-flash",
             google_api_key=os.getenv("GOOGLE_API_KEY"),
             temperature=0.3,
         )
-    
-    def process_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context=""):
-        """Process product comparison requests"""
+        # LLM calls made by this agent, exposed through IntentRouter.call_stats()
+        self.generation_calls = 0
 
-        comparison_data = compare_products_serper(user_message)
+    def _wants_internal_products(self, user_message):
+        return any(product in user_message.lower() for product in ['iphone', 'macbook', 'ipad', 'airpods'])
 
+    def _build_messages(self, user_message, customer_data, chat_context, comparison_data, internal_products):
         if comparison_data.get('success'):
             comparison_info = f"EXTERNAL COMPARISON RESULTS for '{comparison_data['query']}':\n"
             comparison_info += f"Found {comparison_data['result_count']} comparison sources:\n\n"
-            
+
             for i, result in enumerate(comparison_data['results'], 1):
                 comparison_info += f"{i}. {result['title']}\n"
                 comparison_info += f"   Summary: {result['snippet']}\n"
@@ -199,12 +326,10 @@ class ProductComparisonAgent:
             comparison_info = f"COMPARISON ERROR: {comparison_data.get('message', 'Unable to fetch comparison data')}"
 
         our_products_info = ""
-        if any(product in user_message.lower() for product in ['iphone', 'macbook', 'ipad', 'airpods']):
-            internal_products = get_products()
-            if internal_products and internal_products.get('found'):
-                our_products_info = "\nOUR AVAILABLE PRODUCTS:\n"
-                for product in internal_products['products'][:5]:  # Show first 5
-                    our_products_info += f"• {product['product_name']} ({product['size']}): ${product['price']:.2f}\n"
+        if internal_products and internal_products.get('found'):
+            our_products_info = "\nOUR AVAILABLE PRODUCTS:\n"
+            for product in internal_products['products'][:5]:  # Show first 5
+                our_products_info += f"• {product['product_name']} ({product['size']}): ${product['price']:.2f}\n"
 
         system_prompt = f"""You are a Product Comparison Specialist for our e-commerce store.
 
@@ -228,10 +353,56 @@ Your role:
 
 Respond to their comparison request with helpful, objective analysis."""
 
-        messages = [
+        return [
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_message)
         ]
-        
+
+    def _fetch(self, user_message, prefetched=None):
+        """Serper comparison plus our matching products; the products may come from speculation"""
+        if prefetched:
+            internal_products = prefetched["internal_products"]
+        else:
+            internal_products = get_products() if self._wants_internal_products(user_message) else None
+        return {
+            "comparison": serper_cache.fetch(user_message, compare_products_serper),
+            "internal_products": internal_products
+        }
+
+    async def _afetch(self, user_message, prefetched=None):
+        if not prefetched and self._wants_internal_products(user_message):
+            comparison_data, internal_products = await asyncio.gather(
+                serper_cache.afetch(user_message, acompare_products_serper),
+                aget_products()
+            )
+        else:
+            internal_products = prefetched["internal_products"] if prefetched else None
+            comparison_data = await serper_cache.afetch(user_message, acompare_products_serper)
+        return {"comparison": comparison_data, "internal_products": internal_products}
+
+    def speculative_fetch(self, user_message, phone_no):
+        """Our own products for the comparison; the paid Serper search waits until the intent is known"""
+        if not self._wants_internal_products(user_message):
+            return None
+        return {"internal_products": get_products()}
+
+    async def aspeculative_fetch(self, user_message, phone_no):
+        """Async speculative_fetch"""
+        if not self._wants_internal_products(user_message):
+            return None
+        return {"internal_products": await aget_products()}
+
+    def process_message(self, user_message, phone_no, customer_data, previous_conversations, chat_context="", prefetched=None):
+        """Process product comparison requests"""
+        data = self._fetch(user_message, prefetched)
+        comparison_data, internal_products = data["comparison"], data["internal_products"]
+        messages = self._build_messages(user_message, customer_data, chat_context, comparison_data, internal_products)
+
+        self.generation_calls += 1
         response = self.llm.invoke(messages)
-        return response.content
\ No newline at end of file
+        return response.content
+
+    async def _aprepare_messages(self, user_message, phone_no, customer_data, chat_context, prefetched):
+        data = await self._afetch(user_message, prefetched)
+        comparison_data, internal_products = data["comparison"], data["internal_products"]
+        return self._build_messages(user_message, customer_data, chat_context, comparison_data, internal_products)
@@ -0,0 +1,218 @@
+import os
+import time
+import uuid
+from typing import Dict, Any, List
+from dotenv import load_dotenv
+
+from functions import (
+    redis_client,
+    save_chat_sessions_to_db,
+    _session_keys,
+    _history_key,
+    _session_from_parts,
+    _queue_session_prepend,
+    _migrate_legacy_session,
+    SESSION_IDLE_SECONDS,
+    SESSION_ACTIVITY_KEY,
+)
+from context_builder import summary_key
+
+load_dotenv()
+
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '100'))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '60'))
+# A batch still parked this long after it was taken belongs to an archiver that died
+# between the take and the commit; the next run re-claims and archives it
+ARCHIVE_RECLAIM_SECONDS = float(os.getenv('ARCHIVE_RECLAIM_SECONDS', '300'))
+# Sorted set of batches being archived, scored by when they were taken (or last re-claimed)
+ARCHIVING_BATCHES_KEY = "chat_archiving:batches"
+
+# Atomically take up to ARGV[2] sessions idle since ARGV[1] off the activity index and park them
+# under batch ARGV[4]: each session's messages, meta and legacy blob (prefixes ARGV[5..7]) are
+# renamed to their parked names (ARGV[8..10]); the stored history and summary (ARGV[11], ARGV[12])
+# are superseded by the session archived now. Doing both in one script means a session is never
+# off the index without being parked, no message lands in between, and concurrent archivers never
+# take the same session. Parked keys don't expire: they go away once the batch is committed or restored.
+_TAKE_IDLE_BATCH = redis_client.register_script("""
+local phones = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #phones == 0 then
+    return phones
+end
+redis.call('ZREM', KEYS[1], unpack(phones))
+for _, phone in ipairs(phones) do
+    for kind = 0, 2 do
+        local key = ARGV[5 + kind] .. phone
+        if redis.call('EXISTS', key) == 1 then
+            local parked = ARGV[8 + kind] .. phone
+            redis.call('RENAME', key, parked)
+            redis.call('PERSIST', parked)
+        end
+    end
+    redis.call('DEL', ARGV[11] .. phone, ARGV[12] .. phone)
+    redis.call('SADD', KEYS[3], phone)
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[4])
+return phones
+""")
+
+# Take the oldest batch parked before ARGV[1] and mark it re-claimed at ARGV[2], so
+# concurrent archivers don't both pick it up
+_CLAIM_STALE_BATCH = redis_client.register_script("""
+local batch = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)[1]
+if batch then
+    redis.call('ZADD', KEYS[1], ARGV[2], batch)
+end
+return batch
+""")
+
+
+def _parked_keys(batch_id: str, phone_no: str) -> Dict[str, str]:
+    """Where a session waits, under its batch, until the batch is committed to Postgres"""
+    return {kind: f"chat_archiving:{batch_id}:{kind}:{phone_no}" for kind in ("messages", "meta", "legacy")}
+
+
+def _batch_phones_key(batch_id: str) -> str:
+    return f"chat_archiving:{batch_id}:phones"
+
+
+def _take_idle_batch(batch_id: str, cutoff: float, batch_size: int) -> List[str]:
+    """Claim and park up to batch_size idle sessions under batch_id; returns their phones"""
+    kinds = ("messages", "meta", "legacy")
+    session_prefixes = _session_keys("")
+    parked_prefixes = _parked_keys(batch_id, "")
+    phones = _TAKE_IDLE_BATCH(
+        keys=[SESSION_ACTIVITY_KEY, ARCHIVING_BATCHES_KEY, _batch_phones_key(batch_id)],
+        args=[
+            cutoff, batch_size, time.time(), batch_id,
+            *[session_prefixes[kind] for kind in kinds],
+            *[parked_prefixes[kind] for kind in kinds],
+            _history_key(""), summary_key(""),
+        ],
+    )
+    return [phone.decode() if isinstance(phone, bytes) else phone for phone in phones]
+
+
+def _read_parked(batch_id: str) -> Dict[str, Dict[str, Any]]:
+    phones = [phone.decode() if isinstance(phone, bytes) else phone for phone in redis_client.smembers(_batch_phones_key(batch_id))]
+    pipe = redis_client.pipeline(transaction=False)
+    for phone_no in phones:
+        keys = _parked_keys(batch_id, phone_no)
+        pipe.lrange(keys["messages"], 0, -1)
+        pipe.hgetall(keys["meta"])
+        # Sessions not yet migrated from the old single-blob format
+        pipe.get(keys["legacy"])
+    results = pipe.execute()
+
+    sessions = {}
+    for i, phone_no in enumerate(phones):
+        raw_messages, meta, legacy_blob = results[i * 3:(i + 1) * 3]
+        chat_history = _session_from_parts(phone_no, raw_messages, meta, legacy_blob)
+        if chat_history:
+            sessions[phone_no] = chat_history
+    return sessions
+
+
+def _queue_batch_release(pipe, batch_id: str, phones: List[str]):
+    for phone_no in phones:
+        pipe.delete(*_parked_keys(batch_id, phone_no).values())
+    pipe.delete(_batch_phones_key(batch_id))
+    pipe.zrem(ARCHIVING_BATCHES_KEY, batch_id)
+
+
+def _restore_sessions(batch_id: str, sessions: Dict[str, Dict[str, Any]]):
+    """Put a batch's sessions back after a failed DB write so the next run retries them"""
+    pipe = redis_client.pipeline(transaction=True)
+    for phone_no, chat_history in sessions.items():
+        _queue_session_prepend(pipe, phone_no, chat_history)
+        # Prepending shifts message indexes; a summary started since the take is rebuilt
+        pipe.delete(summary_key(phone_no))
+    _queue_batch_release(pipe, batch_id, list(sessions))
+    pipe.execute()
+
+
+def _archive_batch(batch_id: str, stats: Dict[str, Any], idle_seconds: int):
+    sessions = _read_parked(batch_id)
+
+    # The whole batch goes to Postgres in one transaction
+    result = save_chat_sessions_to_db(list(sessions.values()))
+    if result["success"]:
+        stats["archived"] += result["sessions"]
+        stats["rows"] += result["rows"]
+        stats["db_seconds"] += result["elapsed_ms"] / 1000
+        # Only now that the batch is committed do its Redis copies go away
+        pipe = redis_client.pipeline(transaction=True)
+        _queue_batch_release(pipe, batch_id, list(sessions))
+        pipe.execute()
+        print(f"Moved {result['sessions']} conversations to DB (inactive for {idle_seconds // 60}+ minutes, {result['rows_per_sec']} rows/sec)")
+    else:
+        stats["failed"] += len(sessions)
+        _restore_sessions(batch_id, sessions)
+    return sessions
+
+
+def archive_idle_sessions(batch_size: int = ARCHIVE_BATCH_SIZE, idle_seconds: int = SESSION_IDLE_SECONDS) -> Dict[str, Any]:
+    """Move sessions idle for `idle_seconds` from Redis to Postgres, one batch at a time"""
+    cutoff = time.time() - idle_seconds
+    stats = {"claimed": 0, "archived": 0, "expired": 0, "failed": 0, "reclaimed": 0, "rows": 0, "db_seconds": 0.0, "rows_per_sec": 0.0}
+
+    try:
+        # Batches parked by an archiver that died before committing them
+        while True:
+            batch_id = _CLAIM_STALE_BATCH(keys=[ARCHIVING_BATCHES_KEY], args=[time.time() - ARCHIVE_RECLAIM_SECONDS, time.time()])
+            if batch_id is None:
+                break
+            batch_id = batch_id.decode() if isinstance(batch_id, bytes) else batch_id
+            stats["reclaimed"] += 1
+            print(f"Re-claiming unfinished archive batch {batch_id}")
+            _archive_batch(batch_id, stats, idle_seconds)
+
+        while True:
+            batch_id = uuid.uuid4().hex
+            phones = _take_idle_batch(batch_id, cutoff, batch_size)
+            if not phones:
+                break
+            stats["claimed"] += len(phones)
+
+            sessions = _archive_batch(batch_id, stats, idle_seconds)
+            # Sessions whose key already expired have nothing left to archive
+            stats["expired"] += len(phones) - len(sessions)
+
+            if len(phones) < batch_size:
+                break
+
+    except Exception as e:
+        print(f"Archiver error: {e}")
+
+    if stats["db_seconds"] > 0:
+        stats["rows_per_sec"] = round(stats["rows"] / stats["db_seconds"], 1)
+    return stats
+
+
+def migrate_blob_sessions() -> int:
+    """Convert every old single-blob session to the list + meta format and index it (SCAN, never KEYS)"""
+    migrated = 0
+    try:
+        for key in redis_client.scan_iter(match="chat_session:*", count=500):
+            phone_no = (key.decode() if isinstance(key, bytes) else key).split(":", 1)[1]
+            migrated += _migrate_legacy_session(phone_no)
+    except Exception as e:
+        print(f"Error migrating blob sessions: {e}")
+    return migrated
+
+
+def run_archiver(interval: float = ARCHIVE_INTERVAL_SECONDS):
+    """Standalone worker loop: `python archiver.py`"""
+    print(f"Session archiver started (idle after {SESSION_IDLE_SECONDS}s, every {interval}s)")
+    migrated = migrate_blob_sessions()
+    if migrated:
+        print(f"Migrated {migrated} blob chat sessions")
+
+    while True:
+        stats = archive_idle_sessions()
+        if stats["claimed"]:
+            print(f"Archiver run: {stats}")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    run_archiver()
@@ -0,0 +1,602 @@
+import os
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+import json
+import redis
+import redis.asyncio as aioredis
+from db_pool import get_async_db_connection
+from catalog_cache import product_catalog, filter_catalog_rows, search_rows, CATALOG_QUERY
+from product_search import ProductSearchIndex
+from customer_cache import customer_cache, customer_key, CUSTOMER_CACHE_TTL
+from stock_reservation import redis_inventory_enabled, areserve_stock, arelease_stock, arecord_stock_release, arelease_returned_stock, record_release_failure
+from http_clients import async_http_client, timed_hop
+from context_builder import summary_key, parse_summary, needs_history, first_unread
+from functions import (
+    SERPER_URL,
+    SESSION_TTL_SECONDS,
+    _history_key,
+    _conversation_snapshot,
+    _history_result,
+    _known_customer,
+    _session_keys,
+    _new_chat_messages,
+    _queue_session_append,
+    _queue_context_read,
+    _queue_summary_write,
+    _queue_session_prepend,
+    _chat_context_result,
+    _products_result,
+    _retrieve_uncached,
+    _retrieved_result,
+    _order_status_result,
+    _order_placed_result,
+    _return_result,
+    _serper_payload,
+    _serper_result,
+)
+
+load_dotenv()
+
+# Async counterparts of functions.py for the FastAPI event loop. Each helper
+# mirrors its sync twin's SQL and response shape; only the I/O is non-blocking.
+
+async_redis_client = aioredis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+
+
+async def aload_previous_conversations_to_redis(phone_no: str, limit: int = 20, refresh: bool = False) -> Dict[str, Any]:
+    """Async load_previous_conversations_to_redis"""
+    try:
+        redis_key = _history_key(phone_no)
+        if not refresh:
+            cached = await async_redis_client.get(redis_key)
+            if cached:
+                return _history_result(phone_no, json.loads(cached), cached=True)
+
+        async with get_async_db_connection() as conn:
+            # Get the most recent conversation for this phone number
+            conversation = await conn.fetchrow("""
+                SELECT conversation_id, started_at
+                FROM conversations
+                WHERE phone_no = $1
+                ORDER BY started_at DESC
+                LIMIT 1
+            """, phone_no)
+
+            conversation_id, started_at, messages, customer_name = None, None, [], "Unknown"
+
+            if conversation:
+                conversation_id = conversation[0]
+                started_at = conversation[1]
+
+                # Get the last messages from the conversation, oldest first
+                messages = await conn.fetch("""
+                    SELECT sender, message_text, timestamp FROM (
+                        SELECT sender, message_text, timestamp
+                        FROM messages
+                        WHERE conversation_id = $1
+                        ORDER BY timestamp DESC
+                        LIMIT $2
+                    ) recent
+                    ORDER BY timestamp ASC
+                """, conversation_id, limit)
+
+                # Get customer name
+                customer = await _alookup_customer(conn, phone_no)
+                customer_name = customer["customer_name"] if customer else "Unknown"
+
+        conversation_data = _conversation_snapshot(phone_no, customer_name, started_at, messages, conversation_id)
+        await async_redis_client.setex(redis_key, SESSION_TTL_SECONDS, json.dumps(conversation_data))
+
+        return _history_result(phone_no, conversation_data)
+
+    except Exception as e:
+        print(f"Error loading previous conversations: {e}")
+        return {
+            "found": False,
+            "loaded": False,
+            "message": f"Error: {str(e)}"
+        }
+
+
+async def amanage_session_chat_history(phone_no: str, user_message: str = None, bot_response: str = None, get_context: bool = False) -> Dict[str, Any]:
+    """Async manage_session_chat_history"""
+    try:
+        if user_message or bot_response:
+            pipe = async_redis_client.pipeline(transaction=True)
+            _queue_session_append(pipe, phone_no, _new_chat_messages(user_message, bot_response))
+            legacy_exists = (await pipe.execute())[-1]
+            if legacy_exists:
+                await _amigrate_legacy_session(phone_no)
+
+        if get_context:
+            pipe = async_redis_client.pipeline(transaction=False)
+            _queue_context_read(pipe, phone_no)
+            recent_messages, total_messages, legacy_exists, history_blob, summary_raw = await pipe.execute()
+            if legacy_exists and await _amigrate_legacy_session(phone_no):
+                pipe = async_redis_client.pipeline(transaction=False)
+                _queue_context_read(pipe, phone_no)
+                recent_messages, total_messages, _, history_blob, summary_raw = await pipe.execute()
+
+            summary = parse_summary(summary_raw)
+            history = None
+            if needs_history(summary, total_messages):
+                if history_blob:
+                    history = json.loads(history_blob)
+                else:
+                    history = (await aload_previous_conversations_to_redis(phone_no, refresh=True)).get("history")
+
+            first_index = total_messages - len(recent_messages)
+            catch_up = first_unread(summary, total_messages, len(recent_messages))
+            if catch_up is not None:
+                recent_messages = (await async_redis_client.lrange(_session_keys(phone_no)["messages"], catch_up, first_index - 1)) + recent_messages
+                first_index = catch_up
+
+            result, summary_update = _chat_context_result(phone_no, recent_messages, first_index, total_messages, history, summary)
+            if summary_update:
+                pipe = async_redis_client.pipeline(transaction=False)
+                _queue_summary_write(pipe, phone_no, summary_update)
+                await pipe.execute()
+            return result
+
+        return {
+            "success": True,
+            "phone_no": phone_no,
+            "message": "Chat history updated"
+        }
+
+    except Exception as e:
+        print(f"Error managing chat history: {e}")
+        return {
+            "success": False,
+            "message": f"Error: {str(e)}"
+        }
+
+
+async def _amigrate_legacy_session(phone_no: str) -> bool:
+    """Async _migrate_legacy_session"""
+    legacy_key = _session_keys(phone_no)["legacy"]
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(legacy_key)
+            legacy_blob = await pipe.get(legacy_key)
+            if not legacy_blob:
+                return False
+            pipe.multi()
+            _queue_session_prepend(pipe, phone_no, json.loads(legacy_blob))
+            pipe.delete(legacy_key, summary_key(phone_no))
+            await pipe.execute()
+            return True
+        except redis.WatchError:
+            return False
+
+
+# ======================
+# PRODUCT FUNCTIONS
+# ======================
+
+async def aget_products(product_name: Optional[str] = None) -> Dict[str, Any]:
+    """Async get_products"""
+    try:
+        results = product_catalog.lookup(product_name)
+
+        if results is None:
+            generation = product_catalog.generation()
+            async with get_async_db_connection() as conn:
+                catalog_rows = await conn.fetch(CATALOG_QUERY)
+
+            product_catalog.load(catalog_rows, generation)
+            results = filter_catalog_rows(catalog_rows, product_name)
+
+        return _products_result(results, product_name)
+
+    except Exception as e:
+        print(f"Error getting products: {e}")
+        return {
+            "found": False,
+            "message": f"Error retrieving products: {str(e)}",
+            "products": []
+        }
+
+
+async def aretrieve_products(message: str, product_name: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+    """Async retrieve_products"""
+    try:
+        retrieved = product_catalog.retrieve(message, product_name, limit)
+
+        if retrieved is None:
+            generation = product_catalog.generation()
+            async with get_async_db_connection() as conn:
+                catalog_rows = await conn.fetch(CATALOG_QUERY)
+
+            product_catalog.load(catalog_rows, generation)
+            retrieved = product_catalog.retrieve(message, product_name, limit) or _retrieve_uncached(catalog_rows, message, product_name, limit)
+
+        return _retrieved_result(retrieved, product_name)
+
+    except Exception as e:
+        print(f"Error retrieving products: {e}")
+        return {
+            "found": False,
+            "message": f"Error retrieving products: {str(e)}",
+            "products": []
+        }
+
+
+# ======================
+# CUSTOMER FUNCTIONS
+# ======================
+
+async def _acached_customer(phone_no: str) -> Optional[Dict[str, Any]]:
+    """Async _cached_customer"""
+    customer = customer_cache.get(phone_no)
+    if customer:
+        return customer
+
+    try:
+        cached = await async_redis_client.get(customer_key(phone_no))
+    except Exception as e:
+        print(f"Error reading customer cache: {e}")
+        return None
+    if not cached:
+        return None
+
+    customer = json.loads(cached)
+    customer_cache.put(customer)
+    customer_cache.record("redis_hits")
+    return customer
+
+
+async def _acache_customer(customer: Dict[str, Any]):
+    """Async _cache_customer"""
+    customer_cache.put(customer)
+    try:
+        await async_redis_client.set(customer_key(customer["phone_no"]), json.dumps({"phone_no": customer["phone_no"], "customer_name": customer["customer_name"]}), ex=CUSTOMER_CACHE_TTL)
+    except Exception as e:
+        print(f"Error writing customer cache: {e}")
+
+
+async def _alookup_customer(conn, phone_no: str) -> Optional[Dict[str, Any]]:
+    """Async _lookup_customer"""
+    customer = await _acached_customer(phone_no)
+    if customer:
+        return customer
+
+    customer_cache.record("db_reads")
+    row = await conn.fetchrow("SELECT phone_no, customer_name FROM customers WHERE phone_no = $1", phone_no)
+    if not row:
+        return None
+
+    customer = {"phone_no": row[0], "customer_name": row[1]}
+    await _acache_customer(customer)
+    return customer
+
+
+async def _aget_or_create_customer(conn, phone_no: str, customer_name: str = None) -> Dict[str, Any]:
+    """Get or create a customer on the caller's connection (caller owns the transaction, then caches a created one)"""
+    customer = await _alookup_customer(conn, phone_no)
+
+    if customer:
+        return {
+            "found": True,
+            "phone_no": customer["phone_no"],
+            "customer_name": customer["customer_name"]
+        }
+
+    if customer_name:
+        await conn.execute("""
+            INSERT INTO customers (phone_no, customer_name)
+            VALUES ($1, $2)
+        """, phone_no, customer_name)
+        return {
+            "found": True,
+            "phone_no": phone_no,
+            "customer_name": customer_name,
+            "created": True
+        }
+
+    return {
+        "found": False,
+        "message": "Customer not found and no name provided for creation"
+    }
+
+
+async def aget_or_create_customer(phone_no: str, customer_name: str = None) -> Dict[str, Any]:
+    """Async get_or_create_customer"""
+    try:
+        customer = await _acached_customer(phone_no)
+        if customer:
+            return {
+                "found": True,
+                "phone_no": customer["phone_no"],
+                "customer_name": customer["customer_name"]
+            }
+
+        async with get_async_db_connection() as conn:
+            customer_result = await _aget_or_create_customer(conn, phone_no, customer_name)
+        if customer_result.get("created"):
+            await _acache_customer(customer_result)
+        return customer_result
+
+    except Exception as e:
+        print(f"Error with customer: {e}")
+        return {
+            "found": False,
+            "message": f"Error: {str(e)}"
+        }
+
+
+# ======================
+# ORDER FUNCTIONS
+# ======================
+
+async def acheck_order_status(phone_no: str, customer_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Async check_order_status"""
+    try:
+        async with get_async_db_connection() as conn:
+            customer = _known_customer(phone_no, customer_data) or await _alookup_customer(conn, phone_no)
+
+            if not customer:
+                return {
+                    "found": False,
+                    "message": f"No customer found with phone number {phone_no}"
+                }
+
+            orders = await conn.fetch("""
+                SELECT
+                    o.order_id,
+                    o.quantity,
+                    o.order_date,
+                    o.status,
+                    p.product_name,
+                    p.size,
+                    p.price
+                FROM orders o
+                JOIN products p ON o.product_id = p.product_id
+                WHERE o.phone_no = $1
+                ORDER BY o.order_date DESC
+            """, phone_no)
+
+        return _order_status_result(customer, orders)
+
+    except Exception as e:
+        print(f"Error checking order status: {e}")
+        return {
+            "found": False,
+            "message": f"Error checking orders: {str(e)}"
+        }
+
+
+async def aplace_order(phone_no: str, product_name: str, size: str, quantity: int = 1, customer_name: str = None, customer_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Async place_order"""
+    # Units taken from the Redis counter (INVENTORY_MODE=redis), given back if the order doesn't commit
+    reserved = None
+    try:
+        async with get_async_db_connection() as conn:
+            async with conn.transaction():
+                customer_result = _known_customer(phone_no, customer_data)
+                if customer_result:
+                    customer_result["found"] = True
+                else:
+                    customer_result = await _aget_or_create_customer(conn, phone_no, customer_name)
+                if not customer_result["found"]:
+                    return {
+                        "success": False,
+                        "message": customer_result["message"]
+                    }
+
+                match = await _abest_product_match(conn, product_name, size)
+                if not match:
+                    return {
+                        "success": False,
+                        "message": f"Product '{product_name}' with size '{size}' not found"
+                    }
+
+                if redis_inventory_enabled():
+                    result = await _aplace_reserved_order(conn, phone_no, product_name, size, quantity, match)
+                    if not result["success"]:
+                        return result
+                    reserved = (match[0], quantity)
+                    placed = (result["order_id"],) + result["product"]
+                else:
+                    # One statement: conditional decrement + order insert (see place_order)
+                    placed = await conn.fetchrow("""
+                        WITH reserved AS (
+                            UPDATE products
+                            SET stock_quantity = stock_quantity - $1
+                            WHERE product_id = $2 AND stock_quantity >= $1
+                            RETURNING product_id, product_name, size, price, stock_quantity
+                        ), placed AS (
+                            INSERT INTO orders (phone_no, product_id, quantity)
+                            SELECT $3, product_id, $1 FROM reserved
+                            RETURNING order_id
+                        )
+                        SELECT placed.order_id, reserved.product_id, reserved.product_name, reserved.size, reserved.price, reserved.stock_quantity
+                        FROM placed, reserved
+                    """, quantity, match[0], phone_no)
+
+                if not placed:
+                    stock = await conn.fetchval("SELECT stock_quantity FROM products WHERE product_id = $1", match[0])
+                    if stock is None:
+                        return {
+                            "success": False,
+                            "message": f"Product '{product_name}' with size '{size}' not found"
+                        }
+                    return {
+                        "success": False,
+                        "message": f"Insufficient stock. Available: {stock}, Requested: {quantity}"
+                    }
+
+                order_id, product, new_stock = placed[0], tuple(placed)[1:], placed[5]
+
+        product_catalog.set_stock(product[0], new_stock)
+        if customer_result.get("created"):
+            await _acache_customer(customer_result)
+        return _order_placed_result(order_id, customer_result["customer_name"], phone_no, product, quantity)
+
+    except Exception as e:
+        if reserved:
+            await arelease_stock(*reserved)
+        print(f"Error placing order: {e}")
+        return {
+            "success": False,
+            "message": f"Error placing order: {str(e)}"
+        }
+
+
+async def _aplace_reserved_order(conn, phone_no: str, product_name: str, size: str, quantity: int, match) -> Dict[str, Any]:
+    """Async _place_reserved_order (runs inside aplace_order's transaction, which releases the units if it fails)"""
+    reservation = await areserve_stock(match[0], quantity)
+    if not reservation["found"]:
+        return {
+            "success": False,
+            "message": f"Product '{product_name}' with size '{size}' not found"
+        }
+    if not reservation["reserved"]:
+        return {
+            "success": False,
+            "message": f"Insufficient stock. Available: {reservation['stock']}, Requested: {quantity}"
+        }
+
+    try:
+        order_id = await conn.fetchval("""
+            INSERT INTO orders (phone_no, product_id, quantity)
+            VALUES ($1, $2, $3)
+            RETURNING order_id
+        """, phone_no, match[0], quantity)
+    except Exception:
+        # aplace_order only knows about the reservation once this returns
+        await arelease_stock(match[0], quantity)
+        raise
+
+    return {
+        "success": True,
+        "order_id": order_id,
+        "product": (match[0], match[1], match[2], match[3], reservation["stock"]),
+        "stock": reservation["stock"]
+    }
+
+
+async def _abest_product_match(conn, product_name: str, size: str):
+    """Async _best_product_match"""
+    matches = product_catalog.search(product_name, size=size, limit=1)
+
+    if matches is None:
+        generation = product_catalog.generation()
+        catalog_rows = await conn.fetch(CATALOG_QUERY)
+        if product_catalog.load(catalog_rows, generation):
+            matches = product_catalog.search(product_name, size=size, limit=1)
+        else:
+            matches = search_rows(catalog_rows, ProductSearchIndex(catalog_rows), product_name, size, limit=1)
+
+    return matches[0] if matches else None
+
+
+# ======================
+# RETURN FUNCTIONS
+# ======================
+
+async def aprocess_return(phone_no: str, order_id: Optional[int] = None, reason: str = "Customer request", customer_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Async process_return"""
+    try:
+        async with get_async_db_connection() as conn:
+            async with conn.transaction():
+                customer = _known_customer(phone_no, customer_data) or await _alookup_customer(conn, phone_no)
+
+                if not customer:
+                    return {
+                        "success": False,
+                        "message": f"No customer found with phone number {phone_no}"
+                    }
+
+                if not order_id:
+                    order_id = await conn.fetchval("""
+                        SELECT order_id FROM orders
+                        WHERE phone_no = $1
+                        ORDER BY order_date DESC
+                        LIMIT 1
+                    """, phone_no)
+                    if not order_id:
+                        return {
+                            "success": False,
+                            "message": "No recent orders found for return"
+                        }
+
+                order = await conn.fetchrow("""
+                    SELECT o.order_id, o.quantity, o.status, o.product_id, p.product_name, p.size, p.price
+                    FROM orders o
+                    JOIN products p ON o.product_id = p.product_id
+                    WHERE o.order_id = $1 AND o.phone_no = $2
+                """, order_id, phone_no)
+
+                if not order:
+                    return {
+                        "success": False,
+                        "message": f"Order {order_id} not found for this customer"
+                    }
+
+                return_id = await conn.fetchval("""
+                    INSERT INTO returns (order_id, phone_no, reason)
+                    VALUES ($1, $2, $3)
+                    RETURNING return_id
+                """, order_id, phone_no, reason)
+
+                new_stock = None
+                if redis_inventory_enabled():
+                    await arecord_stock_release(conn, return_id, order[3], order[1])
+                else:
+                    new_stock = await conn.fetchval("""
+                        UPDATE products
+                        SET stock_quantity = stock_quantity + $1
+                        WHERE product_id = $2
+                        RETURNING stock_quantity
+                    """, order[1], order[3])  # quantity, product_id
+
+        if redis_inventory_enabled():
+            try:
+                new_stock = await arelease_returned_stock(return_id, order[3], order[1])
+            except Exception as e:
+                record_release_failure(return_id, e)
+        if new_stock is not None:
+            product_catalog.set_stock(order[3], new_stock)
+        return _return_result(return_id, order, reason)
+
+    except Exception as e:
+        print(f"Error processing return: {e}")
+        return {
+            "success": False,
+            "message": f"Error processing return: {str(e)}"
+        }
+
+
+# ======================
+# EXTERNAL API FUNCTIONS
+# ======================
+
+async def acompare_products_serper(query: str) -> Dict[str, Any]:
+    """Async compare_products_serper"""
+    try:
+        serper_key = os.getenv('SERPER_API_KEY')
+
+        if not serper_key:
+            return {
+                "success": False,
+                "message": "Product comparison service is currently unavailable"
+            }
+
+        headers = {
+            'X-API-KEY': serper_key,
+            'Content-Type': 'application/json'
+        }
+
+        with timed_hop("serper"):
+            response = await async_http_client.get().post(SERPER_URL, headers=headers, json=_serper_payload(query))
+            data = response.json()
+
+        return _serper_result(query, data)
+
+    except Exception as e:
+        print(f"Error in product comparison: {e}")
+        return {
+            "success": False,
+            "message": f"Error: {str(e)}"
+        }
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import statistics
+
+from dotenv import load_dotenv
+
+from benchmark_product_search import make_catalog
+from catalog_cache import retrieve_rows
+from product_search import ProductSearchIndex
+from token_budget import estimate_tokens, take_within_budget
+
+load_dotenv()
+
+TOP_K = int(os.getenv("PRODUCT_RETRIEVAL_TOP_K", "20"))
+TOKEN_BUDGET = int(os.getenv("PRODUCT_PROMPT_TOKEN_BUDGET", "800"))
+
+MESSAGES = [
+    "Do you have nike running shoes in 42?",
+    "How much are the airpods pro?",
+    "show me your levi's jeans",
+    "I'm looking for an ultra smart watch",
+    "What products do you have?",
+    "hello",
+]
+
+
+def _block(row):
+    """One product as ProductDetailsAgent lists it in the system prompt"""
+    status = "✅ Available" if row[4] > 0 else "❌ Out of Stock"
+    return f"• {row[1]} ({row[2]})\n  Price: ${row[3]:.2f}\n  Stock: {row[4]} units {status}\n\n"
+
+
+def full_listing(rows, message):
+    """Before: every in-stock product, whatever the message"""
+    return "".join(_block(row) for row in rows if row[4] > 0)
+
+
+def retrieved_listing(rows, index, message):
+    """After: the top-K products for the message, cut to the token budget"""
+    retrieved, _ = retrieve_rows(rows, index, message, limit=TOP_K)
+    blocks, _ = take_within_budget([_block(row) for row in retrieved], TOKEN_BUDGET)
+    return "".join(blocks)
+
+
+def measure(build, repeat: int):
+    """(median prompt tokens, median build ms) over MESSAGES"""
+    tokens, timings = [], []
+    for message in MESSAGES:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            listing = build(message)
+            samples.append((time.perf_counter() - start) * 1000)
+        tokens.append(estimate_tokens(listing))
+        timings.append(statistics.median(samples))
+    return statistics.median(tokens), statistics.median(timings), listing
+
+
+def time_gemini(listing: str) -> float:
+    """Seconds for Gemini to answer with `listing` as the product section of the prompt"""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain.schema import HumanMessage, SystemMessage
+
+    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=os.getenv("GOOGLE_API_KEY"), temperature=0.3)
+    start = time.perf_counter()
+    llm.invoke([
+        SystemMessage(content=f"You are a Product Information Specialist.\n\nAVAILABLE PRODUCTS:\n{listing}"),
+        HumanMessage(content=MESSAGES[0])
+    ])
+    return time.perf_counter() - start
+
+
+def run_benchmark(sizes=(100, 1_000, 10_000, 100_000), repeat: int = 3, with_llm: bool = False):
+    print(f"=== Catalog prompt benchmark: top {TOP_K} products, {TOKEN_BUDGET} token budget ===\n")
+    header = f"{'SKUs':>8}{'full tokens':>13}{'full ms':>10}{'top-K tokens':>14}{'top-K ms':>10}"
+    if with_llm:
+        header += f"{'full LLM s':>12}{'top-K LLM s':>13}"
+    print(header)
+
+    for size in sizes:
+        rows = make_catalog(size)
+        index = ProductSearchIndex(rows)
+
+        full_tokens, full_ms, full = measure(lambda message: full_listing(rows, message), repeat)
+        top_tokens, top_ms, retrieved = measure(lambda message: retrieved_listing(rows, index, message), repeat)
+        assert top_tokens <= TOKEN_BUDGET
+
+        line = f"{size:>8,}{full_tokens:>13,}{full_ms:>10.2f}{top_tokens:>14,}{top_ms:>10.2f}"
+        if with_llm:
+            # Gemini rejects prompts past its context window; report those as failures
+            try:
+                full_llm = f"{time_gemini(full):>12.2f}"
+            except Exception as e:
+                print(f"Error timing full prompt: {e}")
+                full_llm = f"{'failed':>12}"
+            line += f"{full_llm}{time_gemini(retrieved):>13.2f}"
+        print(line)
+
+    print("\nFull-catalog prompts grow with the catalog; retrieved prompts stay under the budget.")
+
+
+if __name__ == "__main__":
+    # python benchmark_catalog_prompt.py [llm]   (llm: also time Gemini, needs GOOGLE_API_KEY)
+    run_benchmark(with_llm="llm" in sys.argv[1:])
@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+
+from product_search import ProductSearchIndex
+
+BRANDS = ['Nike', 'Puma', 'Adidas', "Levi's", 'Apple', 'Samsung', 'Sony', 'Reebok', 'Asics', 'Xiaomi',
+          'New Balance', 'Under Armour', 'Lenovo', 'Dell', 'Canon', 'Bose', 'Fossil', 'Casio', 'Vans', 'Converse']
+PRODUCTS = ['Running Shoes', 'T-Shirt', 'Hoodie', 'Jeans', 'Track Pants', 'Sneakers', 'Backpack', 'Cap',
+            'iPhone', 'MacBook', 'iPad', 'AirPods', 'Headphones', 'Smart Watch', 'Laptop', 'Camera', 'Jacket']
+EDITIONS = ['Pro', 'Max', 'Air', 'Lite', 'Classic', 'Sport', 'Ultra', 'Plus', 'Mini', 'Edge']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', '40', '41', '42', '43', '44', '64GB', '128GB', '256GB']
+
+QUERIES = ['nike', 'running shoes', 'levi', 'iphone 15', 'macbook air', 'airpods pro', 'ultra',
+           'hoodie', 'xl', 'zz', 'nothing matches this', 'samsung smart watch']
+
+
+def make_catalog(size: int, seed: int = 7):
+    """Synthetic catalog rows (product_id, product_name, size, price, stock_quantity), ordered like CATALOG_QUERY"""
+    rng = random.Random(seed)
+    rows = []
+    for product_id in range(1, size + 1):
+        name = f"{rng.choice(BRANDS)} {rng.choice(PRODUCTS)} {rng.choice(EDITIONS)} {rng.randint(1, 40)}"
+        rows.append((product_id, name, rng.choice(SIZES), round(rng.uniform(5, 2500), 2), rng.randint(0, 200)))
+    rows.sort(key=lambda row: (row[1], row[2], row[3]))
+    return rows
+
+
+def linear_search(rows, term):
+    """What LOWER(product_name) LIKE LOWER('%term%') does: test every row"""
+    term = term.lower()
+    return [i for i, row in enumerate(rows) if term in row[1].lower()]
+
+
+def time_queries(fn, repeat: int):
+    timings = {}
+    for query in QUERIES:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(query)
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[query] = statistics.median(samples)
+    return timings
+
+
+def run_benchmark(catalog_size: int = 100_000, repeat: int = 5):
+    print(f"=== Product search benchmark: {catalog_size:,} SKUs ===\n")
+    rows = make_catalog(catalog_size)
+
+    start = time.perf_counter()
+    index = ProductSearchIndex(rows)
+    print(f"Index build: {(time.perf_counter() - start) * 1000:.1f} ms\n")
+
+    # Same answers as the LIKE scan, in the same order
+    for query in QUERIES:
+        assert index.find(query) == linear_search(rows, query), query
+
+    linear = time_queries(lambda q: linear_search(rows, q), repeat)
+    indexed = time_queries(lambda q: index.search(q), repeat)
+
+    print(f"{'query':<24}{'matches':>9}{'scan ms':>10}{'index ms':>10}{'speedup':>9}")
+    for query in QUERIES:
+        speedup = linear[query] / indexed[query] if indexed[query] else float('inf')
+        print(f"{query:<24}{len(index.find(query)):>9}{linear[query]:>10.2f}{indexed[query]:>10.2f}{speedup:>8.1f}x")
+
+    total_linear = sum(linear.values())
+    total_indexed = sum(indexed.values())
+    print(f"\nTotal: scan {total_linear:.1f} ms, index (ranked) {total_indexed:.1f} ms, {total_linear / total_indexed:.1f}x faster")
+
+    best = index.search('nike running shoes', limit=1)
+    print(f"Best match for 'nike running shoes': {rows[best[0]][1] if best else None}")
+    typo = index.search('addidas hodie', limit=1, fuzzy=True)
+    print(f"Fuzzy match for 'addidas hodie': {rows[typo[0]][1] if typo else None}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Thousands of queued orders wait for a handful of connections; don't time them out
+os.environ.setdefault('DB_POOL_TIMEOUT', '60')
+
+import psycopg2
+from dotenv import load_dotenv
+
+from functions import place_order
+from async_functions import aplace_order
+from catalog_cache import product_catalog
+from db_pool import async_db_pool
+from stock_reservation import redis_inventory_enabled, flush_pending_stock, stock_redis, stock_key, INVENTORY_MODE
+
+load_dotenv()
+
+BENCHMARK_PHONE = "+19990000013"
+BENCHMARK_SIZE = "BENCH"
+
+
+def _setup(stock: int):
+    """Create a throwaway SKU with `stock` units and a customer to buy it"""
+    product_name = f"Flash Sale SKU {uuid.uuid4().hex[:8]}"
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO customers (phone_no, customer_name)
+        SELECT %s, 'Benchmark Buyer'
+        WHERE NOT EXISTS (SELECT 1 FROM customers WHERE phone_no = %s)
+    """, (BENCHMARK_PHONE, BENCHMARK_PHONE))
+    cursor.execute("""
+        INSERT INTO products (product_name, size, price, stock_quantity)
+        VALUES (%s, %s, %s, %s)
+        RETURNING product_id
+    """, (product_name, BENCHMARK_SIZE, 9.99, stock))
+    product_id = cursor.fetchone()[0]
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    # The new SKU must be visible to the order path's product search
+    product_catalog.invalidate()
+    return product_id, product_name
+
+
+def _results(product_id: int):
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    cursor = conn.cursor()
+    cursor.execute("SELECT stock_quantity FROM products WHERE product_id = %s", (product_id,))
+    final_stock = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM orders WHERE product_id = %s", (product_id,))
+    order_rows, units_ordered = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return final_stock, order_rows, units_ordered
+
+
+def _cleanup(product_id: int):
+    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM orders WHERE product_id = %s", (product_id,))
+    cursor.execute("DELETE FROM products WHERE product_id = %s", (product_id,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    product_catalog.invalidate()
+    stock_redis.delete(stock_key(product_id))
+
+
+async def _fire_async(product_name: str, orders: int):
+    customer_data = {"found": True, "phone_no": BENCHMARK_PHONE, "customer_name": "Benchmark Buyer"}
+    try:
+        return await asyncio.gather(*[
+            aplace_order(BENCHMARK_PHONE, product_name, BENCHMARK_SIZE, 1, customer_data=customer_data)
+            for _ in range(orders)
+        ])
+    finally:
+        # The pool belongs to this event loop
+        await async_db_pool.close()
+
+
+def _fire_threads(product_name: str, orders: int, threads: int):
+    customer_data = {"found": True, "phone_no": BENCHMARK_PHONE, "customer_name": "Benchmark Buyer"}
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [
+            executor.submit(place_order, BENCHMARK_PHONE, product_name, BENCHMARK_SIZE, 1, customer_data=customer_data)
+            for _ in range(orders)
+        ]
+        return [future.result() for future in futures]
+
+
+def run_benchmark(orders: int = 2000, stock: int = 500, mode: str = "async", threads: int = 64):
+    print(f"=== Stock contention benchmark: {orders} concurrent orders for {stock} units ({mode}, INVENTORY_MODE={INVENTORY_MODE}) ===\n")
+    product_id, product_name = _setup(stock)
+
+    try:
+        start = time.perf_counter()
+        if mode == "async":
+            results = asyncio.run(_fire_async(product_name, orders))
+        else:
+            results = _fire_threads(product_name, orders, threads)
+        elapsed = time.perf_counter() - start
+        if redis_inventory_enabled():
+            # Write the Redis counters' deltas behind before checking Postgres
+            flush_pending_stock()
+
+        placed = sum(1 for result in results if result.get("success"))
+        rejected = sum(1 for result in results if not result.get("success") and "Insufficient stock" in result.get("message", ""))
+        errors = len(results) - placed - rejected
+        final_stock, order_rows, units_ordered = _results(product_id)
+        oversold = max(0, units_ordered - stock)
+
+        print(f"Elapsed:          {elapsed:.2f} s")
+        print(f"Throughput:       {orders / elapsed:.0f} orders/sec")
+        print(f"Placed:           {placed}")
+        print(f"Sold out replies: {rejected}")
+        print(f"Errors:           {errors}")
+        print(f"Final stock:      {final_stock}")
+        print(f"Order rows:       {order_rows} ({units_ordered} units)")
+        print(f"Oversold units:   {oversold}")
+
+        consistent = final_stock == stock - units_ordered and final_stock >= 0 and order_rows == placed
+        if oversold == 0 and consistent:
+            print("\n✅ No oversells; stock and orders agree")
+        else:
+            print("\n❌ Stock and orders disagree")
+    finally:
+        _cleanup(product_id)
+
+
+if __name__ == "__main__":
+    # [INVENTORY_MODE=redis] python benchmark_stock_contention.py [orders] [stock] [async|sync]
+    args = sys.argv[1:]
+    run_benchmark(
+        orders=int(args[0]) if len(args) > 0 else 2000,
+        stock=int(args[1]) if len(args) > 1 else 500,
+        mode=args[2] if len(args) > 2 else "async"
+    )
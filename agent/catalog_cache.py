@@ -0,0 +1,245 @@
+import os
+import json
+import heapq
+import select
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+from product_search import ProductSearchIndex
+
+load_dotenv()
+
+# Safety net for changes made outside place_order/process_return when NOTIFY is not set up
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '300'))
+# Channel fed by migrations/001_catalog_notify.sql; empty disables the listener
+CATALOG_NOTIFY_CHANNEL = os.getenv('CATALOG_NOTIFY_CHANNEL', '')
+
+# (product_id, product_name, size, price, stock_quantity), the row shape get_products returns
+ProductRow = Tuple[int, str, str, float, int]
+
+
+CATALOG_QUERY = """
+    SELECT product_id, product_name, size, price, stock_quantity
+    FROM products
+    ORDER BY product_name, size, price
+"""
+
+
+def filter_catalog_rows(rows: List[ProductRow], product_name: Optional[str] = None) -> List[ProductRow]:
+    """Apply get_products' filter to catalog rows already ordered by name, size, price"""
+    if product_name:
+        # Same as LOWER(product_name) LIKE LOWER('%term%')
+        term = product_name.lower()
+        return [row for row in rows if term in row[1].lower()]
+    # Same as WHERE stock_quantity > 0
+    return [row for row in rows if row[4] > 0]
+
+
+def search_rows(rows: List[ProductRow], search_index: ProductSearchIndex, product_name: str, size: Optional[str] = None, limit: Optional[int] = None, fuzzy: bool = False) -> List[ProductRow]:
+    """Ranked name search over catalog rows, optionally restricted to one size (case-insensitive)"""
+    positions = search_index.search(product_name, fuzzy=fuzzy)
+    if size is not None:
+        size = size.lower()
+        positions = [position for position in positions if str(rows[position][2]).lower() == size]
+    if limit:
+        positions = positions[:limit]
+    return [rows[position] for position in positions]
+
+
+def retrieve_rows(rows: List[ProductRow], search_index: ProductSearchIndex, message: str, product_name: Optional[str] = None, limit: int = 20) -> Tuple[List[ProductRow], int]:
+    """The `limit` products most relevant to a customer message, and how many were candidates.
+
+    Candidates are the names containing `product_name` when given, else every product the
+    message's words match, else (nothing to go on) the in-stock catalog like get_products().
+    Best score first, in stock before out of stock, then catalog order."""
+    scores = search_index.score(message)
+    if product_name:
+        positions = search_index.find(product_name)
+    elif scores:
+        positions = list(scores)
+    else:
+        positions = [position for position, row in enumerate(rows) if row[4] > 0]
+
+    best = heapq.nsmallest(limit, positions, key=lambda position: (-scores.get(position, 0.0), rows[position][4] <= 0, position))
+    return [rows[position] for position in best], len(positions)
+
+
+class ProductCatalogCache:
+    """Versioned in-process copy of the products table.
+
+    Holds every product row (in and out of stock) so both the full-catalog and the
+    name-filtered get_products reads are served from memory. Stock changes made by
+    this process patch rows in place; everything else invalidates."""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+
+        self._lock = threading.Lock()
+        self._rows: Optional[List[ProductRow]] = None
+        self._index: Dict[int, int] = {}
+        self._search_index: Optional[ProductSearchIndex] = None
+        self._loaded_at = 0.0
+        # Bumped by every patch/invalidation; a load that raced with one is not installed
+        self._generation = 0
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "loads": 0,
+            "stale_loads": 0,
+            "patches": 0,
+            "invalidations": 0
+        }
+
+    def _is_fresh(self) -> bool:
+        return self._rows is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def generation(self) -> int:
+        """Token to pass to load() so a load that raced with a write is discarded"""
+        with self._lock:
+            return self._generation
+
+    def _snapshot(self):
+        with self._lock:
+            if not self._is_fresh():
+                self._stats["misses"] += 1
+                return None, None
+            self._stats["hits"] += 1
+            return self._rows, self._search_index
+
+    def lookup(self, product_name: Optional[str] = None) -> Optional[List[ProductRow]]:
+        """Rows matching get_products(product_name), or None on a cache miss"""
+        rows, search_index = self._snapshot()
+        if rows is None:
+            return None
+
+        if product_name:
+            # Trigram index instead of a LIKE '%term%' scan; positions keep catalog order
+            return [rows[position] for position in search_index.find(product_name)]
+        return filter_catalog_rows(rows)
+
+    def search(self, product_name: str, size: Optional[str] = None, limit: Optional[int] = None, fuzzy: bool = False) -> Optional[List[ProductRow]]:
+        """Rows whose name matches, best match first (optionally only one size), or None on a cache miss"""
+        rows, search_index = self._snapshot()
+        if rows is None:
+            return None
+        return search_rows(rows, search_index, product_name, size, limit, fuzzy)
+
+    def retrieve(self, message: str, product_name: Optional[str] = None, limit: int = 20) -> Optional[Tuple[List[ProductRow], int]]:
+        """retrieve_rows over the cached catalog, or None on a cache miss"""
+        rows, search_index = self._snapshot()
+        if rows is None:
+            return None
+        return retrieve_rows(rows, search_index, message, product_name, limit)
+
+    def load(self, rows: List[Any], generation: int) -> bool:
+        """Install a fresh snapshot (rows ordered by product_name, size, price)"""
+        snapshot = [(row[0], row[1], row[2], float(row[3]), row[4]) for row in rows]
+        # Built outside the lock; names never change through set_stock, so it stays valid until the next load
+        search_index = ProductSearchIndex(snapshot)
+        with self._lock:
+            if generation != self._generation:
+                self._stats["stale_loads"] += 1
+                return False
+            self._rows = snapshot
+            self._index = {row[0]: i for i, row in enumerate(snapshot)}
+            self._search_index = search_index
+            self._loaded_at = time.monotonic()
+            self.version += 1
+            self._stats["loads"] += 1
+            return True
+
+    def set_stock(self, product_id: int, stock_quantity: int):
+        """Patch one product's stock after a committed order or return"""
+        with self._lock:
+            self._generation += 1
+            position = self._index.get(product_id)
+            if self._rows is None or position is None:
+                return
+            row = self._rows[position]
+            # Copy-on-write so readers holding the previous list never see a torn update
+            rows = list(self._rows)
+            rows[position] = (row[0], row[1], row[2], row[3], stock_quantity)
+            self._rows = rows
+            self.version += 1
+            self._stats["patches"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._rows = None
+            self._index = {}
+            self._search_index = None
+            self.version += 1
+            self._stats["invalidations"] += 1
+
+    def apply_notification(self, payload: str):
+        """Handle a catalog NOTIFY: a stock patch when the payload has one, otherwise invalidate"""
+        try:
+            change = json.loads(payload) if payload else {}
+        except ValueError:
+            change = {}
+
+        if change.get("op") == "UPDATE" and "product_id" in change and "stock_quantity" in change:
+            self.set_stock(change["product_id"], change["stock_quantity"])
+        else:
+            self.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["version"] = self.version
+            stats["cached_products"] = len(self._rows) if self._rows is not None else 0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+product_catalog = ProductCatalogCache()
+
+
+def _listen_for_catalog_changes(channel: str):
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+            # Anything may have changed while we were not listening
+            product_catalog.invalidate()
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    product_catalog.apply_notification(notify.payload)
+
+        except Exception as e:
+            print(f"Catalog listener error: {e}")
+            product_catalog.invalidate()
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start_catalog_listener(channel: str = CATALOG_NOTIFY_CHANNEL) -> Optional[threading.Thread]:
+    """Keep the cache in sync with writes from other processes via Postgres LISTEN/NOTIFY"""
+    if not channel:
+        return None
+    thread = threading.Thread(target=_listen_for_catalog_changes, args=(channel,), name="catalog-listener", daemon=True)
+    thread.start()
+    return thread
+
+
+def catalog_cache_stats() -> Dict[str, Any]:
+    return product_catalog.stats()
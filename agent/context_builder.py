@@ -0,0 +1,170 @@
+import os
+import re
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from token_budget import estimate_tokens
+
+load_dotenv()
+
+# Most messages quoted verbatim as chat context
+CONTEXT_WINDOW = int(os.getenv('CONTEXT_WINDOW', '10'))
+# Prompt tokens for chat context: the summary of older messages plus the recent ones verbatim
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '600'))
+# Share of the budget held by the summary; its oldest lines roll off past it
+CONTEXT_SUMMARY_TOKENS = int(os.getenv('CONTEXT_SUMMARY_TOKENS', '200'))
+# Long replies (product lists...) are cut to this many characters when quoted verbatim
+CONTEXT_MESSAGE_MAX_CHARS = int(os.getenv('CONTEXT_MESSAGE_MAX_CHARS', '500'))
+# A summary line keeps the first sentence of a message, up to this many characters
+CONTEXT_SUMMARY_LINE_CHARS = int(os.getenv('CONTEXT_SUMMARY_LINE_CHARS', '120'))
+
+# Most session messages read to catch the summary up in one turn (e.g. the first turn of a long session)
+_MAX_CATCH_UP = 200
+
+# Emojis, bullets and other symbols carry nothing worth summarizing
+_SYMBOLS = re.compile(r"[^\w\s.,!?'$%@#&()/:;+-]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+# ======================
+# SUMMARY STATE
+# ======================
+# chat_summary:{phone} is a hash next to the session: the summary lines, how many session
+# messages (from the start of chat_messages:{phone}) and how many messages of the stored
+# conversation (conversation:{phone}) they cover. Messages are only ever folded in once,
+# so each turn summarizes just the ones that left the verbatim part since the last turn.
+
+def summary_key(phone_no: str) -> str:
+    return f"chat_summary:{phone_no}"
+
+
+def parse_summary(raw: Optional[Dict[Any, Any]]) -> Optional[Dict[str, Any]]:
+    """The chat_summary:{phone} hash as a dict, or None when there is no summary yet"""
+    if not raw:
+        return None
+    fields = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v) for k, v in raw.items()}
+    return {
+        "lines": json.loads(fields.get("lines", "[]")),
+        "session_covered": int(fields.get("session_covered", 0)),
+        "history_covered": int(fields.get("history_covered", 0)),
+        "history_total": int(fields.get("history_total", 0))
+    }
+
+
+def summary_fields(summary: Dict[str, Any]) -> Dict[str, str]:
+    """HSET mapping for a summary"""
+    return {
+        "lines": json.dumps(summary["lines"]),
+        "session_covered": str(summary["session_covered"]),
+        "history_covered": str(summary["history_covered"]),
+        "history_total": str(summary["history_total"])
+    }
+
+
+def needs_history(summary: Optional[Dict[str, Any]], total_messages: int) -> bool:
+    """Whether to read the stored conversation: to start the summary, to fill a short session, or to finish folding it in"""
+    return summary is None or total_messages < CONTEXT_WINDOW or summary["history_covered"] < summary["history_total"]
+
+
+def first_unread(summary: Optional[Dict[str, Any]], total_messages: int, fetched: int) -> Optional[int]:
+    """Index of the oldest session message still to be folded that the tail read missed (None: nothing missing)"""
+    covered = summary["session_covered"] if summary else 0
+    tail_start = total_messages - fetched
+    if covered >= tail_start:
+        return None
+    return max(covered, tail_start - _MAX_CATCH_UP)
+
+# ======================
+# CONTEXT
+# ======================
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _speaker(message: Dict[str, Any]) -> str:
+    return "User" if message["sender"] == "user" else "Assistant"
+
+
+def _verbatim_line(message: Dict[str, Any], text_field: str) -> str:
+    return f"{_speaker(message)}: {_clip(message[text_field], CONTEXT_MESSAGE_MAX_CHARS)}\n"
+
+
+def summary_line(message: Dict[str, Any], text_field: str) -> str:
+    """Extractive one-liner for a message: its first sentence, without emojis"""
+    text = " ".join(_SYMBOLS.sub(" ", message[text_field]).split())
+    first_sentence = _SENTENCE_END.split(text, 1)[0]
+    return f"{_speaker(message)}: {_clip(first_sentence, CONTEXT_SUMMARY_LINE_CHARS)}"
+
+
+def _roll(lines: List[str]) -> List[str]:
+    """The newest lines that fit CONTEXT_SUMMARY_TOKENS"""
+    kept, used = [], 0
+    for line in reversed(lines):
+        tokens = estimate_tokens(f"- {line}\n")
+        if used + tokens > CONTEXT_SUMMARY_TOKENS:
+            break
+        kept.append(line)
+        used += tokens
+    return kept[::-1]
+
+
+def build_context(session_messages: List[Dict[str, Any]], first_index: int, total_messages: int, history: Optional[Dict[str, Any]], summary: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Chat context within CONTEXT_TOKEN_BUDGET, and the summary to store (None when unchanged).
+
+    `session_messages` are the session's messages from index `first_index` to the end, `history`
+    the stored previous conversation when it was read. The newest messages not yet summarized
+    are quoted verbatim while they fit; older ones are folded into the summary."""
+    history_messages = history["messages"] if history else []
+    previous = summary or {"lines": [], "session_covered": 0, "history_covered": 0, "history_total": len(history_messages)}
+
+    session_open = session_messages[max(previous["session_covered"] - first_index, 0):]
+    history_open = history_messages[previous["history_covered"]:]
+
+    # Newest first: the session, then the end of the stored conversation
+    candidates = [(message, "message") for message in reversed(session_open)]
+    candidates += [(message, "message_text") for message in reversed(history_open)]
+    verbatim, used = [], 0
+    for message, text_field in candidates[:CONTEXT_WINDOW]:
+        line = _verbatim_line(message, text_field)
+        tokens = estimate_tokens(line)
+        if used + tokens > CONTEXT_TOKEN_BUDGET - CONTEXT_SUMMARY_TOKENS:
+            break
+        verbatim.append(line)
+        used += tokens
+    kept_session = min(len(verbatim), len(session_open))
+    kept_history = len(verbatim) - kept_session
+
+    # Everything older than the verbatim part goes into the summary, stored conversation first
+    folded = [summary_line(message, "message_text") for message in history_open[:len(history_open) - kept_history]]
+    folded += [summary_line(message, "message") for message in session_open[:len(session_open) - kept_session]]
+    updated = {
+        "lines": _roll(previous["lines"] + folded) if folded else previous["lines"],
+        "session_covered": total_messages - kept_session,
+        "history_covered": len(history_messages) - kept_history if history else previous["history_covered"],
+        "history_total": len(history_messages) if history else previous["history_total"]
+    }
+
+    context_text = ""
+    if updated["lines"]:
+        context_text += "Summary of earlier messages:\n"
+        context_text += "".join(f"- {line}\n" for line in updated["lines"])
+        context_text += "\n"
+    if kept_history:
+        context_text += "Earlier conversation:\n"
+        context_text += "".join(reversed(verbatim[kept_session:]))
+        context_text += "\n"
+    if kept_session:
+        context_text += "Previous conversation:\n"
+        context_text += "".join(reversed(verbatim[:kept_session]))
+
+    context = {
+        "context": context_text,
+        "context_messages": kept_session,
+        "history_messages": kept_history,
+        "summary_lines": len(updated["lines"]),
+        "context_tokens": estimate_tokens(context_text),
+        "raw_messages": session_open[len(session_open) - kept_session:]
+    }
+    return context, (updated if updated != summary else None)
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Customers are only ever inserted, so a long TTL is safe; it bounds staleness after manual edits
+CUSTOMER_CACHE_TTL = int(os.getenv('CUSTOMER_CACHE_TTL', '900'))
+CUSTOMER_CACHE_SIZE = int(os.getenv('CUSTOMER_CACHE_SIZE', '10000'))
+
+
+def customer_key(phone_no: str) -> str:
+    """Redis key shared with the Node backend's CustomerService"""
+    return f"customer:{phone_no}"
+
+
+class CustomerCache:
+    """In-process tier of the customer read-through cache: {phone_no, customer_name} by phone.
+
+    functions.py / async_functions.py put the shared Redis tier (customer:{phone})
+    behind it and the customers table behind that."""
+
+    def __init__(self, ttl: float = CUSTOMER_CACHE_TTL, max_entries: int = CUSTOMER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # phone_no -> (customer, expires_at), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        self._stats = {
+            "hits": 0,
+            "redis_hits": 0,
+            "db_reads": 0,
+            "evictions": 0
+        }
+
+    def get(self, phone_no: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(phone_no)
+            if entry is None:
+                return None
+            customer, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[phone_no]
+                return None
+            self._entries.move_to_end(phone_no)
+            self._stats["hits"] += 1
+            return customer
+
+    def put(self, customer: Dict[str, Any]):
+        record = {"phone_no": customer["phone_no"], "customer_name": customer["customer_name"]}
+        with self._lock:
+            self._entries[record["phone_no"]] = (record, time.monotonic() + self.ttl)
+            self._entries.move_to_end(record["phone_no"])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, phone_no: str):
+        with self._lock:
+            self._entries.pop(phone_no, None)
+
+    def record(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["redis_hits"] + stats["db_reads"]
+        stats["hit_rate"] = round((stats["hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+customer_cache = CustomerCache()
+
+
+def customer_cache_stats() -> Dict[str, Any]:
+    return customer_cache.stats()
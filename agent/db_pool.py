@@ -0,0 +1,295 @@
+import os
+import asyncio
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any
+
+import asyncpg
+import psycopg2
+from psycopg2 import extensions, pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pool sizing is per worker process: total DB connections = workers * DB_POOL_MAX
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+# Connections idle for longer than this are pinged before being handed out (0 = always ping)
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', '30'))
+
+
+class PoolTimeoutError(pool.PoolError):
+    """Raised when no connection becomes available within DB_POOL_TIMEOUT"""
+
+
+class DatabasePool:
+    """Thread-safe PostgreSQL connection pool with checkout health checks and wait metrics"""
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+
+        self._pool = None
+        self._init_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # psycopg2's pool raises instead of blocking when exhausted, so callers queue here
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._returned_at = {}
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "in_use": 0
+        }
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, self.dsn)
+        return self._pool
+
+    def _is_healthy(self, conn) -> bool:
+        """Check a connection before handing it out"""
+        if conn.closed:
+            return False
+
+        idle_for = time.monotonic() - self._returned_at.get(id(conn), 0)
+        if idle_for < self.ping_after:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _checkout(self):
+        db_pool = self._get_pool()
+        # One retry per slot: a burst of dead connections after a DB restart gets replaced
+        for _ in range(self.maxconn + 1):
+            conn = db_pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._stats_lock:
+                self._stats["health_check_failures"] += 1
+            self._returned_at.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+        raise pool.PoolError("Could not obtain a healthy database connection")
+
+    def _release(self, conn):
+        discard = conn.closed
+        if not discard and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard:
+            self._returned_at.pop(id(conn), None)
+        else:
+            self._returned_at[id(conn)] = time.monotonic()
+        self._get_pool().putconn(conn, close=discard)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; uncommitted work is rolled back when it is returned"""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeoutError(f"Timed out after {self.timeout}s waiting for a database connection")
+
+        waited_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_time_total_ms"] += waited_ms
+            self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], waited_ms)
+            if waited_ms >= 1:
+                self._stats["waits"] += 1
+
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        finally:
+            if conn is not None:
+                self._release(conn)
+            with self._stats_lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg_ms"] = round(stats["wait_time_total_ms"] / checkouts, 3) if checkouts else 0.0
+        stats["wait_time_total_ms"] = round(stats["wait_time_total_ms"], 3)
+        stats["wait_time_max_ms"] = round(stats["wait_time_max_ms"], 3)
+        stats["min_size"] = self.minconn
+        stats["max_size"] = self.maxconn
+        return stats
+
+    def close(self):
+        with self._init_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._returned_at.clear()
+
+
+db_pool = DatabasePool(
+    os.getenv('DATABASE_URL'),
+    DB_POOL_MIN,
+    DB_POOL_MAX,
+    DB_POOL_TIMEOUT,
+    DB_POOL_PING_AFTER
+)
+
+
+class AsyncDatabasePool:
+    """asyncpg pool with the same sizing, health checks and wait metrics as DatabasePool"""
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float, ping_after: float):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+
+        self._pool = None
+        self._init_lock = None
+        self._returned_at = {}
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "in_use": 0
+        }
+
+    async def _get_pool(self):
+        # Created lazily so the pool binds to the event loop that serves requests
+        if self._pool is None:
+            if self._init_lock is None:
+                self._init_lock = asyncio.Lock()
+            async with self._init_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=self.minconn,
+                        max_size=self.maxconn
+                    )
+        return self._pool
+
+    async def _is_healthy(self, conn) -> bool:
+        if conn.is_closed():
+            return False
+
+        # asyncpg hands out a new proxy per acquire, so track the backend pid instead
+        idle_for = time.monotonic() - self._returned_at.get(conn.get_server_pid(), 0)
+        if idle_for < self.ping_after:
+            return True
+
+        try:
+            await conn.fetchval("SELECT 1")
+            return True
+        except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError):
+            return False
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a connection: `async with get_async_db_connection() as conn:`"""
+        db_pool = await self._get_pool()
+        start = time.perf_counter()
+
+        conn = None
+        for _ in range(self.maxconn + 1):
+            try:
+                conn = await db_pool.acquire(timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._stats["timeouts"] += 1
+                raise PoolTimeoutError(f"Timed out after {self.timeout}s waiting for a database connection")
+            if await self._is_healthy(conn):
+                break
+            self._stats["health_check_failures"] += 1
+            self._returned_at.pop(conn.get_server_pid(), None)
+            conn.terminate()
+            await db_pool.release(conn)
+            conn = None
+        if conn is None:
+            raise pool.PoolError("Could not obtain a healthy database connection")
+
+        waited_ms = (time.perf_counter() - start) * 1000
+        self._stats["checkouts"] += 1
+        self._stats["in_use"] += 1
+        self._stats["wait_time_total_ms"] += waited_ms
+        self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], waited_ms)
+        if waited_ms >= 1:
+            self._stats["waits"] += 1
+
+        try:
+            yield conn
+        finally:
+            self._stats["in_use"] -= 1
+            if not conn.is_closed():
+                self._returned_at[conn.get_server_pid()] = time.monotonic()
+            await db_pool.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg_ms"] = round(stats["wait_time_total_ms"] / checkouts, 3) if checkouts else 0.0
+        stats["wait_time_total_ms"] = round(stats["wait_time_total_ms"], 3)
+        stats["wait_time_max_ms"] = round(stats["wait_time_max_ms"], 3)
+        stats["min_size"] = self.minconn
+        stats["max_size"] = self.maxconn
+        return stats
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        self._returned_at.clear()
+
+
+async_db_pool = AsyncDatabasePool(
+    os.getenv('DATABASE_URL'),
+    DB_POOL_MIN,
+    DB_POOL_MAX,
+    DB_POOL_TIMEOUT,
+    DB_POOL_PING_AFTER
+)
+
+
+def get_db_connection():
+    """Borrow a connection from the shared pool: `with get_db_connection() as conn:`"""
+    return db_pool.connection()
+
+
+def get_async_db_connection():
+    """Borrow a connection from the shared asyncpg pool"""
+    return async_db_pool.connection()
+
+
+def db_pool_stats() -> Dict[str, Any]:
+    """Pool size, checkout and wait-time metrics for this worker"""
+    return {
+        "sync": db_pool.stats(),
+        "async": async_db_pool.stats()
+    }
@@ -1,11 +1,20 @@
 import os
-import psycopg2
-from datetime import datetime, timedelta
+import io
+import csv
+import time
+from datetime import datetime
 from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
-import requests
+from psycopg2.extras import execute_values
 import json
 import redis
+from db_pool import get_db_connection
+from catalog_cache import product_catalog, filter_catalog_rows, search_rows, retrieve_rows, CATALOG_QUERY
+from product_search import ProductSearchIndex
+from customer_cache import customer_cache, customer_key, CUSTOMER_CACHE_TTL
+from stock_reservation import redis_inventory_enabled, reserve_stock, release_stock, record_stock_release, release_returned_stock, record_release_failure
+from http_clients import http_session, HTTP_TIMEOUT, timed_hop
+from context_builder import CONTEXT_WINDOW, summary_key, parse_summary, summary_fields, needs_history, first_unread, build_context
 
 
 
@@ -13,91 +22,72 @@ redis_client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
 
 load_dotenv()
 
-def load_previous_conversations_to_redis(phone_no: str, limit: int = 20) -> Dict[str, Any]:
-    """Check if previous conversations exist in DB and load them to Redis"""
+# Sessions idle this long are archived to Postgres by archiver.py
+SESSION_IDLE_SECONDS = int(os.getenv('SESSION_IDLE_SECONDS', '1800'))
+# Redis keeps a session a little past the idle threshold so the archiver can still read it
+SESSION_TTL_SECONDS = SESSION_IDLE_SECONDS + int(os.getenv('SESSION_ARCHIVE_GRACE_SECONDS', '600'))
+# Sorted set of phone numbers scored by last activity (unix time); the archiver's index
+SESSION_ACTIVITY_KEY = "chat_sessions:last_activity"
+# Session messages read for the chat context: the window plus a couple of exchanges,
+# so the messages that left the window since the last turn are usually read along
+CONTEXT_READ = CONTEXT_WINDOW + 4
+
+def _history_key(phone_no: str) -> str:
+    return f"conversation:{phone_no}"
+
+def load_previous_conversations_to_redis(phone_no: str, limit: int = 20, refresh: bool = False) -> Dict[str, Any]:
+    """Load the latest stored conversation into Redis once per session (skipped while conversation:{phone} is warm)"""
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cursor = conn.cursor()
-        
-        # Get the most recent conversation for this phone number
-        cursor.execute("""
-            SELECT conversation_id, started_at
-            FROM conversations 
-            WHERE phone_no = %s 
-            ORDER BY started_at DESC 
-            LIMIT 1
-        """, (phone_no,))
-        
-        conversation = cursor.fetchone()
-        
-        if not conversation:
+        redis_key = _history_key(phone_no)
+        if not refresh:
+            cached = redis_client.get(redis_key)
+            if cached:
+                return _history_result(phone_no, json.loads(cached), cached=True)
+        
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get the most recent conversation for this phone number
+            cursor.execute("""
+                SELECT conversation_id, started_at
+                FROM conversations 
+                WHERE phone_no = %s 
+                ORDER BY started_at DESC 
+                LIMIT 1
+            """, (phone_no,))
+            
+            conversation = cursor.fetchone()
+            conversation_id, started_at, messages, customer_name = None, None, [], "Unknown"
+            
+            if conversation:
+                conversation_id = conversation[0]
+                started_at = conversation[1]
+                
+                # Get the last messages from the conversation, oldest first
+                cursor.execute("""
+                    SELECT sender, message_text, timestamp FROM (
+                        SELECT sender, message_text, timestamp
+                        FROM messages 
+                        WHERE conversation_id = %s
+                        ORDER BY timestamp DESC
+                        LIMIT %s
+                    ) recent
+                    ORDER BY timestamp ASC
+                """, (conversation_id, limit))
+                
+                messages = cursor.fetchall()
+                
+                # Get customer name
+                customer = _lookup_customer(cursor, phone_no)
+                customer_name = customer["customer_name"] if customer else "Unknown"
+            
             cursor.close()
-            conn.close()
-            return {
-                "found": False,
-                "loaded": False,
-                "message": "No previous conversations found in database"
-            }
         
-        conversation_id = conversation[0]
-        started_at = conversation[1]
-        
-        # Get messages from the conversation
-        cursor.execute("""
-            SELECT sender, message_text, timestamp
-            FROM messages 
-            WHERE conversation_id = %s
-            ORDER BY timestamp ASC
-            LIMIT %s
-        """, (conversation_id, limit))
+        # Cached even when empty, so customers without history don't query the DB on every message
+        conversation_data = _conversation_snapshot(phone_no, customer_name, started_at, messages, conversation_id)
+        redis_client.setex(redis_key, SESSION_TTL_SECONDS, json.dumps(conversation_data))
         
-        messages = cursor.fetchall()
-        
-        # Get customer name
-        cursor.execute("SELECT customer_name FROM customers WHERE phone_no = %s", (phone_no,))
-        customer = cursor.fetchone()
-        customer_name = customer[0] if customer else "Unknown"
-        
-        cursor.close()
-        conn.close()
-        
-        if not messages:
-            return {
-                "found": True,
-                "loaded": False,
-                "message": "Conversation found but no messages"
-            }
-        
-        # Load conversation into Redis
-        redis_key = f"conversation:{phone_no}"
-        
-        conversation_data = {
-            "phone_no": phone_no,
-            "whatsapp_name": customer_name,
-            "started_at": started_at.isoformat(),
-            "messages": [],
-            "last_activity": datetime.now().isoformat(),
-            "loaded_from_db": True
-        }
-        
-        # Add all messages
-        for msg in messages:
-            conversation_data["messages"].append({
-                "sender": msg[0],
-                "message_text": msg[1],
-                "timestamp": msg[2].isoformat()
-            })
-        
-        # Save to Redis with 30 minute expiry
-        redis_client.setex(redis_key, 1800, json.dumps(conversation_data))
-        
-        return {
-            "found": True,
-            "loaded": True,
-            "phone_no": phone_no,
-            "messages_loaded": len(messages),
-            "conversation_id": conversation_id
-        }
+        return _history_result(phone_no, conversation_data)
         
     except Exception as e:
         print(f"Error loading previous conversations: {e}")
@@ -107,80 +97,108 @@ def load_previous_conversations_to_redis(phone_no: str, limit: int = 20) -> Dict
             "message": f"Error: {str(e)}"
         }
 
-# Add this function to store and retrieve chat history
+def _conversation_snapshot(phone_no: str, customer_name: str, started_at: Optional[datetime], messages: List[Any], conversation_id: Optional[int] = None) -> Dict[str, Any]:
+    """Build the Redis copy of a stored conversation from (sender, text, timestamp) rows"""
+    conversation_data = {
+        "phone_no": phone_no,
+        "whatsapp_name": customer_name,
+        "conversation_id": conversation_id,
+        "started_at": started_at.isoformat() if started_at else None,
+        "messages": [],
+        "last_activity": datetime.now().isoformat(),
+        "loaded_from_db": True
+    }
+    
+    # Add all messages
+    for msg in messages:
+        conversation_data["messages"].append({
+            "sender": msg[0],
+            "message_text": msg[1],
+            "timestamp": msg[2].isoformat()
+        })
+    
+    return conversation_data
+
+def _history_result(phone_no: str, conversation_data: Dict[str, Any], cached: bool = False) -> Dict[str, Any]:
+    """load_previous_conversations_to_redis response for a stored (or cached) conversation snapshot"""
+    if conversation_data["conversation_id"] is None:
+        message = "No previous conversations found in database"
+    elif not conversation_data["messages"]:
+        message = "Conversation found but no messages"
+    else:
+        message = "Previous conversation available in Redis"
+    
+    return {
+        "found": conversation_data["conversation_id"] is not None,
+        "loaded": bool(conversation_data["messages"]),
+        "cached": cached,
+        "phone_no": phone_no,
+        "messages_loaded": len(conversation_data["messages"]),
+        "conversation_id": conversation_data["conversation_id"],
+        "message": message,
+        "history": conversation_data
+    }
+
+# ======================
+# SESSION CHAT HISTORY
+# ======================
+# A session is an append-only Redis list of JSON messages plus a small meta hash,
+# so a new exchange is one RPUSH instead of a read-modify-write of the whole blob.
+# Sessions stored by older versions as a single JSON blob under chat_session:{phone}
+# are migrated the first time they are touched (or in bulk by archiver.py).
+
+def _session_keys(phone_no: str) -> Dict[str, str]:
+    return {
+        "messages": f"chat_messages:{phone_no}",
+        "meta": f"chat_meta:{phone_no}",
+        "legacy": f"chat_session:{phone_no}"
+    }
 
 def manage_session_chat_history(phone_no: str, user_message: str = None, bot_response: str = None, get_context: bool = False) -> Dict[str, Any]:
     """Store chat messages in Redis and retrieve context for next messages"""
     try:
-        redis_key = f"chat_session:{phone_no}"
-        
-        # CLEANUP: Move old conversations to DB before processing new messages
+        # Idle sessions are moved to DB by archiver.py, not on the request path
         if user_message or bot_response:
-            _cleanup_old_conversations()
-            # Get existing chat history
-            existing_chat = redis_client.get(redis_key)
-            if existing_chat:
-                chat_history = json.loads(existing_chat)
-            else:
-                chat_history = {
-                    "phone_no": phone_no,
-                    "messages": [],
-                    "started_at": datetime.now().isoformat()
-                }
-            
-            # Add user message
-            if user_message:
-                chat_history["messages"].append({
-                    "sender": "user",
-                    "message": user_message,
-                    "timestamp": datetime.now().isoformat()
-                })
-            
-            # Add bot response
-            if bot_response:
-                chat_history["messages"].append({
-                    "sender": "bot",
-                    "message": bot_response,
-                    "timestamp": datetime.now().isoformat()
-                })
-            
-            # Update last activity
-            chat_history["last_activity"] = datetime.now().isoformat()
-            
-            # Store back to Redis with 23 minutes expiry
-            redis_client.setex(redis_key, 1800, json.dumps(chat_history))  
+            # Append, refresh TTLs and record the activity in one round trip
+            pipe = redis_client.pipeline(transaction=True)
+            _queue_session_append(pipe, phone_no, _new_chat_messages(user_message, bot_response))
+            legacy_exists = pipe.execute()[-1]
+            if legacy_exists:
+                _migrate_legacy_session(phone_no)
         
         # Get context if requested
         if get_context:
-            chat_data = redis_client.get(redis_key)
-            if chat_data:
-                chat_history = json.loads(chat_data)
-                
-                # Get last 10 messages for context
-                recent_messages = chat_history["messages"][-10:]
-                
-                # Format context
-                context_text = "Previous conversation:\n"
-                for msg in recent_messages:
-                    sender = "User" if msg["sender"] == "user" else "Assistant"
-                    context_text += f"{sender}: {msg['message']}\n"
-                
-                return {
-                    "success": True,
-                    "phone_no": phone_no,
-                    "total_messages": len(chat_history["messages"]),
-                    "context_messages": len(recent_messages),
-                    "context": context_text,
-                    "raw_messages": recent_messages
-                }
-            else:
-                return {
-                    "success": True,
-                    "phone_no": phone_no,
-                    "total_messages": 0,
-                    "context": "No previous conversation history.",
-                    "raw_messages": []
-                }
+            pipe = redis_client.pipeline(transaction=False)
+            _queue_context_read(pipe, phone_no)
+            recent_messages, total_messages, legacy_exists, history_blob, summary_raw = pipe.execute()
+            if legacy_exists and _migrate_legacy_session(phone_no):
+                pipe = redis_client.pipeline(transaction=False)
+                _queue_context_read(pipe, phone_no)
+                recent_messages, total_messages, _, history_blob, summary_raw = pipe.execute()
+            
+            # The stored conversation is needed to start the summary and while the session is short;
+            # it is loaded from the DB the first time it is needed, then read from Redis
+            summary = parse_summary(summary_raw)
+            history = None
+            if needs_history(summary, total_messages):
+                if history_blob:
+                    history = json.loads(history_blob)
+                else:
+                    history = load_previous_conversations_to_redis(phone_no, refresh=True).get("history")
+            
+            # Messages still to be summarized that the tail read missed
+            first_index = total_messages - len(recent_messages)
+            catch_up = first_unread(summary, total_messages, len(recent_messages))
+            if catch_up is not None:
+                recent_messages = redis_client.lrange(_session_keys(phone_no)["messages"], catch_up, first_index - 1) + recent_messages
+                first_index = catch_up
+            
+            result, summary_update = _chat_context_result(phone_no, recent_messages, first_index, total_messages, history, summary)
+            if summary_update:
+                pipe = redis_client.pipeline(transaction=False)
+                _queue_summary_write(pipe, phone_no, summary_update)
+                pipe.execute()
+            return result
         
         return {
             "success": True,
@@ -195,75 +213,211 @@ def manage_session_chat_history(phone_no: str, user_message: str = None, bot_res
             "message": f"Error: {str(e)}"
         }
 
+def _new_chat_messages(user_message: str = None, bot_response: str = None) -> List[Dict[str, Any]]:
+    """Session entries for a user/bot exchange"""
+    messages = []
+    
+    # Add user message
+    if user_message:
+        messages.append({
+            "sender": "user",
+            "message": user_message,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    # Add bot response
+    if bot_response:
+        messages.append({
+            "sender": "bot",
+            "message": bot_response,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    return messages
 
+def _queue_session_append(pipe, phone_no: str, messages: List[Dict[str, Any]]):
+    """Queue an append on a (sync or async) pipeline; its last result says whether a legacy blob exists"""
+    keys = _session_keys(phone_no)
+    now = datetime.now()
+    
+    pipe.rpush(keys["messages"], *[json.dumps(msg) for msg in messages])
+    pipe.hsetnx(keys["meta"], "started_at", now.isoformat())
+    pipe.hset(keys["meta"], mapping={"phone_no": phone_no, "last_activity": now.isoformat()})
+    pipe.expire(keys["messages"], SESSION_TTL_SECONDS)
+    pipe.expire(keys["meta"], SESSION_TTL_SECONDS)
+    pipe.zadd(SESSION_ACTIVITY_KEY, {phone_no: now.timestamp()})
+    pipe.exists(keys["legacy"])
 
-def _cleanup_old_conversations():
-    """Check all Redis chat sessions and move expired ones to DB"""
-    try:
-        chat_keys = redis_client.keys("chat_session:*")
-        current_time = datetime.now()
-        
-        for key in chat_keys:
-            chat_data = redis_client.get(key)
-            if not chat_data:
-                continue
-                
-            chat_history = json.loads(chat_data)
-            last_activity = datetime.fromisoformat(chat_history.get("last_activity", chat_history["started_at"]))
-            
-            # If older than 30 minutes, move to DB
-            if current_time - last_activity >= timedelta(minutes=30):
-                phone_no = chat_history["phone_no"]
-                _save_chat_to_db(phone_no, chat_history)
-                redis_client.delete(key)
-                print(f"Moved conversation for {phone_no} to DB (inactive for 30+ minutes)")
-                
-    except Exception as e:
-        print(f"Cleanup error: {e}")
+def _queue_context_read(pipe, phone_no: str, window: int = CONTEXT_READ):
+    """Queue the tail read for the context: (recent messages, total count, legacy blob exists, stored history, summary)"""
+    keys = _session_keys(phone_no)
+    pipe.lrange(keys["messages"], -window, -1)
+    pipe.llen(keys["messages"])
+    pipe.exists(keys["legacy"])
+    pipe.get(_history_key(phone_no))
+    pipe.hgetall(summary_key(phone_no))
+
+def _queue_summary_write(pipe, phone_no: str, summary: Dict[str, Any]):
+    """Queue storing the rolling summary; it lives as long as the session"""
+    key = summary_key(phone_no)
+    pipe.hset(key, mapping=summary_fields(summary))
+    pipe.expire(key, SESSION_TTL_SECONDS)
+
+def _queue_session_prepend(pipe, phone_no: str, chat_history: Dict[str, Any]):
+    """Queue putting a whole session back in front of whatever is stored now.
+    
+    Used to migrate legacy blobs and to restore sessions the archiver could not save;
+    messages written in the meantime stay after the older ones."""
+    keys = _session_keys(phone_no)
+    last_activity = chat_history.get("last_activity", chat_history["started_at"])
+    
+    if chat_history["messages"]:
+        pipe.lpush(keys["messages"], *[json.dumps(msg) for msg in reversed(chat_history["messages"])])
+    pipe.hset(keys["meta"], mapping={"phone_no": phone_no, "started_at": chat_history["started_at"]})
+    pipe.hsetnx(keys["meta"], "last_activity", last_activity)
+    pipe.expire(keys["messages"], SESSION_TTL_SECONDS)
+    pipe.expire(keys["meta"], SESSION_TTL_SECONDS)
+    pipe.zadd(SESSION_ACTIVITY_KEY, {phone_no: datetime.fromisoformat(last_activity).timestamp()}, gt=True)
+
+def _session_from_parts(phone_no: str, raw_messages: List[bytes], meta: Dict[Any, Any], legacy_blob: Optional[bytes] = None) -> Optional[Dict[str, Any]]:
+    """Rebuild the {phone_no, started_at, last_activity, messages} session dict from Redis reads"""
+    meta = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v) for k, v in meta.items()}
+    messages = [json.loads(msg) for msg in raw_messages]
+    
+    if legacy_blob:
+        legacy = json.loads(legacy_blob)
+        messages = legacy["messages"] + messages
+        meta.setdefault("last_activity", legacy.get("last_activity", legacy["started_at"]))
+        meta["started_at"] = legacy["started_at"]
+    
+    if not messages:
+        return None
+    
+    started_at = meta.get("started_at", messages[0]["timestamp"])
+    return {
+        "phone_no": phone_no,
+        "started_at": started_at,
+        "last_activity": meta.get("last_activity", started_at),
+        "messages": messages
+    }
+
+def _migrate_legacy_session(phone_no: str) -> bool:
+    """Convert a chat_session:{phone} JSON blob into the list + meta format"""
+    legacy_key = _session_keys(phone_no)["legacy"]
+    with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            pipe.watch(legacy_key)
+            legacy_blob = pipe.get(legacy_key)
+            if not legacy_blob:
+                return False
+            pipe.multi()
+            _queue_session_prepend(pipe, phone_no, json.loads(legacy_blob))
+            # Prepending shifts message indexes, so the summary starts over
+            pipe.delete(legacy_key, summary_key(phone_no))
+            pipe.execute()
+            return True
+        except redis.WatchError:
+            # Another worker migrated (or archived) it first
+            return False
+
+def _chat_context_result(phone_no: str, session_messages: List[bytes], first_index: int, total_messages: int, history: Optional[Dict[str, Any]] = None, summary: Optional[Dict[str, Any]] = None):
+    """Prompt context for the session messages from `first_index` on, the stored conversation and the summary.
+    
+    Returns the manage_session_chat_history response and the summary to store (None when unchanged)."""
+    session_messages = [json.loads(msg) for msg in session_messages]
+    context, summary_update = build_context(session_messages, first_index, total_messages, history, summary)
+    
+    if context["context"]:
+        return {
+            "success": True,
+            "phone_no": phone_no,
+            "total_messages": total_messages,
+            **context
+        }, summary_update
+    
+    return {
+        "success": True,
+        "phone_no": phone_no,
+        "total_messages": 0,
+        "context": "No previous conversation history.",
+        "raw_messages": []
+    }, summary_update
 
-def _save_chat_to_db(phone_no: str, chat_history: Dict[str, Any]):
-    """Save chat session to database"""
+def save_chat_sessions_to_db(sessions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Archive many chat sessions in one transaction.
+    
+    Customers and conversations go in as multi-row INSERTs and all messages are
+    streamed with COPY, so a batch costs a few round trips however long the
+    conversations are. Sessions are {phone_no, started_at, last_activity, messages}."""
+    if not sessions:
+        return {"success": True, "sessions": 0, "messages": 0, "rows": 0, "elapsed_ms": 0.0, "rows_per_sec": 0.0}
+    if len({session["phone_no"] for session in sessions}) != len(sessions):
+        raise ValueError("save_chat_sessions_to_db takes at most one session per phone_no per batch")
+    
+    start = time.perf_counter()
     try:
-        # ENSURE CUSTOMER EXISTS using existing function
-        customer_result = get_or_create_customer(phone_no, "Unknown User")
-        if not customer_result["found"]:
-            print(f"Error: Could not create customer for {phone_no}")
-            return
-        
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cursor = conn.cursor()
-        
-        # Insert conversation
-        cursor.execute("""
-            INSERT INTO conversations (phone_no, started_at, ended_at)
-            VALUES (%s, %s, %s)
-            RETURNING conversation_id
-        """, (
-            phone_no,
-            datetime.fromisoformat(chat_history["started_at"]),
-            datetime.fromisoformat(chat_history["last_activity"])
-        ))
-        conversation_id = cursor.fetchone()[0]
-        
-        # Insert messages
-        for msg in chat_history["messages"]:
-            cursor.execute("""
-                INSERT INTO messages (conversation_id, sender, message_text, timestamp)
-                VALUES (%s, %s, %s, %s)
-            """, (
-                conversation_id,
-                msg["sender"],
-                msg["message"],
-                datetime.fromisoformat(msg["timestamp"])
-            ))
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # ENSURE CUSTOMERS EXIST (no-op for phones that are already customers, including
+            # ones the webhook path creates concurrently, which would otherwise abort the batch)
+            execute_values(cursor, """
+                INSERT INTO customers (phone_no, customer_name)
+                VALUES %s
+                ON CONFLICT (phone_no) DO NOTHING
+            """, list({session["phone_no"]: (session["phone_no"], "Unknown User") for session in sessions}.values()))
+            
+            # Insert conversations; sessions are keyed by phone, so phone_no maps ids back
+            conversation_rows = execute_values(cursor, """
+                INSERT INTO conversations (phone_no, started_at, ended_at)
+                VALUES %s
+                RETURNING conversation_id, phone_no
+            """, [
+                (
+                    session["phone_no"],
+                    datetime.fromisoformat(session["started_at"]),
+                    datetime.fromisoformat(session["last_activity"])
+                )
+                for session in sessions
+            ], page_size=len(sessions), fetch=True)
+            conversation_ids = {phone_no: conversation_id for conversation_id, phone_no in conversation_rows}
+            
+            # Stream all messages with COPY
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            message_count = 0
+            for session in sessions:
+                conversation_id = conversation_ids[session["phone_no"]]
+                for msg in session["messages"]:
+                    writer.writerow([conversation_id, msg["sender"], msg["message"], msg["timestamp"]])
+                    message_count += 1
+            buffer.seek(0)
+            cursor.copy_expert(
+                "COPY messages (conversation_id, sender, message_text, timestamp) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+            
+            conn.commit()
+            cursor.close()
         
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"Chat saved to DB: Conversation ID {conversation_id}")
+        elapsed = time.perf_counter() - start
+        rows = len(sessions) + message_count
+        return {
+            "success": True,
+            "sessions": len(sessions),
+            "messages": message_count,
+            "rows": rows,
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else 0.0
+        }
         
     except Exception as e:
-        print(f"Error saving chat to DB: {e}")
+        print(f"Error saving chat sessions to DB: {e}")
+        return {
+            "success": False,
+            "sessions": len(sessions),
+            "message": f"Error: {str(e)}"
+        }
 
 
 
@@ -275,118 +429,196 @@ def _save_chat_to_db(phone_no: str, chat_history: Dict[str, Any]):
 def get_products(product_name: Optional[str] = None) -> Dict[str, Any]:
     """Get product catalog or specific product details"""
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cursor = conn.cursor()
-        
-        if product_name:
-            # Get specific product details
-            cursor.execute("""
-                SELECT 
-                    product_id,
-                    product_name,
-                    size,
-                    price,
-                    stock_quantity
-                FROM products 
-                WHERE LOWER(product_name) LIKE LOWER(%s)
-                ORDER BY product_name, size, price
-            """, [f"%{product_name}%"])
-        else:
-            # Get all products catalog
-            cursor.execute("""
-                SELECT 
-                    product_id,
-                    product_name,
-                    size,
-                    price,
-                    stock_quantity
-                FROM products 
-                WHERE stock_quantity > 0
-                ORDER BY product_name, size
-            """)
-        
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if not results:
-            return {
-                "found": False,
-                "message": f"No products found{f' for {product_name}' if product_name else ''}",
-                "products": []
-            }
+        # Served from the in-process catalog; the whole table is loaded on a miss
+        results = product_catalog.lookup(product_name)
+        
+        if results is None:
+            generation = product_catalog.generation()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(CATALOG_QUERY)
+                catalog_rows = cursor.fetchall()
+                cursor.close()
+            
+            product_catalog.load(catalog_rows, generation)
+            results = filter_catalog_rows(catalog_rows, product_name)
         
-        products = []
-        for row in results:
-            products.append({
-                "product_id": row[0],
-                "product_name": row[1],
-                "size": row[2],
-                "price": float(row[3]),
-                "stock_quantity": row[4],
-                "available": row[4] > 0
-            })
+        return _products_result(results, product_name)
         
+    except Exception as e:
+        print(f"Error getting products: {e}")
         return {
-            "found": True,
-            "total_products": len(products),
-            "products": products
+            "found": False,
+            "message": f"Error retrieving products: {str(e)}",
+            "products": []
         }
+
+def retrieve_products(message: str, product_name: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+    """The `limit` products most relevant to a customer message (get_products response plus total_matches)"""
+    try:
+        retrieved = product_catalog.retrieve(message, product_name, limit)
+        
+        if retrieved is None:
+            generation = product_catalog.generation()
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(CATALOG_QUERY)
+                catalog_rows = cursor.fetchall()
+                cursor.close()
+            
+            product_catalog.load(catalog_rows, generation)
+            retrieved = product_catalog.retrieve(message, product_name, limit) or _retrieve_uncached(catalog_rows, message, product_name, limit)
+        
+        return _retrieved_result(retrieved, product_name)
         
     except Exception as e:
-        print(f"Error getting products: {e}")
+        print(f"Error retrieving products: {e}")
         return {
             "found": False,
             "message": f"Error retrieving products: {str(e)}",
             "products": []
         }
 
+def _retrieve_uncached(catalog_rows: List[Any], message: str, product_name: Optional[str], limit: int):
+    """retrieve_rows when the load lost a race with a stock change and wasn't cached"""
+    return retrieve_rows(catalog_rows, ProductSearchIndex(catalog_rows), message, product_name, limit)
+
+def _retrieved_result(retrieved, product_name: Optional[str] = None) -> Dict[str, Any]:
+    rows, total_matches = retrieved
+    result = _products_result(rows, product_name)
+    result["total_matches"] = total_matches
+    return result
+
+def _products_result(results: List[Any], product_name: Optional[str] = None) -> Dict[str, Any]:
+    """Shape (id, name, size, price, stock) rows into the get_products response"""
+    if not results:
+        return {
+            "found": False,
+            "message": f"No products found{f' for {product_name}' if product_name else ''}",
+            "products": []
+        }
+    
+    products = []
+    for row in results:
+        products.append({
+            "product_id": row[0],
+            "product_name": row[1],
+            "size": row[2],
+            "price": float(row[3]),
+            "stock_quantity": row[4],
+            "available": row[4] > 0
+        })
+    
+    return {
+        "found": True,
+        "total_products": len(products),
+        "products": products
+    }
+
 # ======================
 # CUSTOMER FUNCTIONS
 # ======================
 
+def _cached_customer(phone_no: str) -> Optional[Dict[str, Any]]:
+    """Customer from the in-process cache, then Redis (customer:{phone}), or None"""
+    customer = customer_cache.get(phone_no)
+    if customer:
+        return customer
+    
+    try:
+        cached = redis_client.get(customer_key(phone_no))
+    except Exception as e:
+        print(f"Error reading customer cache: {e}")
+        return None
+    if not cached:
+        return None
+    
+    customer = json.loads(cached)
+    customer_cache.put(customer)
+    customer_cache.record("redis_hits")
+    return customer
+
+def _cache_customer(customer: Dict[str, Any]):
+    """Store a committed customer in both cache tiers"""
+    customer_cache.put(customer)
+    try:
+        redis_client.set(customer_key(customer["phone_no"]), json.dumps({"phone_no": customer["phone_no"], "customer_name": customer["customer_name"]}), ex=CUSTOMER_CACHE_TTL)
+    except Exception as e:
+        print(f"Error writing customer cache: {e}")
+
+def _lookup_customer(cursor, phone_no: str) -> Optional[Dict[str, Any]]:
+    """Read-through customer lookup: caches first, then the customers table"""
+    customer = _cached_customer(phone_no)
+    if customer:
+        return customer
+    
+    customer_cache.record("db_reads")
+    cursor.execute("SELECT phone_no, customer_name FROM customers WHERE phone_no = %s", (phone_no,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    
+    customer = {"phone_no": row[0], "customer_name": row[1]}
+    _cache_customer(customer)
+    return customer
+
+def _known_customer(phone_no: str, customer_data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The customer the workflow already resolved (IntentRouterState.customer_data), if it is this phone's"""
+    if customer_data and customer_data.get("found") and customer_data.get("phone_no") == phone_no:
+        return {"phone_no": phone_no, "customer_name": customer_data["customer_name"]}
+    return None
+
+def _get_or_create_customer(cursor, phone_no: str, customer_name: str = None) -> Dict[str, Any]:
+    """Get or create a customer using the caller's cursor (caller commits, then caches a created one)"""
+    # Check if customer exists
+    customer = _lookup_customer(cursor, phone_no)
+    
+    if customer:
+        return {
+            "found": True,
+            "phone_no": customer["phone_no"],
+            "customer_name": customer["customer_name"]
+        }
+    
+    # Create new customer if name provided
+    if customer_name:
+        cursor.execute("""
+            INSERT INTO customers (phone_no, customer_name) 
+            VALUES (%s, %s)
+        """, (phone_no, customer_name))
+        return {
+            "found": True,
+            "phone_no": phone_no,
+            "customer_name": customer_name,
+            "created": True
+        }
+    
+    return {
+        "found": False,
+        "message": "Customer not found and no name provided for creation"
+    }
+
 def get_or_create_customer(phone_no: str, customer_name: str = None) -> Dict[str, Any]:
     """Get existing customer or create new one"""
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cursor = conn.cursor()
-        
-        # Check if customer exists
-        cursor.execute("SELECT phone_no, customer_name FROM customers WHERE phone_no = %s", (phone_no,))
-        customer = cursor.fetchone()
-        
+        # Returning customers are answered from the cache without a pool checkout
+        customer = _cached_customer(phone_no)
         if customer:
-            cursor.close()
-            conn.close()
             return {
                 "found": True,
-                "phone_no": customer[0],
-                "customer_name": customer[1]
+                "phone_no": customer["phone_no"],
+                "customer_name": customer["customer_name"]
             }
         
-        # Create new customer if name provided
-        if customer_name:
-            cursor.execute("""
-                INSERT INTO customers (phone_no, customer_name) 
-                VALUES (%s, %s)
-            """, (phone_no, customer_name))
-            conn.commit()
-            
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            customer_result = _get_or_create_customer(cursor, phone_no, customer_name)
+            if customer_result.get("created"):
+                conn.commit()
+                _cache_customer(customer_result)
             cursor.close()
-            conn.close()
-            return {
-                "found": True,
-                "phone_no": phone_no,
-                "customer_name": customer_name,
-                "created": True
-            }
         
-        cursor.close()
-        conn.close()
-        return {
-            "found": False,
-            "message": "Customer not found and no name provided for creation"
-        }
+        return customer_result
         
     except Exception as e:
         print(f"Error with customer: {e}")
@@ -399,75 +631,42 @@ def get_or_create_customer(phone_no: str, customer_name: str = None) -> Dict[str
 # ORDER FUNCTIONS
 # ======================
 
-def check_order_status(phone_no: str) -> Dict[str, Any]:
-    """Check order status for a customer"""
+def check_order_status(phone_no: str, customer_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Check order status for a customer (customer_data: the already resolved customer, if any)"""
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cursor = conn.cursor()
-        
-        # Check if customer exists
-        cursor.execute("SELECT phone_no, customer_name FROM customers WHERE phone_no = %s", (phone_no,))
-        customer = cursor.fetchone()
-        
-        if not customer:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Check if customer exists
+            customer = _known_customer(phone_no, customer_data) or _lookup_customer(cursor, phone_no)
+            
+            if not customer:
+                cursor.close()
+                return {
+                    "found": False,
+                    "message": f"No customer found with phone number {phone_no}"
+                }
+            
+            # Get orders with product details
+            cursor.execute("""
+                SELECT 
+                    o.order_id,
+                    o.quantity,
+                    o.order_date,
+                    o.status,
+                    p.product_name,
+                    p.size,
+                    p.price
+                FROM orders o
+                JOIN products p ON o.product_id = p.product_id
+                WHERE o.phone_no = %s
+                ORDER BY o.order_date DESC
+            """, (phone_no,))
+            
+            orders = cursor.fetchall()
             cursor.close()
-            conn.close()
-            return {
-                "found": False,
-                "message": f"No customer found with phone number {phone_no}"
-            }
         
-        # Get orders with product details
-        cursor.execute("""
-            SELECT 
-                o.order_id,
-                o.quantity,
-                o.order_date,
-                o.status,
-                p.product_name,
-                p.size,
-                p.price
-            FROM orders o
-            JOIN products p ON o.product_id = p.product_id
-            WHERE o.phone_no = %s
-            ORDER BY o.order_date DESC
-        """, (phone_no,))
-        
-        orders = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if not orders:
-            return {
-                "found": True,
-                "customer_name": customer[1],
-                "phone_no": customer[0],
-                "order_count": 0,
-                "orders": [],
-                "message": "No orders found for this customer"
-            }
-        
-        order_list = []
-        for order in orders:
-            total_amount = order[1] * float(order[6])  # quantity * price
-            order_list.append({
-                "order_id": order[0],
-                "quantity": order[1],
-                "order_date": order[2].strftime('%Y-%m-%d %H:%M:%S') if order[2] else None,
-                "status": order[3],
-                "product_name": order[4],
-                "size": order[5],
-                "unit_price": float(order[6]),
-                "total_amount": total_amount
-            })
-        
-        return {
-            "found": True,
-            "customer_name": customer[1],
-            "phone_no": customer[0],
-            "order_count": len(orders),
-            "orders": order_list
-        }
+        return _order_status_result(customer, orders)
         
     except Exception as e:
         print(f"Error checking order status: {e}")
@@ -476,80 +675,126 @@ def check_order_status(phone_no: str) -> Dict[str, Any]:
             "message": f"Error checking orders: {str(e)}"
         }
 
-def place_order(phone_no: str, product_name: str, size: str, quantity: int = 1, customer_name: str = None) -> Dict[str, Any]:
+def _order_status_result(customer: Dict[str, Any], orders: List[Any]) -> Dict[str, Any]:
+    """Shape a {phone_no, customer_name} customer and order rows into the check_order_status response"""
+    if not orders:
+        return {
+            "found": True,
+            "customer_name": customer["customer_name"],
+            "phone_no": customer["phone_no"],
+            "order_count": 0,
+            "orders": [],
+            "message": "No orders found for this customer"
+        }
+    
+    order_list = []
+    for order in orders:
+        total_amount = order[1] * float(order[6])  # quantity * price
+        order_list.append({
+            "order_id": order[0],
+            "quantity": order[1],
+            "order_date": order[2].strftime('%Y-%m-%d %H:%M:%S') if order[2] else None,
+            "status": order[3],
+            "product_name": order[4],
+            "size": order[5],
+            "unit_price": float(order[6]),
+            "total_amount": total_amount
+        })
+    
+    return {
+        "found": True,
+        "customer_name": customer["customer_name"],
+        "phone_no": customer["phone_no"],
+        "order_count": len(orders),
+        "orders": order_list
+    }
+
+def place_order(phone_no: str, product_name: str, size: str, quantity: int = 1, customer_name: str = None, customer_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Place a new order"""
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cursor = conn.cursor()
-        
-        # Get or create customer
-        customer_result = get_or_create_customer(phone_no, customer_name)
-        if not customer_result["found"]:
-            return {
-                "success": False,
-                "message": customer_result["message"]
-            }
-        
-        # Find product
-        cursor.execute("""
-            SELECT product_id, product_name, size, price, stock_quantity 
-            FROM products 
-            WHERE LOWER(product_name) LIKE LOWER(%s) AND LOWER(size) = LOWER(%s)
-        """, (f"%{product_name}%", size))
-        
-        product = cursor.fetchone()
-        
-        if not product:
-            cursor.close()
-            conn.close()
-            return {
-                "success": False,
-                "message": f"Product '{product_name}' with size '{size}' not found"
-            }
-        
-        # Check stock
-        if product[4] < quantity:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Get or create customer on the same connection, unless the workflow already has it
+            customer_result = _known_customer(phone_no, customer_data)
+            if customer_result:
+                customer_result["found"] = True
+            else:
+                customer_result = _get_or_create_customer(cursor, phone_no, customer_name)
+            if not customer_result["found"]:
+                cursor.close()
+                return {
+                    "success": False,
+                    "message": customer_result["message"]
+                }
+            
+            # Find product: best-ranked name match in this size
+            match = _best_product_match(cursor, product_name, size)
+            if not match:
+                conn.commit()  # keep a newly created customer
+                cursor.close()
+                return {
+                    "success": False,
+                    "message": f"Product '{product_name}' with size '{size}' not found"
+                }
+            
+            if redis_inventory_enabled():
+                result = _place_reserved_order(conn, cursor, phone_no, product_name, size, quantity, match)
+                cursor.close()
+                if not result["success"]:
+                    return result
+                order_id, product, new_stock = result["order_id"], result["product"], result["stock"]
+                product_catalog.set_stock(product[0], new_stock)
+                if customer_result.get("created"):
+                    _cache_customer(customer_result)
+                return _order_placed_result(order_id, customer_result["customer_name"], phone_no, product, quantity)
+            
+            # Decrement stock only if enough is left and record the order, in one statement.
+            # The conditional UPDATE is checked against the row Postgres has locked, so
+            # concurrent buyers of one SKU can never oversell it, and the row lock is
+            # held only for this statement plus the commit.
+            cursor.execute("""
+                WITH reserved AS (
+                    UPDATE products 
+                    SET stock_quantity = stock_quantity - %s 
+                    WHERE product_id = %s AND stock_quantity >= %s
+                    RETURNING product_id, product_name, size, price, stock_quantity
+                ), placed AS (
+                    INSERT INTO orders (phone_no, product_id, quantity)
+                    SELECT %s, product_id, %s FROM reserved
+                    RETURNING order_id
+                )
+                SELECT placed.order_id, reserved.product_id, reserved.product_name, reserved.size, reserved.price, reserved.stock_quantity
+                FROM placed, reserved
+            """, (quantity, match[0], quantity, phone_no, quantity))
+            placed = cursor.fetchone()
+            
+            if not placed:
+                # Nothing reserved: report what is actually left
+                cursor.execute("SELECT stock_quantity FROM products WHERE product_id = %s", (match[0],))
+                stock = cursor.fetchone()
+                conn.commit()  # keep a newly created customer
+                cursor.close()
+                if not stock:
+                    return {
+                        "success": False,
+                        "message": f"Product '{product_name}' with size '{size}' not found"
+                    }
+                return {
+                    "success": False,
+                    "message": f"Insufficient stock. Available: {stock[0]}, Requested: {quantity}"
+                }
+            
+            order_id, product, new_stock = placed[0], placed[1:], placed[5]
+            
+            conn.commit()
             cursor.close()
-            conn.close()
-            return {
-                "success": False,
-                "message": f"Insufficient stock. Available: {product[4]}, Requested: {quantity}"
-            }
         
-        # Place order
-        cursor.execute("""
-            INSERT INTO orders (phone_no, product_id, quantity)
-            VALUES (%s, %s, %s)
-            RETURNING order_id
-        """, (phone_no, product[0], quantity))
-        
-        order_id = cursor.fetchone()[0]
-        
-        # Update stock
-        cursor.execute("""
-            UPDATE products 
-            SET stock_quantity = stock_quantity - %s 
-            WHERE product_id = %s
-        """, (quantity, product[0]))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        total_amount = quantity * float(product[3])
+        product_catalog.set_stock(product[0], new_stock)
+        if customer_result.get("created"):
+            _cache_customer(customer_result)
         
-        return {
-            "success": True,
-            "order_id": order_id,
-            "customer_name": customer_result["customer_name"],
-            "phone_no": phone_no,
-            "product_name": product[1],
-            "size": product[2],
-            "quantity": quantity,
-            "unit_price": float(product[3]),
-            "total_amount": total_amount,
-            "status": "Placed"
-        }
+        return _order_placed_result(order_id, customer_result["customer_name"], phone_no, product, quantity)
         
     except Exception as e:
         print(f"Error placing order: {e}")
@@ -558,99 +803,165 @@ def place_order(phone_no: str, product_name: str, size: str, quantity: int = 1,
             "message": f"Error placing order: {str(e)}"
         }
 
+def _place_reserved_order(conn, cursor, phone_no: str, product_name: str, size: str, quantity: int, match: Any) -> Dict[str, Any]:
+    """INVENTORY_MODE=redis: reserve units in Redis, then only insert the order (no products row lock)"""
+    reservation = reserve_stock(match[0], quantity)
+    if not reservation["found"]:
+        conn.commit()  # keep a newly created customer
+        return {
+            "success": False,
+            "message": f"Product '{product_name}' with size '{size}' not found"
+        }
+    if not reservation["reserved"]:
+        conn.commit()  # keep a newly created customer
+        return {
+            "success": False,
+            "message": f"Insufficient stock. Available: {reservation['stock']}, Requested: {quantity}"
+        }
+    
+    try:
+        cursor.execute("""
+            INSERT INTO orders (phone_no, product_id, quantity)
+            VALUES (%s, %s, %s)
+            RETURNING order_id
+        """, (phone_no, match[0], quantity))
+        order_id = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        # The order was not recorded, so the units go back
+        release_stock(match[0], quantity)
+        raise
+    
+    return {
+        "success": True,
+        "order_id": order_id,
+        "product": (match[0], match[1], match[2], match[3], reservation["stock"]),
+        "stock": reservation["stock"]
+    }
+
+def _best_product_match(cursor, product_name: str, size: str) -> Optional[Any]:
+    """Resolve an order's product through the catalog search index (ranked, deterministic)"""
+    matches = product_catalog.search(product_name, size=size, limit=1)
+    
+    if matches is None:
+        generation = product_catalog.generation()
+        cursor.execute(CATALOG_QUERY)
+        catalog_rows = cursor.fetchall()
+        if product_catalog.load(catalog_rows, generation):
+            matches = product_catalog.search(product_name, size=size, limit=1)
+        else:
+            matches = search_rows(catalog_rows, ProductSearchIndex(catalog_rows), product_name, size, limit=1)
+    
+    return matches[0] if matches else None
+
+def _order_placed_result(order_id: int, customer_name: str, phone_no: str, product: Any, quantity: int) -> Dict[str, Any]:
+    """Shape a placed order from its (id, name, size, price, stock) product row"""
+    total_amount = quantity * float(product[3])
+    
+    return {
+        "success": True,
+        "order_id": order_id,
+        "customer_name": customer_name,
+        "phone_no": phone_no,
+        "product_name": product[1],
+        "size": product[2],
+        "quantity": quantity,
+        "unit_price": float(product[3]),
+        "total_amount": total_amount,
+        "status": "Placed"
+    }
+
 # ======================
 # RETURN FUNCTIONS
 # ======================
 
-def process_return(phone_no: str, order_id: Optional[int] = None, reason: str = "Customer request") -> Dict[str, Any]:
+def process_return(phone_no: str, order_id: Optional[int] = None, reason: str = "Customer request", customer_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Process a return request"""
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        cursor = conn.cursor()
-        
-        # Check if customer exists
-        cursor.execute("SELECT phone_no, customer_name FROM customers WHERE phone_no = %s", (phone_no,))
-        customer = cursor.fetchone()
-        
-        if not customer:
-            cursor.close()
-            conn.close()
-            return {
-                "success": False,
-                "message": f"No customer found with phone number {phone_no}"
-            }
-        
-        # If no order_id provided, get most recent order
-        if not order_id:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Check if customer exists
+            customer = _known_customer(phone_no, customer_data) or _lookup_customer(cursor, phone_no)
+            
+            if not customer:
+                cursor.close()
+                return {
+                    "success": False,
+                    "message": f"No customer found with phone number {phone_no}"
+                }
+            
+            # If no order_id provided, get most recent order
+            if not order_id:
+                cursor.execute("""
+                    SELECT order_id FROM orders 
+                    WHERE phone_no = %s 
+                    ORDER BY order_date DESC 
+                    LIMIT 1
+                """, (phone_no,))
+                
+                recent_order = cursor.fetchone()
+                if not recent_order:
+                    cursor.close()
+                    return {
+                        "success": False,
+                        "message": "No recent orders found for return"
+                    }
+                order_id = recent_order[0]
+            
+            # Get order details including product_id
             cursor.execute("""
-                SELECT order_id FROM orders 
-                WHERE phone_no = %s 
-                ORDER BY order_date DESC 
-                LIMIT 1
-            """, (phone_no,))
+                SELECT o.order_id, o.quantity, o.status, o.product_id, p.product_name, p.size, p.price
+                FROM orders o
+                JOIN products p ON o.product_id = p.product_id
+                WHERE o.order_id = %s AND o.phone_no = %s
+            """, (order_id, phone_no))
+            
+            order = cursor.fetchone()
             
-            recent_order = cursor.fetchone()
-            if not recent_order:
+            if not order:
                 cursor.close()
-                conn.close()
                 return {
                     "success": False,
-                    "message": "No recent orders found for return"
+                    "message": f"Order {order_id} not found for this customer"
                 }
-            order_id = recent_order[0]
-        
-        # Get order details including product_id
-        cursor.execute("""
-            SELECT o.order_id, o.quantity, o.status, o.product_id, p.product_name, p.size, p.price
-            FROM orders o
-            JOIN products p ON o.product_id = p.product_id
-            WHERE o.order_id = %s AND o.phone_no = %s
-        """, (order_id, phone_no))
-        
-        order = cursor.fetchone()
-        
-        if not order:
+            
+            # Create return
+            cursor.execute("""
+                INSERT INTO returns (order_id, phone_no, reason)
+                VALUES (%s, %s, %s)
+                RETURNING return_id
+            """, (order_id, phone_no, reason))
+            
+            return_id = cursor.fetchone()[0]
+            
+            new_stock = None
+            if redis_inventory_enabled():
+                # Committed with the return, so the units come back even if Redis fails below
+                record_stock_release(cursor, return_id, order[3], order[1])
+            else:
+                # ADD THIS: Restore stock quantity
+                cursor.execute("""
+                    UPDATE products 
+                    SET stock_quantity = stock_quantity + %s 
+                    WHERE product_id = %s
+                    RETURNING stock_quantity
+                """, (order[1], order[3]))  # quantity, product_id
+                new_stock = cursor.fetchone()[0]
+            
+            conn.commit()
             cursor.close()
-            conn.close()
-            return {
-                "success": False,
-                "message": f"Order {order_id} not found for this customer"
-            }
-        
-        # Create return
-        cursor.execute("""
-            INSERT INTO returns (order_id, phone_no, reason)
-            VALUES (%s, %s, %s)
-            RETURNING return_id
-        """, (order_id, phone_no, reason))
-        
-        return_id = cursor.fetchone()[0]
-        
-        # ADD THIS: Restore stock quantity
-        cursor.execute("""
-            UPDATE products 
-            SET stock_quantity = stock_quantity + %s 
-            WHERE product_id = %s
-        """, (order[1], order[3]))  # quantity, product_id
         
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        refund_amount = order[1] * float(order[6])  # quantity * price (adjusted index)
+        if redis_inventory_enabled():
+            # Restored through the Redis counter and written behind like an order
+            try:
+                new_stock = release_returned_stock(return_id, order[3], order[1])
+            except Exception as e:
+                record_release_failure(return_id, e)
+        if new_stock is not None:
+            product_catalog.set_stock(order[3], new_stock)
         
-        return {
-            "success": True,
-            "return_id": return_id,
-            "order_id": order[0],
-            "product_name": order[4],
-            "size": order[5],
-            "quantity": order[1],
-            "refund_amount": refund_amount,
-            "reason": reason,
-            "status": "Pending",
-            "stock_restored": True
-        }
+        return _return_result(return_id, order, reason)
         
     except Exception as e:
         print(f"Error processing return: {e}")
@@ -659,10 +970,60 @@ def process_return(phone_no: str, order_id: Optional[int] = None, reason: str =
             "message": f"Error processing return: {str(e)}"
         }
 
+def _return_result(return_id: int, order: Any, reason: str) -> Dict[str, Any]:
+    """Shape a processed return from its order row"""
+    refund_amount = order[1] * float(order[6])  # quantity * price (adjusted index)
+    
+    return {
+        "success": True,
+        "return_id": return_id,
+        "order_id": order[0],
+        "product_name": order[4],
+        "size": order[5],
+        "quantity": order[1],
+        "refund_amount": refund_amount,
+        "reason": reason,
+        "status": "Pending",
+        "stock_restored": True
+    }
+
 # ======================
 # EXTERNAL API FUNCTIONS
 # ======================
 
+SERPER_URL = "https://google.serper.dev/search"
+
+def _serper_payload(query: str) -> Dict[str, Any]:
+    return {
+        'q': f"{query} comparison review features specs vs differences",
+        'num': 6
+    }
+
+def _serper_result(query: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a Serper search response into the compare_products_serper response"""
+    if 'organic' in data and data['organic']:
+        comparison_results = []
+        
+        for result in data['organic'][:4]:  # Top 4 results
+            comparison_results.append({
+                "title": result.get('title', 'N/A'),
+                "snippet": result.get('snippet', 'No description'),
+                "link": result.get('link', ''),
+                "source": result.get('source', 'Unknown')
+            })
+        
+        return {
+            "success": True,
+            "query": query,
+            "results": comparison_results,
+            "result_count": len(comparison_results)
+        }
+    else:
+        return {
+            "success": False,
+            "message": "No comparison data found. Try being more specific with product names."
+        }
+
 def compare_products_serper(query: str) -> Dict[str, Any]:
     """Compare products using Serper API"""
     try:
@@ -674,41 +1035,16 @@ def compare_products_serper(query: str) -> Dict[str, Any]:
                 "message": "Product comparison service is currently unavailable"
             }
         
-        url = "https://google.serper.dev/search"
         headers = {
             'X-API-KEY': serper_key,
             'Content-Type': 'application/json'
         }
-        payload = {
-            'q': f"{query} comparison review features specs vs differences",
-            'num': 6
-        }
         
-        response = requests.post(url, headers=headers, json=payload)
-        data = response.json()
+        with timed_hop("serper"):
+            response = http_session.post(SERPER_URL, headers=headers, json=_serper_payload(query), timeout=HTTP_TIMEOUT)
+            data = response.json()
         
-        if 'organic' in data and data['organic']:
-            comparison_results = []
-            
-            for result in data['organic'][:4]:  # Top 4 results
-                comparison_results.append({
-                    "title": result.get('title', 'N/A'),
-                    "snippet": result.get('snippet', 'No description'),
-                    "link": result.get('link', ''),
-                    "source": result.get('source', 'Unknown')
-                })
-            
-            return {
-                "success": True,
-                "query": query,
-                "results": comparison_results,
-                "result_count": len(comparison_results)
-            }
-        else:
-            return {
-                "success": False,
-                "message": "No comparison data found. Try being more specific with product names."
-            }
+        return _serper_result(query, data)
             
     except Exception as e:
         print(f"Error in product comparison: {e}")
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Keep-alive pools for outbound HTTP (Serper); sized per worker process
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+# Pooled connections idle longer than this are closed (httpx)
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# requests.Session is safe to share between threads for plain POSTs like ours
+http_session = _new_session()
+# (connect, read) for http_session calls; requests has no default timeout
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+class AsyncHTTPClient:
+    """Shared httpx.AsyncClient, created lazily so it binds to the event loop that serves requests"""
+
+    def __init__(self):
+        self._client = None
+
+    def get(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_SIZE,
+                    max_keepalive_connections=HTTP_POOL_SIZE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                )
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+async_http_client = AsyncHTTPClient()
+
+
+# ======================
+# LATENCY METRICS
+# ======================
+
+_stats_lock = threading.Lock()
+_hops: Dict[str, Dict[str, Any]] = {}
+
+
+def record_latency(hop: str, elapsed_ms: float, error: bool = False):
+    with _stats_lock:
+        stats = _hops.setdefault(hop, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+
+@contextmanager
+def timed_hop(hop: str):
+    """Record the latency of the enclosed call under `hop` (errors included)"""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record_latency(hop, (time.perf_counter() - start) * 1000, error)
+
+
+def http_client_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        hops = {
+            hop: {
+                **stats,
+                "total_ms": round(stats["total_ms"], 2),
+                "max_ms": round(stats["max_ms"], 2),
+                "avg_ms": round(stats["total_ms"] / stats["calls"], 2) if stats["calls"] else 0.0
+            }
+            for hop, stats in _hops.items()
+        }
+    return {
+        "pool_size": HTTP_POOL_SIZE,
+        "connect_timeout": HTTP_CONNECT_TIMEOUT,
+        "read_timeout": HTTP_READ_TIMEOUT,
+        "hops": hops
+    }
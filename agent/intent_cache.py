@@ -0,0 +1,161 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+
+from functions import redis_client
+from async_functions import async_redis_client
+
+load_dotenv()
+
+INTENT_CACHE_SIZE = int(os.getenv('INTENT_CACHE_SIZE', '5000'))
+INTENT_CACHE_TTL = float(os.getenv('INTENT_CACHE_TTL', '86400'))
+# Share classifications between workers through Redis (intent_cache:<digest>)
+INTENT_CACHE_REDIS = os.getenv('INTENT_CACHE_REDIS', '1') == '1'
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """Case, punctuation and spacing don't change the intent: "Where is my order??" == "where is my order" """
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", message.lower())).strip()
+
+
+class IntentCache:
+    """Bounded LRU + TTL cache of LLM intent classifications, keyed by normalized message.
+
+    The in-process tier answers repeats in microseconds; with `shared`, a miss also
+    checks Redis so one worker's classification serves all of them."""
+
+    def __init__(self, max_entries: int = INTENT_CACHE_SIZE, ttl: float = INTENT_CACHE_TTL, shared: bool = INTENT_CACHE_REDIS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        # normalized message -> (category, expires_at), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        self._stats = {
+            "hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+    def _redis_key(self, key: str) -> str:
+        return f"intent_cache:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def _get_local(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            category, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return category
+
+    def _put_local(self, key: str, category: str):
+        with self._lock:
+            self._entries[key] = (category, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _record(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _from_redis(self, key: str, value) -> Optional[str]:
+        if value is None:
+            self._record("misses")
+            return None
+        category = value.decode() if isinstance(value, bytes) else value
+        self._put_local(key, category)
+        self._record("redis_hits")
+        return category
+
+    def get(self, message: str) -> Optional[str]:
+        """Cached category for this message, or None"""
+        key = normalize_message(message)
+        category = self._get_local(key)
+        if category is not None:
+            return category
+        if not self.shared:
+            self._record("misses")
+            return None
+
+        try:
+            return self._from_redis(key, redis_client.get(self._redis_key(key)))
+        except Exception as e:
+            print(f"Error reading intent cache: {e}")
+            self._record("misses")
+            return None
+
+    async def aget(self, message: str) -> Optional[str]:
+        """Async get"""
+        key = normalize_message(message)
+        category = self._get_local(key)
+        if category is not None:
+            return category
+        if not self.shared:
+            self._record("misses")
+            return None
+
+        try:
+            return self._from_redis(key, await async_redis_client.get(self._redis_key(key)))
+        except Exception as e:
+            print(f"Error reading intent cache: {e}")
+            self._record("misses")
+            return None
+
+    def put(self, message: str, category: str):
+        key = normalize_message(message)
+        self._put_local(key, category)
+        self._record("stores")
+        if self.shared:
+            try:
+                redis_client.set(self._redis_key(key), category, ex=int(self.ttl))
+            except Exception as e:
+                print(f"Error writing intent cache: {e}")
+
+    async def aput(self, message: str, category: str):
+        """Async put"""
+        key = normalize_message(message)
+        self._put_local(key, category)
+        self._record("stores")
+        if self.shared:
+            try:
+                await async_redis_client.set(self._redis_key(key), category, ex=int(self.ttl))
+            except Exception as e:
+                print(f"Error writing intent cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        stats["shared"] = self.shared
+        lookups = stats["hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+intent_cache = IntentCache()
+
+
+def intent_cache_stats() -> Dict[str, Any]:
+    return intent_cache.stats()
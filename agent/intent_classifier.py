@@ -0,0 +1,114 @@
+import os
+import re
+import threading
+from typing import Dict, Any, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Below this confidence the message goes to the Gemini classifier
+INTENT_FASTPATH_THRESHOLD = float(os.getenv('INTENT_FASTPATH_THRESHOLD', '0.75'))
+
+# Product names the agents recognise; ProductDetailsAgent filters get_products by these
+PRODUCT_KEYWORDS = ['iphone', 'macbook', 'ipad', 'airpods', 'levi', 'nike', 'puma', 'adidas']
+
+# Keeps a single weak hit from ever being confident on its own
+_SMOOTHING = 0.25
+
+# (pattern, weight) per category. Strong phrases weigh 1.0, hints that also show up
+# in other intents weigh less so they only tip the balance together with something else.
+# Product names and sizes are not cues: every intent mentions them.
+_RULES = {
+    "INVENTORY_MANAGEMENT": [
+        (r"\border status\b|\bcheck (?:my )?orders?\b|\bmy orders?\b|\bwhere is my\b", 1.0),
+        (r"\btrack(?:ing)?\b|\bshipment\b|\bdelivery status\b", 1.0),
+        # Asking about the return/refund policy is not asking for a return
+        (r"\b(?:return|refund)\b(?! polic)|\bsend (?:it )?back\b|\bcancel\b", 1.0),
+        (r"\b(?:i )?(?:want|would like|like) to (?:buy|order|purchase)\b|\bplace an? order\b", 1.0),
+        # Imperative ("order the levi t-shirt M") or asking to buy ("can I order ...")
+        (r"^\s*(?:please\s+)?(?:order|buy|purchase)\b|\bcan i (?:buy|order|purchase|get)\b", 1.0),
+        # "available to order" asks about availability, not for an order
+        (r"(?<!available to )\b(?:buy|purchase|order)\b", 0.6),
+        (r"\bdeliver(?:ed|y)?\b|\bshipping\b", 0.4),
+    ],
+    "PRODUCT_COMPARISON": [
+        (r"\bvs\.?\b|\bversus\b", 1.0),
+        (r"\bcompar(?:e|ed|ing|ison)\b", 1.0),
+        (r"\bbetter than\b|\bwhich is better\b|\bdifference between\b", 1.0),
+        (r"\balternatives?\b|\bother brands\b|\bcompetitors?\b", 0.6),
+    ],
+    "PRODUCT_DETAILS": [
+        (r"\bhow much\b|\bprice\b|\bcost\b|\bpricing\b", 1.0),
+        (r"\bin stock\b|\bavailab(?:le|ility)\b|\bdo you (?:have|sell)\b", 1.0),
+        (r"\bspecs?\b|\bspecifications?\b|\bfeatures?\b", 1.0),
+        (r"\bshow me\b|\bcatalog(?:ue)?\b|\bwhat products\b|\bwhat do you sell\b", 1.0),
+        (r"\b(?:return|refund|shipping|delivery) polic(?:y|ies)\b|\bwarranty\b", 1.0),
+    ],
+}
+
+
+class IntentClassifier:
+    """Compiled keyword/regex rules that label obvious messages without calling the LLM.
+
+    Each category's score is the sum of its matching rule weights; confidence is the
+    winning score's share of all scores (smoothed), so conflicting cues stay low."""
+
+    def __init__(self, threshold: float = INTENT_FASTPATH_THRESHOLD):
+        self.threshold = threshold
+        self._rules = {
+            category: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in rules]
+            for category, rules in _RULES.items()
+        }
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "classified": 0,
+            "fast_path": 0,
+            "fallback": 0,
+            "fast_path_by_category": {category: 0 for category in _RULES}
+        }
+
+    def classify(self, message: str) -> Tuple[Optional[str], float]:
+        """Best category and its confidence (None, 0.0 when no rule matches)"""
+        scores = {}
+        for category, rules in self._rules.items():
+            score = sum(weight for pattern, weight in rules if pattern.search(message))
+            if score:
+                scores[category] = score
+
+        if not scores:
+            return None, 0.0
+
+        category = max(scores, key=scores.get)
+        confidence = scores[category] / (sum(scores.values()) + _SMOOTHING)
+        return category, round(confidence, 4)
+
+    def fast_path(self, message: str) -> Optional[str]:
+        """The category when the rules are confident enough, otherwise None (ask the LLM)"""
+        category, confidence = self.classify(message)
+        confident = category is not None and confidence >= self.threshold
+
+        with self._lock:
+            self._stats["classified"] += 1
+            if confident:
+                self._stats["fast_path"] += 1
+                self._stats["fast_path_by_category"][category] += 1
+            else:
+                self._stats["fallback"] += 1
+
+        return category if confident else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["fast_path_by_category"] = dict(self._stats["fast_path_by_category"])
+        stats["threshold"] = self.threshold
+        stats["fallback_rate"] = round(stats["fallback"] / stats["classified"], 4) if stats["classified"] else 0.0
+        return stats
+
+
+intent_classifier = IntentClassifier()
+
+
+def intent_classifier_stats() -> Dict[str, Any]:
+    return intent_classifier.stats()
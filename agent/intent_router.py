@@ -1,16 +1,38 @@
 import os
+import time
 from typing import TypedDict, Annotated, Sequence
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage, SystemMessage, AIMessage, BaseMessage
-from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END
 import operator
+from collections import Counter
 from dotenv import load_dotenv
 
-from functions import get_or_create_customer, load_previous_conversations_to_redis, manage_session_chat_history
+from functions import get_or_create_customer, manage_session_chat_history
+from async_functions import aget_or_create_customer, amanage_session_chat_history
 from ai_agents import ProductDetailsAgent, InventoryManagementAgent, ProductComparisonAgent
+from intent_classifier import intent_classifier
+from intent_cache import intent_cache
 
 load_dotenv()
 
+# Fetch read-only agent data for the likeliest intent (local rules) while the message is being classified
+SPECULATIVE_PREFETCH = os.getenv('SPECULATIVE_PREFETCH', '0') == '1'
+# Rule confidence needed to speculate; lower means more prefetches wasted on the wrong agent
+SPECULATIVE_MIN_CONFIDENCE = float(os.getenv('SPECULATIVE_MIN_CONFIDENCE', '0.4'))
+
+# Category -> specialist node
+AGENT_NODES = {
+    "PRODUCT_DETAILS": "product_details_agent",
+    "INVENTORY_MANAGEMENT": "inventory_management_agent",
+    "PRODUCT_COMPARISON": "product_comparison_agent"
+}
+
+def _merge_timings(left: dict, right: dict) -> dict:
+    """Reducer for node_timings: parallel branches each add their own nodes"""
+    return {**(left or {}), **(right or {})}
+
 class IntentRouterState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], operator.add]
     phone_no: str
@@ -20,7 +42,10 @@ class IntentRouterState(TypedDict):
     is_new_user: bool
     previous_conversations: dict
     message_category: str
+    chat_context: str
+    prefetched: dict
     agent_response: str
+    node_timings: Annotated[dict, _merge_timings]
     
 class IntentRouter:
     def __init__(self):
@@ -33,36 +58,59 @@ class IntentRouter:
         self.product_details_agent = ProductDetailsAgent()
         self.inventory_management_agent = InventoryManagementAgent()
         self.product_comparison_agent = ProductComparisonAgent()
+        self.specialists = {
+            "product_details_agent": self.product_details_agent,
+            "inventory_management_agent": self.inventory_management_agent,
+            "product_comparison_agent": self.product_comparison_agent
+        }
+
+        # Per-node run counts and classifier LLM calls, see call_stats()
+        self.node_calls = Counter()
+        self.classifier_calls = 0
+        # Per-node wall time, and time saved by running the two branches side by side
+        self.node_ms = Counter()
+        self.parallel_saved_ms = 0.0
+        self.workflows = 0
+        # Speculative prefetches: launched, then used by the chosen agent or wasted
+        self.speculation = Counter()
         
         self.graph = self._create_graph()
+        # Stops at dispatch; astream_user_message runs the chosen agent itself to stream its reply
+        self.context_graph = self._create_graph(with_agents=False)
     
-    def _create_graph(self):
+    def _create_graph(self, with_agents: bool = True):
         workflow = StateGraph(IntentRouterState)
 
-        workflow.add_node("user_checker", self._user_checker_node)
-        workflow.add_node("load_conversations", self._load_conversations_node)
-        workflow.add_node("new_user_handler", self._new_user_handler_node)
-        workflow.add_node("message_analyzer", self._message_analyzer_node)
-        workflow.add_node("product_details_agent", self._product_details_agent_node)
-        workflow.add_node("inventory_management_agent", self._inventory_management_agent_node)
-        workflow.add_node("product_comparison_agent", self._product_comparison_agent_node)
+        # Each node has a sync and an async implementation so the same graph
+        # serves graph.invoke (scripts) and graph.ainvoke (FastAPI)
+        workflow.add_node("user_checker", self._timed_node("user_checker", self._user_checker_node, self._auser_checker_node))
+        workflow.add_node("load_conversations", self._timed_node("load_conversations", self._load_conversations_node, self._aload_conversations_node))
+        workflow.add_node("message_analyzer", self._timed_node("message_analyzer", self._message_analyzer_node, self._amessage_analyzer_node))
+        if SPECULATIVE_PREFETCH:
+            workflow.add_node("prefetch", self._timed_node("prefetch", self._prefetch_node, self._aprefetch_node))
+        workflow.add_node("dispatch", self._timed_node("dispatch", self._dispatch_node, self._adispatch_node))
 
-        workflow.set_entry_point("user_checker")
+        # Classification needs only the message, so it runs alongside the customer
+        # branch (customer lookup -> chat context) and both meet at dispatch
+        workflow.add_edge(START, "user_checker")
+        workflow.add_edge(START, "message_analyzer")
+        workflow.add_edge("user_checker", "load_conversations")
+        if SPECULATIVE_PREFETCH:
+            workflow.add_edge(START, "prefetch")
+            workflow.add_edge(["load_conversations", "message_analyzer", "prefetch"], "dispatch")
+        else:
+            workflow.add_edge(["load_conversations", "message_analyzer"], "dispatch")
 
-        workflow.add_conditional_edges(
-            "user_checker",
-            self._route_by_user_type,
-            {
-                "load_conversations": "load_conversations",
-                "new_user": "new_user_handler"
-            }
-        )
+        if not with_agents:
+            workflow.add_edge("dispatch", END)
+            return workflow.compile()
 
-        workflow.add_edge("load_conversations", "message_analyzer")
-        workflow.add_edge("new_user_handler", "message_analyzer")
+        workflow.add_node("product_details_agent", self._timed_node("product_details_agent", self._product_details_agent_node, self._aproduct_details_agent_node))
+        workflow.add_node("inventory_management_agent", self._timed_node("inventory_management_agent", self._inventory_management_agent_node, self._ainventory_management_agent_node))
+        workflow.add_node("product_comparison_agent", self._timed_node("product_comparison_agent", self._product_comparison_agent_node, self._aproduct_comparison_agent_node))
 
         workflow.add_conditional_edges(
-            "message_analyzer",
+            "dispatch",
             self._route_to_agent,
             {
                 "product_details": "product_details_agent",
@@ -77,8 +125,26 @@ class IntentRouter:
         
         return workflow.compile()
     
+    def _timed_node(self, node: str, func, afunc):
+        """Wrap a node's sync/async implementations so each run reports its wall time in node_timings"""
+        def run(state: IntentRouterState):
+            start = time.perf_counter()
+            return self._with_timing(node, func(state), start)
+
+        async def arun(state: IntentRouterState):
+            start = time.perf_counter()
+            return self._with_timing(node, await afunc(state), start)
+
+        return RunnableLambda(run, afunc=arun)
+    
+    def _with_timing(self, node: str, update: dict, start: float):
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+        self.node_ms[node] += elapsed_ms
+        return {**update, "node_timings": {node: elapsed_ms}}
+    
     def _user_checker_node(self, state: IntentRouterState):
         """Check if user is new or existing"""
+        self.node_calls["user_checker"] += 1
         phone_no = state["phone_no"]
         whatsapp_name = state["whatsapp_name"]
         
@@ -90,29 +156,98 @@ class IntentRouter:
             "is_new_user": is_new_user
         }
     
-    def _route_by_user_type(self, state: IntentRouterState):
-        """Route based on user type"""
-        if state["is_new_user"]:
-            return "new_user"
-        else:
-            return "load_conversations"
+    async def _auser_checker_node(self, state: IntentRouterState):
+        self.node_calls["user_checker"] += 1
+        customer_result = await aget_or_create_customer(state["phone_no"], state["whatsapp_name"])
+        
+        return {
+            "customer_data": customer_result,
+            "is_new_user": customer_result.get("created", False)
+        }
     
     def _load_conversations_node(self, state: IntentRouterState):
-        """Load previous conversations for existing users"""
-        phone_no = state["phone_no"]
+        """Read the chat context (hydrating stored history when the session is short) off the classification path"""
+        self.node_calls["load_conversations"] += 1
+        if state["is_new_user"]:
+            return self._new_user_conversations()
         
-        conversation_result = load_previous_conversations_to_redis(phone_no, limit=20)
+        chat_context = manage_session_chat_history(state["phone_no"], get_context=True)
+        return self._conversations_update(chat_context)
+    
+    async def _aload_conversations_node(self, state: IntentRouterState):
+        self.node_calls["load_conversations"] += 1
+        if state["is_new_user"]:
+            return self._new_user_conversations()
         
-        return {"previous_conversations": conversation_result}
+        chat_context = await amanage_session_chat_history(state["phone_no"], get_context=True)
+        return self._conversations_update(chat_context)
     
-    def _new_user_handler_node(self, state: IntentRouterState):
-        """Handle new users - no conversation loading needed"""
-        return {"previous_conversations": {"loaded": False, "message": "New user - no previous conversations"}}
+    def _conversations_update(self, chat_context: dict):
+        return {
+            "previous_conversations": {
+                "loaded": bool(chat_context.get("history_messages")),
+                "message": "Previous conversations are loaded with the chat context when needed"
+            },
+            "chat_context": chat_context.get("context", "No previous conversation.")
+        }
     
-    def _message_analyzer_node(self, state: IntentRouterState):
-        """Analyze user message using Gemini LLM to categorize intent"""
-        user_message = state["user_message"]
-        
+    def _new_user_conversations(self):
+        """New users - no conversation loading needed"""
+        self.node_calls["new_user_handler"] += 1
+        return {
+            "previous_conversations": {"loaded": False, "message": "New user - no previous conversations"},
+            "chat_context": "No previous conversation."
+        }
+    
+    def _speculation_target(self, user_message: str):
+        """Specialist node the local rules expect, when they are sure enough to fetch for it"""
+        category, confidence = intent_classifier.classify(user_message)
+        if category is None or confidence < SPECULATIVE_MIN_CONFIDENCE:
+            self.speculation["skipped"] += 1
+            return None, None
+        return category, AGENT_NODES[category]
+    
+    def _prefetch_node(self, state: IntentRouterState):
+        """Speculative branch: start the likely agent's read-only fetch while the intent is classified"""
+        self.node_calls["prefetch"] += 1
+        category, node = self._speculation_target(state["user_message"])
+        data = self.specialists[node].speculative_fetch(state["user_message"], state["phone_no"]) if node else None
+        return self._prefetch_update(category, data)
+    
+    async def _aprefetch_node(self, state: IntentRouterState):
+        self.node_calls["prefetch"] += 1
+        category, node = self._speculation_target(state["user_message"])
+        data = await self.specialists[node].aspeculative_fetch(state["user_message"], state["phone_no"]) if node else None
+        return self._prefetch_update(category, data)
+    
+    def _prefetch_update(self, category, data):
+        if data is None:
+            return {"prefetched": {}}
+        self.speculation["launched"] += 1
+        return {"prefetched": {"category": category, "data": data}}
+    
+    def _prefetch_usable(self, prefetched: dict, state: IntentRouterState):
+        """Fetched for the intent that won, and (for customer data) for a customer that already existed"""
+        if prefetched["category"] != state["message_category"]:
+            return False
+        if self.specialists[AGENT_NODES[prefetched["category"]]].speculation_needs_customer:
+            # The prefetch ran before user_checker: for a new customer, or when the lookup
+            # failed, it read someone who wasn't there ("No customer found")
+            return not state["is_new_user"] and state["customer_data"].get("found", False)
+        return True
+    
+    def _take_prefetched(self, state: IntentRouterState):
+        """The speculative data if it is usable for this message, else None (counted as wasted)"""
+        prefetched = state.get("prefetched") or {}
+        if not prefetched:
+            return None
+        if self._prefetch_usable(prefetched, state):
+            self.speculation["used"] += 1
+            return prefetched["data"]
+        self.speculation["wasted"] += 1
+        return None
+    
+    def _classification_messages(self, user_message: str):
         system_prompt = """You are a message categorization expert. Analyze the user's message and classify it into ONE of these categories:
 
 1. PRODUCT_DETAILS - User wants information about products, specifications, features, pricing, availability
@@ -121,20 +256,65 @@ class IntentRouter:
 
 Respond with ONLY the category name: PRODUCT_DETAILS, INVENTORY_MANAGEMENT, or PRODUCT_COMPARISON"""
 
-        messages = [
+        return [
             SystemMessage(content=system_prompt),
             HumanMessage(content=f"Categorize this message: '{user_message}'")
         ]
-        
-        response = self.llm.invoke(messages)
-        category = response.content.strip().upper()
+    
+    def _parse_category(self, content: str) -> str:
+        category = content.strip().upper()
 
         valid_categories = ["PRODUCT_DETAILS", "INVENTORY_MANAGEMENT", "PRODUCT_COMPARISON"]
         if category not in valid_categories:
             category = "PRODUCT_DETAILS" 
         
+        return category
+    
+    def _message_analyzer_node(self, state: IntentRouterState):
+        """Categorize intent: local rules for obvious messages, then cached LLM answers, then Gemini LLM"""
+        self.node_calls["message_analyzer"] += 1
+        category = intent_classifier.fast_path(state["user_message"]) or intent_cache.get(state["user_message"])
+        if category:
+            return {"message_category": category}
+
+        messages = self._classification_messages(state["user_message"])
+        
+        self.classifier_calls += 1
+        response = self.llm.invoke(messages)
+        category = self._parse_category(response.content)
+        intent_cache.put(state["user_message"], category)
+        
         return {"message_category": category}
     
+    async def _amessage_analyzer_node(self, state: IntentRouterState):
+        self.node_calls["message_analyzer"] += 1
+        category = intent_classifier.fast_path(state["user_message"]) or await intent_cache.aget(state["user_message"])
+        if category:
+            return {"message_category": category}
+
+        messages = self._classification_messages(state["user_message"])
+        
+        self.classifier_calls += 1
+        response = await self.llm.ainvoke(messages)
+        category = self._parse_category(response.content)
+        await intent_cache.aput(state["user_message"], category)
+        
+        return {"message_category": category}
+    
+    def _dispatch_node(self, state: IntentRouterState):
+        """Join point of the customer and classification branches; records what running them in parallel saved"""
+        self.node_calls["dispatch"] += 1
+        timings = state.get("node_timings") or {}
+        customer_branch_ms = timings.get("user_checker", 0.0) + timings.get("load_conversations", 0.0)
+        # Sequentially the shorter branches would have been paid on top of the longest one
+        branches = [customer_branch_ms, timings.get("message_analyzer", 0.0), timings.get("prefetch", 0.0)]
+        self.parallel_saved_ms += sum(branches) - max(branches)
+        self.workflows += 1
+        return {}
+    
+    async def _adispatch_node(self, state: IntentRouterState):
+        return self._dispatch_node(state)
+    
     def _route_to_agent(self, state: IntentRouterState):
         """Route to appropriate AI agent based on message category"""
         category = state["message_category"]
@@ -148,68 +328,87 @@ Respond with ONLY the category name: PRODUCT_DETAILS, INVENTORY_MANAGEMENT, or P
         else:
             return "product_details"  
     
-    def _product_details_agent_node(self, state: IntentRouterState):
-        """PRODUCT_DETAILS AI Agent - handles product information requests"""
+    def _run_specialist(self, node: str, state: IntentRouterState):
+        """Answer with the node's specialist agent: exactly one generation call, with the session context"""
+        self.node_calls[node] += 1
         user_message = state["user_message"]
         phone_no = state["phone_no"]
-        customer_data = state["customer_data"]
-        previous_conversations = state["previous_conversations"]
 
-        chat_context = manage_session_chat_history(phone_no, get_context=True)
-        formatted_context = chat_context.get("context", "No previous conversation.")
+        # Read by load_conversations in parallel with classification
+        formatted_context = state["chat_context"]
 
-        agent_response = self.product_details_agent.process_message(
-            user_message, phone_no, customer_data, previous_conversations, formatted_context
+        agent_response = self.specialists[node].process_message(
+            user_message, phone_no, state["customer_data"], state["previous_conversations"], formatted_context,
+            prefetched=self._take_prefetched(state)
         )
-        
+
         manage_session_chat_history(phone_no, user_message, agent_response)
-        
+
         return {"agent_response": agent_response}
-    
-    def _inventory_management_agent_node(self, state: IntentRouterState):
-        """INVENTORY_MANAGEMENT AI Agent - handles orders, returns, status checks"""
+
+    async def _arun_specialist(self, node: str, state: IntentRouterState):
+        self.node_calls[node] += 1
         user_message = state["user_message"]
         phone_no = state["phone_no"]
-        customer_data = state["customer_data"]
-        previous_conversations = state["previous_conversations"]
-        
-        agent_response = self.inventory_management_agent.process_message(user_message, phone_no, customer_data, previous_conversations)
 
-        chat_context = manage_session_chat_history(phone_no, get_context=True)
-        formatted_context = chat_context.get("context", "No previous conversation.")
-        
+        formatted_context = state["chat_context"]
 
-        agent_response = self.product_details_agent.process_message(
-            user_message, phone_no, customer_data, previous_conversations, formatted_context
+        agent_response = await self.specialists[node].aprocess_message(
+            user_message, phone_no, state["customer_data"], state["previous_conversations"], formatted_context,
+            prefetched=self._take_prefetched(state)
         )
 
-        manage_session_chat_history(phone_no, user_message, agent_response)
+        await amanage_session_chat_history(phone_no, user_message, agent_response)
 
         return {"agent_response": agent_response}
+
+    def _product_details_agent_node(self, state: IntentRouterState):
+        """PRODUCT_DETAILS AI Agent - handles product information requests"""
+        return self._run_specialist("product_details_agent", state)
+    
+    def _inventory_management_agent_node(self, state: IntentRouterState):
+        """INVENTORY_MANAGEMENT AI Agent - handles orders, returns, status checks"""
+        return self._run_specialist("inventory_management_agent", state)
     
     def _product_comparison_agent_node(self, state: IntentRouterState):
         """PRODUCT_COMPARISON AI Agent - handles product comparisons"""
-        user_message = state["user_message"]
-        phone_no = state["phone_no"]
-        customer_data = state["customer_data"]
-        previous_conversations = state["previous_conversations"]
-
-        agent_response = self.product_comparison_agent.process_message(user_message, phone_no, customer_data, previous_conversations)
-
-        chat_context = manage_session_chat_history(phone_no, get_context=True)
-        formatted_context = chat_context.get("context", "No previous conversation.")
-
-        agent_response = self.product_details_agent.process_message(
-            user_message, phone_no, customer_data, previous_conversations, formatted_context
-        )
-
-        manage_session_chat_history(phone_no, user_message, agent_response)
-
-        return {"agent_response": agent_response}
+        return self._run_specialist("product_comparison_agent", state)
     
-    def process_user_message(self, phone_no: str, user_message: str, whatsapp_name: str = "Unknown"):
-        """Full workflow: Check user → Load conversations → Analyze → Route to appropriate AI agent"""
-        result = self.graph.invoke({
+    async def _aproduct_details_agent_node(self, state: IntentRouterState):
+        return await self._arun_specialist("product_details_agent", state)
+    
+    async def _ainventory_management_agent_node(self, state: IntentRouterState):
+        return await self._arun_specialist("inventory_management_agent", state)
+    
+    async def _aproduct_comparison_agent_node(self, state: IntentRouterState):
+        return await self._arun_specialist("product_comparison_agent", state)
+    
+    def call_stats(self):
+        """How often each node ran and how many LLM generations each one made"""
+        generation_calls = {"message_analyzer": self.classifier_calls}
+        for node, agent in self.specialists.items():
+            generation_calls[node] = agent.generation_calls
+        return {
+            "node_calls": dict(self.node_calls),
+            "generation_calls": generation_calls,
+            "avg_node_ms": {node: round(ms / self.node_calls[node], 2) for node, ms in self.node_ms.items() if self.node_calls[node]},
+            "avg_parallel_saved_ms": round(self.parallel_saved_ms / self.workflows, 2) if self.workflows else 0.0,
+            "speculation": self.speculation_stats()
+        }
+    
+    def speculation_stats(self):
+        launched = self.speculation["launched"]
+        return {
+            "enabled": SPECULATIVE_PREFETCH,
+            "launched": launched,
+            "used": self.speculation["used"],
+            "wasted": self.speculation["wasted"],
+            "skipped": self.speculation["skipped"],
+            "hit_rate": round(self.speculation["used"] / launched, 4) if launched else 0.0
+        }
+    
+    def _initial_state(self, phone_no: str, user_message: str, whatsapp_name: str):
+        return {
             "messages": [],
             "phone_no": phone_no,
             "whatsapp_name": whatsapp_name,
@@ -218,17 +417,64 @@ Respond with ONLY the category name: PRODUCT_DETAILS, INVENTORY_MANAGEMENT, or P
             "is_new_user": False,
             "previous_conversations": {},
             "message_category": "",
-            "agent_response": ""
-        })
-        
+            "chat_context": "",
+            "prefetched": {},
+            "agent_response": "",
+            "node_timings": {}
+        }
+    
+    def _workflow_result(self, result, phone_no: str, user_message: str):
         return {
             "is_new_user": result["is_new_user"],
             "customer_data": result["customer_data"],
             "previous_conversations": result["previous_conversations"],
             "message_category": result["message_category"],
             "agent_response": result["agent_response"],
+            "node_timings": result["node_timings"],
+            "speculation": self._speculation_outcome(result),
             "user_message": user_message,
             "phone_no": phone_no
         }
-
-        
\ No newline at end of file
+    
+    def _speculation_outcome(self, result):
+        prefetched = result.get("prefetched") or {}
+        if not SPECULATIVE_PREFETCH:
+            return "off"
+        if not prefetched:
+            return "skipped"
+        return "used" if self._prefetch_usable(prefetched, result) else "wasted"
+    
+    def process_user_message(self, phone_no: str, user_message: str, whatsapp_name: str = "Unknown"):
+        """Full workflow: (Check user → Load conversations) in parallel with Analyze → Route to appropriate AI agent"""
+        result = self.graph.invoke(self._initial_state(phone_no, user_message, whatsapp_name))
+        
+        return self._workflow_result(result, phone_no, user_message)
+    
+    async def aprocess_user_message(self, phone_no: str, user_message: str, whatsapp_name: str = "Unknown"):
+        """Async process_user_message: the whole graph runs without blocking the event loop"""
+        result = await self.graph.ainvoke(self._initial_state(phone_no, user_message, whatsapp_name))
+        
+        return self._workflow_result(result, phone_no, user_message)
+    
+    async def astream_user_message(self, phone_no: str, user_message: str, whatsapp_name: str = "Unknown"):
+        """Streaming aprocess_user_message: yields {"type": "chunk", "text"} events as the agent generates
+        its reply, then one {"type": "done", ...workflow result} event"""
+        state = await self.context_graph.ainvoke(self._initial_state(phone_no, user_message, whatsapp_name))
+        
+        node = AGENT_NODES.get(state["message_category"], "product_details_agent")
+        self.node_calls[node] += 1
+        start = time.perf_counter()
+        
+        parts = []
+        async for text in self.specialists[node].astream_message(
+            user_message, phone_no, state["customer_data"], state["previous_conversations"], state["chat_context"],
+            prefetched=self._take_prefetched(state)
+        ):
+            parts.append(text)
+            yield {"type": "chunk", "text": text}
+        
+        state["agent_response"] = "".join(parts)
+        await amanage_session_chat_history(phone_no, user_message, state["agent_response"])
+        state["node_timings"] = _merge_timings(state["node_timings"], self._with_timing(node, {}, start)["node_timings"])
+        
+        yield {"type": "done", **self._workflow_result(state, phone_no, user_message)}
@@ -0,0 +1,29 @@
+-- Publish product changes on the catalog_changed channel so every agent worker
+-- can patch or drop its in-process catalog cache (see catalog_cache.py).
+-- Enable the listener with CATALOG_NOTIFY_CHANNEL=catalog_changed.
+
+CREATE OR REPLACE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.product_id = OLD.product_id
+       AND NEW.product_name IS NOT DISTINCT FROM OLD.product_name
+       AND NEW.size IS NOT DISTINCT FROM OLD.size
+       AND NEW.price IS NOT DISTINCT FROM OLD.price THEN
+        -- Stock-only change: listeners patch the row in place
+        PERFORM pg_notify('catalog_changed', json_build_object(
+            'op', 'UPDATE',
+            'product_id', NEW.product_id,
+            'stock_quantity', NEW.stock_quantity
+        )::text);
+    ELSE
+        -- Anything else: listeners reload the catalog
+        PERFORM pg_notify('catalog_changed', json_build_object('op', TG_OP)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_catalog_notify ON products;
+CREATE TRIGGER products_catalog_notify
+    AFTER INSERT OR UPDATE OR DELETE ON products
+    FOR EACH ROW EXECUTE FUNCTION notify_catalog_change();
@@ -0,0 +1,9 @@
+-- Required for INVENTORY_MODE=redis (agent/stock_reservation.py).
+-- Each write-behind flush records its id here in the same transaction that applies
+-- its stock deltas, so a flush retried after a crash is never applied twice.
+CREATE TABLE IF NOT EXISTS stock_flushes (
+    flush_id TEXT PRIMARY KEY,
+    flushed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS stock_flushes_flushed_at_idx ON stock_flushes (flushed_at);
@@ -0,0 +1,12 @@
+-- Required for INVENTORY_MODE=redis (agent/stock_reservation.py).
+-- A return records the units it gives back here, in the transaction that inserts the
+-- return, so they are restored even if the Redis release after the commit fails.
+-- The stock flush replays rows older than STOCK_RELEASE_GRACE_SECONDS and deletes them.
+CREATE TABLE IF NOT EXISTS stock_releases (
+    return_id INTEGER PRIMARY KEY REFERENCES returns (return_id),
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS stock_releases_created_at_idx ON stock_releases (created_at);
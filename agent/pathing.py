@@ -1,9 +1,22 @@
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any
 import os
+import json
+import time
+import asyncio
 from dotenv import load_dotenv
 from intent_router import IntentRouter
+from db_pool import db_pool_stats, async_db_pool
+from archiver import archive_idle_sessions, migrate_blob_sessions, ARCHIVE_INTERVAL_SECONDS
+from catalog_cache import start_catalog_listener, catalog_cache_stats
+from intent_classifier import intent_classifier_stats
+from intent_cache import intent_cache_stats
+from customer_cache import customer_cache_stats
+from serper_cache import serper_cache_stats
+from http_clients import async_http_client, timed_hop, record_latency, http_client_stats
+from stock_reservation import redis_inventory_enabled, reconcile_stock, flush_pending_stock, replay_stock_releases, stock_reservation_stats, STOCK_FLUSH_INTERVAL_SECONDS
 
 load_dotenv()
 
@@ -11,6 +24,10 @@ app = FastAPI()
 
 intent_router = IntentRouter()
 
+# Set ARCHIVER_IN_PROCESS=0 when sessions are archived by a separate `python archiver.py` worker
+ARCHIVER_IN_PROCESS = os.getenv('ARCHIVER_IN_PROCESS', '1') == '1'
+archiver_stats = {"runs": 0, "archived": 0, "failed": 0, "reclaimed": 0, "rows": 0, "db_seconds": 0.0, "rows_per_sec": 0.0}
+
 
 class QueryRequest(BaseModel):
     query: str
@@ -22,6 +39,9 @@ class QueryResponse(BaseModel):
     intent: str
     entities: Dict[str, Any]
     agent_used: str
+    # Whether speculative prefetch (SPECULATIVE_PREFETCH=1) was used, wasted, skipped or off
+    speculation: str = "off"
+    node_timings: Dict[str, float] = {}
 
 
 @app.post("/agent", response_model=QueryResponse)
@@ -32,17 +52,20 @@ async def agent_endpoint(request: QueryRequest):
         phone_number = request.phone_number
         whatsapp_name = request.whatsapp_name  
         
-        result = intent_router.process_user_message(
-            phone_no=phone_number,
-            user_message=user_message,
-            whatsapp_name=whatsapp_name
-        )
+        with timed_hop("agent"):
+            result = await intent_router.aprocess_user_message(
+                phone_no=phone_number,
+                user_message=user_message,
+                whatsapp_name=whatsapp_name
+            )
         
         return QueryResponse(
             response=result["agent_response"],
             intent=result.get("message_category", "unknown"),
             entities={},
-            agent_used="langgraph_agent"
+            agent_used="langgraph_agent",
+            speculation=result["speculation"],
+            node_timings=result["node_timings"]
         )
         
     except Exception as e:
@@ -56,6 +79,43 @@ async def agent_endpoint(request: QueryRequest):
             agent_used="error_handler"
         )
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/agent/stream")
+async def agent_stream_endpoint(request: QueryRequest):
+    """/agent as server-sent events: `chunk` events carry reply text as it is generated, then one `done` event"""
+    async def events():
+        start = time.perf_counter()
+        first_chunk = True
+        try:
+            async for event in intent_router.astream_user_message(
+                phone_no=request.phone_number,
+                user_message=request.query,
+                whatsapp_name=request.whatsapp_name
+            ):
+                if event["type"] == "chunk":
+                    if first_chunk:
+                        record_latency("agent_first_chunk", (time.perf_counter() - start) * 1000)
+                        first_chunk = False
+                    yield _sse("chunk", {"text": event["text"]})
+                else:
+                    record_latency("agent_stream", (time.perf_counter() - start) * 1000)
+                    yield _sse("done", {
+                        "response": event["agent_response"],
+                        "intent": event.get("message_category", "unknown"),
+                        "speculation": event["speculation"],
+                        "node_timings": event["node_timings"]
+                    })
+        except Exception as e:
+            print(f"🔥 STREAM ERROR: {e}")
+            import traceback
+            traceback.print_exc()
+            record_latency("agent_stream", (time.perf_counter() - start) * 1000, error=True)
+            yield _sse("error", {"response": "Sorry, I'm experiencing technical difficulties. Please try again."})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -65,7 +125,74 @@ async def health_check():
         "agents": ["product_info", "inventory", "order", "comparison"]
     }
 
+async def _archive_sessions_periodically():
+    """Background archiver: moves idle Redis sessions to Postgres off the request path"""
+    await asyncio.to_thread(migrate_blob_sessions)
+    while True:
+        stats = await asyncio.to_thread(archive_idle_sessions)
+        archiver_stats["runs"] += 1
+        archiver_stats["archived"] += stats["archived"]
+        archiver_stats["failed"] += stats["failed"]
+        archiver_stats["reclaimed"] += stats["reclaimed"]
+        archiver_stats["rows"] += stats["rows"]
+        archiver_stats["db_seconds"] += stats["db_seconds"]
+        if archiver_stats["db_seconds"] > 0:
+            archiver_stats["rows_per_sec"] = round(archiver_stats["rows"] / archiver_stats["db_seconds"], 1)
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+async def _flush_stock_periodically():
+    """INVENTORY_MODE=redis: write Redis stock deltas behind to Postgres in batches"""
+    while True:
+        await asyncio.sleep(STOCK_FLUSH_INTERVAL_SECONDS)
+        try:
+            # Returns whose release after the commit failed go out with this flush
+            await asyncio.to_thread(replay_stock_releases)
+            await asyncio.to_thread(flush_pending_stock)
+        except Exception as e:
+            print(f"Stock flush error: {e}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    start_catalog_listener()
+    if ARCHIVER_IN_PROCESS:
+        app.state.archiver_task = asyncio.create_task(_archive_sessions_periodically())
+    if redis_inventory_enabled():
+        reconciled = await asyncio.to_thread(reconcile_stock)
+        print(f"Stock counters reconciled: {reconciled}")
+        app.state.stock_flush_task = asyncio.create_task(_flush_stock_periodically())
+
+@app.on_event("shutdown")
+async def close_pools():
+    archiver_task = getattr(app.state, "archiver_task", None)
+    if archiver_task:
+        archiver_task.cancel()
+    stock_flush_task = getattr(app.state, "stock_flush_task", None)
+    if stock_flush_task:
+        stock_flush_task.cancel()
+        # Don't leave this worker's last deltas waiting for another worker's flush
+        await asyncio.to_thread(flush_pending_stock)
+    await async_db_pool.close()
+    await async_http_client.close()
+
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics for this worker"""
+    return {
+        "db_pool": db_pool_stats(),
+        "archiver": archiver_stats,
+        "catalog_cache": catalog_cache_stats(),
+        "intent_router": intent_router.call_stats(),
+        "intent_classifier": intent_classifier_stats(),
+        "intent_cache": intent_cache_stats(),
+        "customer_cache": customer_cache_stats(),
+        "serper_cache": serper_cache_stats(),
+        "inventory": stock_reservation_stats(),
+        "http": http_client_stats()
+    }
+
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("pathing:app", host="0.0.0.0", port=5000, reload=True)
\ No newline at end of file
+    # Longer than uvicorn's 5 s default so the backend's pooled keep-alive connections stay usable
+    uvicorn.run("pathing:app", host="0.0.0.0", port=5000, reload=True,
+                timeout_keep_alive=int(os.getenv('AGENT_KEEPALIVE_SECONDS', '75')))
\ No newline at end of file
@@ -0,0 +1,139 @@
+import re
+import math
+import bisect
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Set
+
+# Fuzzy matches below this trigram similarity are not returned
+FUZZY_MIN_SIMILARITY = 0.3
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# Words of a customer message that say nothing about which product they mean
+_STOP_WORDS = {
+    "a", "about", "all", "an", "and", "any", "are", "available", "buy", "can", "catalog", "do", "does",
+    "everything", "for", "get", "have", "hello", "hi", "how", "i", "in", "is", "it", "looking", "me",
+    "much", "my", "need", "of", "on", "or", "our", "please", "price", "prices", "product", "products",
+    "show", "some", "stock", "tell", "that", "the", "there", "this", "to", "us", "want", "we", "what",
+    "with", "you", "your"
+}
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ProductSearchIndex:
+    """Trigram index over product names.
+
+    Answers LOWER(product_name) LIKE '%term%' without scanning every name: the
+    posting lists of the term's trigrams are intersected and only the survivors
+    are checked with a real substring test. Rows keep their catalog positions, so
+    results come back in catalog order unless ranked."""
+
+    def __init__(self, rows: Sequence[Sequence]):
+        self._names = [row[1].lower() for row in rows]
+        self._gram_counts = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._word_postings: Dict[str, List[int]] = defaultdict(list)
+
+        for position, name in enumerate(self._names):
+            grams = _trigrams(name)
+            self._gram_counts.append(len(grams))
+            # Positions are appended in order, so every posting list stays sorted
+            for gram in grams:
+                self._postings[gram].append(position)
+            for word in set(_WORD.findall(name)):
+                self._word_postings[word].append(position)
+
+        # Sorted so the words starting with a prefix are one contiguous range
+        self._vocabulary = sorted(self._word_postings)
+
+    def __len__(self):
+        return len(self._names)
+
+    def find(self, term: str) -> List[int]:
+        """Positions of names containing `term` (case-insensitive), in catalog order"""
+        term = term.lower()
+        if len(term) < 3:
+            # Too short to have a trigram; these are rare and cheap enough to scan
+            return [i for i, name in enumerate(self._names) if term in name]
+
+        postings = sorted((self._postings.get(gram, []) for gram in _trigrams(term)), key=len)
+        if not postings[0]:
+            return []
+
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+
+        return sorted(i for i in candidates if term in self._names[i])
+
+    def rank_key(self, term: str, position: int):
+        """Sort key: exact name, then prefix, then word-prefix, then any substring; closer length first"""
+        term = term.lower()
+        name = self._names[position]
+        if name == term:
+            match_class = 0
+        elif name.startswith(term):
+            match_class = 1
+        elif any(word.startswith(term) for word in name.split()):
+            match_class = 2
+        else:
+            match_class = 3
+        return (match_class, len(name) - len(term), position)
+
+    def rank(self, term: str, positions: List[int]) -> List[int]:
+        return sorted(positions, key=lambda position: self.rank_key(term, position))
+
+    def similar(self, term: str, limit: int = 10, min_similarity: float = FUZZY_MIN_SIMILARITY) -> List[int]:
+        """Positions of names sharing enough trigrams with `term` (typos, word order), best first"""
+        grams = _trigrams(term.lower())
+        if not grams:
+            return []
+
+        shared = defaultdict(int)
+        for gram in grams:
+            for position in self._postings.get(gram, []):
+                shared[position] += 1
+
+        scored = []
+        for position, common in shared.items():
+            similarity = common / (len(grams) + self._gram_counts[position] - common)
+            if similarity >= min_similarity:
+                scored.append((-similarity, position))
+        scored.sort()
+        return [position for _, position in scored[:limit]]
+
+    def _word_matches(self, word: str) -> Set[int]:
+        """Positions of names containing `word`, or (3+ characters) a word starting with it: "levi" finds "levi's" """
+        if len(word) < 3:
+            return set(self._word_postings.get(word, []))
+        matches = set()
+        start = bisect.bisect_left(self._vocabulary, word)
+        for vocabulary_word in self._vocabulary[start:]:
+            if not vocabulary_word.startswith(word):
+                break
+            matches.update(self._word_postings[vocabulary_word])
+        return matches
+
+    def score(self, message: str) -> Dict[int, float]:
+        """Relevance of products to a free-form message: summed IDF of the message words each name matches"""
+        scores = defaultdict(float)
+        for word in set(_WORD.findall(message.lower())) - _STOP_WORDS:
+            matches = self._word_matches(word)
+            if not matches:
+                continue
+            # Rare words ("ultra", "airpods") say more than common ones ("pro", "shoes")
+            idf = math.log(1 + len(self._names) / len(matches))
+            for position in matches:
+                scores[position] += idf
+        return scores
+
+    def search(self, term: str, limit: Optional[int] = None, fuzzy: bool = False) -> List[int]:
+        """Ranked positions for `term`; with fuzzy=True, falls back to trigram similarity when nothing contains it"""
+        positions = self.rank(term, self.find(term))
+        if not positions and fuzzy:
+            positions = self.similar(term, limit or 10)
+        return positions[:limit] if limit else positions
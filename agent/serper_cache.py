@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+from dotenv import load_dotenv
+
+from functions import redis_client
+from async_functions import async_redis_client
+from intent_cache import normalize_message
+
+load_dotenv()
+
+SERPER_CACHE_SIZE = int(os.getenv('SERPER_CACHE_SIZE', '1000'))
+# Comparison reviews change slowly; a few hours of staleness is fine
+SERPER_CACHE_TTL = float(os.getenv('SERPER_CACHE_TTL', '21600'))
+# Share results between workers through Redis (serper_cache:<digest>)
+SERPER_CACHE_REDIS = os.getenv('SERPER_CACHE_REDIS', '1') == '1'
+# How long a coalesced caller waits for the leader's request before searching itself
+SERPER_CACHE_WAIT = float(os.getenv('SERPER_CACHE_WAIT', '15'))
+
+
+class _Flight:
+    """One outbound search that concurrent identical queries wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SerperCache:
+    """LRU + TTL cache of Serper comparison results keyed by normalized query, with single-flight.
+
+    Only successful searches are cached. Identical queries that miss at the same time
+    share one outbound request: the first caller searches, the rest wait for its result."""
+
+    def __init__(self, max_entries: int = SERPER_CACHE_SIZE, ttl: float = SERPER_CACHE_TTL, shared: bool = SERPER_CACHE_REDIS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        # normalized query -> (result, expires_at), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+        self._aflights: Dict[str, asyncio.Future] = {}
+
+        self._stats = {
+            "hits": 0,
+            "redis_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+    def _redis_key(self, key: str) -> str:
+        return f"serper_cache:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def _record(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            result, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return result
+
+    def _put_local(self, key: str, result: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (result, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _from_redis(self, key: str, value) -> Optional[Dict[str, Any]]:
+        if value is None:
+            return None
+        result = json.loads(value)
+        self._put_local(key, result)
+        self._record("redis_hits")
+        return result
+
+    def _store(self, key: str, result: Dict[str, Any]) -> bool:
+        """Keep successful results only; errors and "no results" may be transient"""
+        if not result.get("success"):
+            return False
+        self._put_local(key, result)
+        self._record("stores")
+        return True
+
+    # ======================
+    # SYNC API
+    # ======================
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self._get_local(key)
+        if result is not None or not self.shared:
+            return result
+        try:
+            return self._from_redis(key, redis_client.get(self._redis_key(key)))
+        except Exception as e:
+            print(f"Error reading serper cache: {e}")
+            return None
+
+    def fetch(self, query: str, search: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+        """Cached result for `query`, else `search(query)` (shared with concurrent identical calls)"""
+        key = normalize_message(query)
+        result = self._lookup(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            if flight.done.wait(SERPER_CACHE_WAIT) and flight.result is not None:
+                return flight.result
+            return search(query)
+
+        try:
+            flight.result = search(query)
+            if self._store(key, flight.result) and self.shared:
+                try:
+                    redis_client.set(self._redis_key(key), json.dumps(flight.result), ex=int(self.ttl))
+                except Exception as e:
+                    print(f"Error writing serper cache: {e}")
+            return flight.result
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    # ======================
+    # ASYNC API
+    # ======================
+
+    async def _alookup(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self._get_local(key)
+        if result is not None or not self.shared:
+            return result
+        try:
+            return self._from_redis(key, await async_redis_client.get(self._redis_key(key)))
+        except Exception as e:
+            print(f"Error reading serper cache: {e}")
+            return None
+
+    async def afetch(self, query: str, asearch: Callable[[str], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Async fetch"""
+        key = normalize_message(query)
+        result = await self._alookup(key)
+        if result is not None:
+            return result
+
+        # Single event loop: no lock needed between the check and the insert
+        flight = self._aflights.get(key)
+        if flight is not None:
+            self._record("coalesced")
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                # The leader's request was cancelled, not ours: search ourselves
+                if not flight.cancelled():
+                    raise
+                return await asearch(query)
+
+        flight = self._aflights[key] = asyncio.get_running_loop().create_future()
+        self._record("misses")
+        try:
+            result = await asearch(query)
+            if self._store(key, result) and self.shared:
+                try:
+                    await async_redis_client.set(self._redis_key(key), json.dumps(result), ex=int(self.ttl))
+                except Exception as e:
+                    print(f"Error writing serper cache: {e}")
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting
+            flight.exception()
+            raise
+        finally:
+            self._aflights.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        stats["shared"] = self.shared
+        lookups = stats["hits"] + stats["redis_hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = round((stats["hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+serper_cache = SerperCache()
+
+
+def serper_cache_stats() -> Dict[str, Any]:
+    return serper_cache.stats()
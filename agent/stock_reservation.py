@@ -0,0 +1,398 @@
+import os
+import time
+import asyncio
+import uuid
+import threading
+from typing import Dict, Any, Optional, List, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+from db_pool import get_db_connection, get_async_db_connection
+
+load_dotenv()
+
+# 'postgres' (default): place_order decrements products.stock_quantity directly.
+# 'redis': stock counters live in Redis and are written behind to Postgres in batches.
+INVENTORY_MODE = os.getenv('INVENTORY_MODE', 'postgres')
+STOCK_FLUSH_INTERVAL_SECONDS = float(os.getenv('STOCK_FLUSH_INTERVAL_SECONDS', '5'))
+# A return's stock_releases row older than this is replayed by the flush; the return itself
+# normally releases the units right after its commit
+STOCK_RELEASE_GRACE_SECONDS = float(os.getenv('STOCK_RELEASE_GRACE_SECONDS', '30'))
+# How long a return's release stays marked as applied; must outlast any replay delay
+STOCK_RELEASE_MARKER_TTL = int(os.getenv('STOCK_RELEASE_MARKER_TTL', '86400'))
+
+# ======================
+# REDIS LAYOUT
+# ======================
+# stock:{product_id}   available units (what orders reserve against)
+# stock:pending        hash product_id -> delta not yet written to Postgres
+# stock:flushing       the deltas a flush is writing right now (renamed from stock:pending)
+# stock:flushing_id    id of that flush; Postgres records applied ids in stock_flushes
+# stock:flush_epoch    bumped by every finished flush
+# stock:released:{id}  set once return {id}'s units were released (replays skip it)
+#
+# Available stock is always products.stock_quantity + pending (+ flushing while a flush
+# is in flight), so a counter is only (re)built from Postgres when no flush is running
+# and none finished since Postgres was read (same epoch).
+
+PENDING_KEY = "stock:pending"
+FLUSHING_KEY = "stock:flushing"
+FLUSH_ID_KEY = "stock:flushing_id"
+EPOCH_KEY = "stock:flush_epoch"
+
+# Stock counters get their own clients so functions.py can import this module
+stock_redis = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+async_stock_redis = aioredis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+
+# {1, new stock} reserved, {0, current stock} not enough, {-1, 0} counter not loaded
+_RESERVE = """
+local stock = redis.call('GET', KEYS[1])
+if not stock then
+    return {-1, 0}
+end
+stock = tonumber(stock)
+local quantity = tonumber(ARGV[2])
+if stock < quantity then
+    return {0, stock}
+end
+redis.call('DECRBY', KEYS[1], quantity)
+redis.call('HINCRBY', KEYS[2], ARGV[1], -quantity)
+return {1, stock - quantity}
+"""
+
+# New stock, or -1 when the counter isn't loaded (the pending delta still reaches Postgres)
+_RELEASE = """
+redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[2])
+end
+return -1
+"""
+
+# _RELEASE at most once per return (KEYS[3] is its marker); -2 when it was already applied
+_RELEASE_ONCE = """
+if not redis.call('SET', KEYS[3], '1', 'NX', 'EX', ARGV[3]) then
+    return -2
+end
+redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[2])
+end
+return -1
+"""
+
+# {1, stock, previous or -1} loaded, {0, 0, -1} a flush ran since Postgres was read (retry)
+_LOAD = """
+if ARGV[4] == '0' and redis.call('EXISTS', KEYS[1]) == 1 then
+    local stock = tonumber(redis.call('GET', KEYS[1]))
+    return {1, stock, stock}
+end
+if redis.call('EXISTS', KEYS[3]) == 1 or (redis.call('GET', KEYS[4]) or '0') ~= ARGV[3] then
+    return {0, 0, -1}
+end
+local previous = redis.call('GET', KEYS[1])
+local stock = tonumber(ARGV[2]) + tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('SET', KEYS[1], stock)
+return {1, stock, previous and tonumber(previous) or -1}
+"""
+
+# {flush id, [product_id, delta, ...]}; resumes an unfinished flush before starting a new one
+_TAKE_FLUSH = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('SET', KEYS[3], ARGV[1])
+end
+return {redis.call('GET', KEYS[3]) or ARGV[1], redis.call('HGETALL', KEYS[2])}
+"""
+
+_FINISH_FLUSH = """
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    redis.call('INCR', KEYS[3])
+    return 1
+end
+return 0
+"""
+
+_reserve = stock_redis.register_script(_RESERVE)
+_release = stock_redis.register_script(_RELEASE)
+_release_once = stock_redis.register_script(_RELEASE_ONCE)
+_load = stock_redis.register_script(_LOAD)
+_take_flush = stock_redis.register_script(_TAKE_FLUSH)
+_finish_flush = stock_redis.register_script(_FINISH_FLUSH)
+_areserve = async_stock_redis.register_script(_RESERVE)
+_arelease = async_stock_redis.register_script(_RELEASE)
+_arelease_once = async_stock_redis.register_script(_RELEASE_ONCE)
+_aload = async_stock_redis.register_script(_LOAD)
+
+# Attempts to build a counter while flushes keep finishing underneath
+_LOAD_RETRIES = 5
+
+_stats_lock = threading.Lock()
+_stats = {
+    "reserved": 0,
+    "rejected": 0,
+    "released": 0,
+    "counters_loaded": 0,
+    "flushes": 0,
+    "flushed_products": 0,
+    "flushed_units": 0,
+    "last_flush_ms": 0.0,
+    "reconciled": 0,
+    "drift": 0,
+    "release_failures": 0,
+    "releases_replayed": 0
+}
+
+
+def redis_inventory_enabled() -> bool:
+    return INVENTORY_MODE == 'redis'
+
+
+def stock_key(product_id: int) -> str:
+    return f"stock:{product_id}"
+
+
+def _record(**increments):
+    with _stats_lock:
+        for stat, value in increments.items():
+            _stats[stat] += value
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _load_keys(product_id: int) -> List[str]:
+    return [stock_key(product_id), PENDING_KEY, FLUSHING_KEY, EPOCH_KEY]
+
+
+def _release_once_keys(return_id: int, product_id: int) -> List[str]:
+    return [stock_key(product_id), PENDING_KEY, f"stock:released:{return_id}"]
+
+
+def _reservation_result(result: List[int]) -> Dict[str, Any]:
+    status, stock = int(result[0]), int(result[1])
+    _record(**({"reserved": 1} if status == 1 else {"rejected": 1}))
+    return {"found": True, "reserved": status == 1, "stock": stock}
+
+
+# ======================
+# SYNC API
+# ======================
+
+def _load_counter(product_id: int, overwrite: bool = False) -> Optional[Tuple[int, int]]:
+    """Build stock:{product_id} from Postgres plus pending deltas: (stock, previous counter or -1), None if no such product"""
+    for _ in range(_LOAD_RETRIES):
+        epoch = _decode(stock_redis.get(EPOCH_KEY) or b"0")
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT stock_quantity FROM products WHERE product_id = %s", (product_id,))
+            row = cursor.fetchone()
+            cursor.close()
+        if not row:
+            return None
+
+        loaded, stock, previous = _load(keys=_load_keys(product_id), args=[product_id, row[0], epoch, int(overwrite)])
+        if loaded:
+            _record(counters_loaded=1)
+            return int(stock), int(previous)
+        time.sleep(0.05)
+
+    raise RuntimeError(f"Could not load stock counter for product {product_id}: flushes kept running")
+
+
+def reserve_stock(product_id: int, quantity: int) -> Dict[str, Any]:
+    """Atomically take `quantity` units: {found, reserved, stock} (stock is what's left, or what was available)"""
+    result = _reserve(keys=[stock_key(product_id), PENDING_KEY], args=[product_id, quantity])
+    if int(result[0]) == -1:
+        if _load_counter(product_id) is None:
+            return {"found": False, "reserved": False, "stock": 0}
+        result = _reserve(keys=[stock_key(product_id), PENDING_KEY], args=[product_id, quantity])
+    return _reservation_result(result)
+
+
+def release_stock(product_id: int, quantity: int) -> Optional[int]:
+    """Give units back (returns, failed orders); the new stock, or None if the counter isn't loaded"""
+    new_stock = int(_release(keys=[stock_key(product_id), PENDING_KEY], args=[product_id, quantity]))
+    _record(released=1)
+    return new_stock if new_stock >= 0 else None
+
+
+def record_stock_release(cursor, return_id: int, product_id: int, quantity: int):
+    """In the return's transaction: the units to give back, until the release is known to be applied"""
+    cursor.execute("""
+        INSERT INTO stock_releases (return_id, product_id, quantity)
+        VALUES (%s, %s, %s)
+    """, (return_id, product_id, quantity))
+
+
+def release_returned_stock(return_id: int, product_id: int, quantity: int) -> Optional[int]:
+    """Give a committed return's units back, at most once; the new stock, or None if not known"""
+    new_stock = int(_release_once(keys=_release_once_keys(return_id, product_id), args=[product_id, quantity, STOCK_RELEASE_MARKER_TTL]))
+    _record(released=1)
+    return new_stock if new_stock >= 0 else None
+
+
+def record_release_failure(return_id: int, error: Exception):
+    """The return is committed; its stock_releases row gets the units back on a later flush"""
+    _record(release_failures=1)
+    print(f"Stock release for return {return_id} failed, left for the next flush: {error}")
+
+
+def replay_stock_releases(min_age_seconds: float = STOCK_RELEASE_GRACE_SECONDS) -> int:
+    """Release the units of returns whose release after the commit may have failed, then drop their rows"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT return_id, product_id, quantity FROM stock_releases
+            WHERE created_at < NOW() - make_interval(secs => %s)
+            ORDER BY return_id
+            LIMIT 1000
+        """, (min_age_seconds,))
+        rows = cursor.fetchall()
+
+        replayed = 0
+        for return_id, product_id, quantity in rows:
+            # Almost always already applied by the return itself (-2)
+            if int(_release_once(keys=_release_once_keys(return_id, product_id), args=[product_id, quantity, STOCK_RELEASE_MARKER_TTL])) != -2:
+                replayed += 1
+        if rows:
+            cursor.execute("DELETE FROM stock_releases WHERE return_id = ANY(%s)", ([row[0] for row in rows],))
+        conn.commit()
+        cursor.close()
+
+    _record(releases_replayed=replayed)
+    return replayed
+
+
+def flush_pending_stock() -> Dict[str, Any]:
+    """Write accumulated deltas to products.stock_quantity in one transaction (idempotent per flush id)"""
+    taken = _take_flush(keys=[PENDING_KEY, FLUSHING_KEY, FLUSH_ID_KEY], args=[uuid.uuid4().hex])
+    if not taken:
+        return {"flushed": False, "products": 0, "units": 0}
+
+    flush_id, flat = _decode(taken[0]), taken[1]
+    deltas = [(int(flat[i]), int(flat[i + 1])) for i in range(0, len(flat), 2)]
+    deltas = [(product_id, delta) for product_id, delta in deltas if delta]
+
+    start = time.perf_counter()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # A flush that crashed after committing is resumed with the same id and skipped here
+        cursor.execute("""
+            INSERT INTO stock_flushes (flush_id) VALUES (%s)
+            ON CONFLICT (flush_id) DO NOTHING
+            RETURNING flush_id
+        """, (flush_id,))
+        if cursor.fetchone() and deltas:
+            execute_values(cursor, """
+                UPDATE products AS p
+                SET stock_quantity = p.stock_quantity + d.delta
+                FROM (VALUES %s) AS d (product_id, delta)
+                WHERE p.product_id = d.product_id
+            """, deltas)
+        cursor.execute("DELETE FROM stock_flushes WHERE flushed_at < NOW() - INTERVAL '1 day'")
+        conn.commit()
+        cursor.close()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    _finish_flush(keys=[FLUSHING_KEY, FLUSH_ID_KEY, EPOCH_KEY], args=[flush_id])
+
+    units = sum(abs(delta) for _, delta in deltas)
+    _record(flushes=1, flushed_products=len(deltas), flushed_units=units)
+    with _stats_lock:
+        _stats["last_flush_ms"] = round(elapsed_ms, 2)
+    return {"flushed": True, "products": len(deltas), "units": units, "elapsed_ms": round(elapsed_ms, 2)}
+
+
+def reconcile_stock() -> Dict[str, Any]:
+    """Startup: finish/flush outstanding deltas, then rebuild every counter from Postgres and count drift"""
+    # Returns whose release never reached Redis, however recent
+    replay_stock_releases(min_age_seconds=0)
+    # Twice: the first call may only resume a flush an earlier process left behind
+    flush_pending_stock()
+    flush_pending_stock()
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_id FROM products")
+        product_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+
+    drift = 0
+    for product_id in product_ids:
+        counter = _load_counter(product_id, overwrite=True)
+        # A counter that disagrees with Postgres + pending deltas lost or gained units somewhere
+        if counter and counter[1] >= 0 and counter[1] != counter[0]:
+            drift += 1
+
+    _record(reconciled=len(product_ids), drift=drift)
+    return {"products": len(product_ids), "drift": drift}
+
+
+# ======================
+# ASYNC API
+# ======================
+
+async def _aload_counter(product_id: int) -> Optional[int]:
+    """Async _load_counter"""
+    for _ in range(_LOAD_RETRIES):
+        epoch = _decode(await async_stock_redis.get(EPOCH_KEY) or b"0")
+        async with get_async_db_connection() as conn:
+            stock_quantity = await conn.fetchval("SELECT stock_quantity FROM products WHERE product_id = $1", product_id)
+        if stock_quantity is None:
+            return None
+
+        loaded, stock, _ = await _aload(keys=_load_keys(product_id), args=[product_id, stock_quantity, epoch, 0])
+        if loaded:
+            _record(counters_loaded=1)
+            return int(stock)
+        await asyncio.sleep(0.05)
+
+    raise RuntimeError(f"Could not load stock counter for product {product_id}: flushes kept running")
+
+
+async def areserve_stock(product_id: int, quantity: int) -> Dict[str, Any]:
+    """Async reserve_stock"""
+    result = await _areserve(keys=[stock_key(product_id), PENDING_KEY], args=[product_id, quantity])
+    if int(result[0]) == -1:
+        if await _aload_counter(product_id) is None:
+            return {"found": False, "reserved": False, "stock": 0}
+        result = await _areserve(keys=[stock_key(product_id), PENDING_KEY], args=[product_id, quantity])
+    return _reservation_result(result)
+
+
+async def arelease_stock(product_id: int, quantity: int) -> Optional[int]:
+    """Async release_stock"""
+    new_stock = int(await _arelease(keys=[stock_key(product_id), PENDING_KEY], args=[product_id, quantity]))
+    _record(released=1)
+    return new_stock if new_stock >= 0 else None
+
+
+async def arecord_stock_release(conn, return_id: int, product_id: int, quantity: int):
+    """Async record_stock_release"""
+    await conn.execute("""
+        INSERT INTO stock_releases (return_id, product_id, quantity)
+        VALUES ($1, $2, $3)
+    """, return_id, product_id, quantity)
+
+
+async def arelease_returned_stock(return_id: int, product_id: int, quantity: int) -> Optional[int]:
+    """Async release_returned_stock"""
+    new_stock = int(await _arelease_once(keys=_release_once_keys(return_id, product_id), args=[product_id, quantity, STOCK_RELEASE_MARKER_TTL]))
+    _record(released=1)
+    return new_stock if new_stock >= 0 else None
+
+
+def stock_reservation_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["mode"] = INVENTORY_MODE
+    return stats
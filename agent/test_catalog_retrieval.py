@@ -0,0 +1,88 @@
+from catalog_cache import retrieve_rows
+from product_search import ProductSearchIndex
+from token_budget import estimate_tokens, take_within_budget
+
+# (product_id, product_name, size, price, stock_quantity), ordered like CATALOG_QUERY
+ROWS = sorted([
+    (1, "Apple AirPods Pro", "One Size", 249.0, 10),
+    (2, "Apple iPhone 15", "128GB", 799.0, 5),
+    (3, "Apple MacBook Air", "256GB", 1099.0, 0),
+    (4, "Levi's Jeans", "32", 69.0, 20),
+    (5, "Nike Running Shoes", "42", 120.0, 8),
+    (6, "Nike Running Shoes", "44", 120.0, 0),
+    (7, "Puma Running Shoes", "42", 90.0, 3),
+    (8, "Sony Headphones Pro", "One Size", 199.0, 4),
+], key=lambda row: (row[1], row[2], row[3]))
+
+
+def _names(rows):
+    return [(row[1], row[2]) for row in rows]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_take_within_budget_keeps_leading_blocks():
+    blocks = ["a" * 40, "b" * 40, "c" * 40]
+    taken, used = take_within_budget(blocks, 25)
+    assert taken == blocks[:2] and used == 20
+
+    # A block that doesn't fit stops the listing, even if a later one would
+    taken, used = take_within_budget(["a" * 40, "b" * 400, "c"], 50)
+    assert taken == ["a" * 40] and used == 10
+
+
+def test_score_weights_rare_words():
+    index = ProductSearchIndex(ROWS)
+    scores = index.score("do you have nike running shoes?")
+
+    nike = [i for i, row in enumerate(ROWS) if row[1].startswith("Nike")]
+    puma = [i for i, row in enumerate(ROWS) if row[1].startswith("Puma")]
+    # "nike" is rarer than "running"/"shoes", so both Nike rows outrank Puma
+    assert min(scores[i] for i in nike) > max(scores[i] for i in puma)
+    # Stop words and unknown words score nothing
+    assert index.score("hello can you show me") == {}
+
+
+def test_prefix_matching():
+    index = ProductSearchIndex(ROWS)
+    scores = index.score("levi")
+    assert [ROWS[i][1] for i in scores] == ["Levi's Jeans"]
+
+
+def test_retrieve_top_k_in_stock_first():
+    index = ProductSearchIndex(ROWS)
+    rows, total = retrieve_rows(ROWS, index, "nike running shoes", limit=2)
+
+    assert total == 3
+    # Same score: the in-stock size first
+    assert _names(rows) == [("Nike Running Shoes", "42"), ("Nike Running Shoes", "44")]
+
+
+def test_retrieve_by_product_name():
+    index = ProductSearchIndex(ROWS)
+    rows, total = retrieve_rows(ROWS, index, "what apple stuff is there", product_name="apple", limit=10)
+    assert total == 3
+    assert {row[1] for row in rows} == {"Apple AirPods Pro", "Apple iPhone 15", "Apple MacBook Air"}
+
+
+def test_retrieve_without_matches_lists_in_stock_catalog():
+    index = ProductSearchIndex(ROWS)
+    rows, total = retrieve_rows(ROWS, index, "what do you have?", limit=3)
+
+    assert total == sum(1 for row in ROWS if row[4] > 0)
+    assert len(rows) == 3 and all(row[4] > 0 for row in rows)
+
+
+if __name__ == "__main__":
+    test_estimate_tokens()
+    test_take_within_budget_keeps_leading_blocks()
+    test_score_weights_rare_words()
+    test_prefix_matching()
+    test_retrieve_top_k_in_stock_first()
+    test_retrieve_by_product_name()
+    test_retrieve_without_matches_lists_in_stock_catalog()
+    print("✅ Catalog retrieval tests passed")
@@ -0,0 +1,139 @@
+from unittest.mock import patch
+
+import context_builder
+from context_builder import build_context, parse_summary, summary_fields, needs_history, first_unread, summary_line
+from token_budget import estimate_tokens
+
+# Fixed limits so the tests don't depend on the environment
+LIMITS = {
+    "CONTEXT_WINDOW": 10,
+    "CONTEXT_TOKEN_BUDGET": 300,
+    "CONTEXT_SUMMARY_TOKENS": 100,
+    "CONTEXT_MESSAGE_MAX_CHARS": 200,
+    "CONTEXT_SUMMARY_LINE_CHARS": 60,
+}
+
+
+def _limits():
+    return patch.multiple(context_builder, **LIMITS)
+
+
+def _session(count, start=0):
+    messages = []
+    for i in range(start, start + count):
+        if i % 2 == 0:
+            messages.append({"sender": "user", "message": f"Question {i} about nike shoes 👟"})
+        else:
+            messages.append({"sender": "bot", "message": f"Answer {i}. " + "• Nike Air (42) $120 ✅\n" * 4})
+    return messages
+
+
+def _history(count):
+    return {"messages": [{"sender": "user" if i % 2 == 0 else "bot", "message_text": f"Old message {i}."} for i in range(count)]}
+
+
+def test_summary_line_is_first_sentence_without_emojis():
+    line = summary_line({"sender": "bot", "message": "Here are our Nike shoes! 🛍️ We have 3 sizes."}, "message")
+    assert line == "Assistant: Here are our Nike shoes!"
+
+    with _limits():
+        line = summary_line({"sender": "user", "message_text": "x" * 100}, "message_text")
+    assert line == "User: " + "x" * 59 + "…"
+
+
+def test_summary_round_trip():
+    summary = {"lines": ["User: hi"], "session_covered": 4, "history_covered": 2, "history_total": 6}
+    raw = {key.encode(): value.encode() for key, value in summary_fields(summary).items()}
+    assert parse_summary(raw) == summary
+    assert parse_summary({}) is None
+
+
+def test_empty_conversation():
+    with _limits():
+        context, _ = build_context([], 0, 0, None, None)
+    assert context["context"] == ""
+    assert context["context_messages"] == 0
+
+
+def test_short_session_uses_stored_history():
+    with _limits():
+        context, summary = build_context(_session(2), 0, 2, _history(20), None)
+
+    # Ten messages verbatim: the two of the session and the end of the stored conversation
+    assert context["context_messages"] == 2
+    assert context["history_messages"] == 8
+    assert "Earlier conversation:" in context["context"]
+    assert "Old message 19." in context["context"]
+    # The rest of the stored conversation went into the summary
+    assert summary["history_covered"] == 12
+    assert summary["history_total"] == 20
+    assert "User: Old message 0." in summary["lines"]
+
+
+def test_history_read_only_while_needed():
+    with _limits():
+        assert needs_history(None, 50)
+        assert needs_history({"history_covered": 20, "history_total": 20}, 4)
+        assert needs_history({"history_covered": 12, "history_total": 20}, 30)
+        assert not needs_history({"history_covered": 20, "history_total": 20}, 30)
+
+
+def test_first_unread_catch_up():
+    assert first_unread(None, 10, 14) is None
+    assert first_unread({"session_covered": 20}, 34, 14) is None
+    assert first_unread({"session_covered": 16}, 34, 14) == 16
+    # A long session seen for the first time: at most _MAX_CATCH_UP messages are read
+    assert first_unread(None, 1000, 14) == 1000 - 14 - context_builder._MAX_CATCH_UP
+
+
+def test_rolling_summary_keeps_context_within_budget():
+    with _limits():
+        session, summary = [], None
+        for turn in range(40):
+            total = len(session)
+            # The tail read plus whatever the summary hasn't covered yet, as manage_session_chat_history does
+            first_index = max(total - 14, 0)
+            catch_up = first_unread(summary, total, total - first_index)
+            if catch_up is not None:
+                first_index = catch_up
+            history = _history(6) if needs_history(summary, total) else None
+
+            context, update = build_context(session[first_index:], first_index, total, history, summary)
+            previous = summary
+            summary = update or summary
+
+            assert context["context_tokens"] <= LIMITS["CONTEXT_TOKEN_BUDGET"]
+            assert context["context_messages"] <= LIMITS["CONTEXT_WINDOW"]
+            assert estimate_tokens("".join(f"- {line}\n" for line in summary["lines"])) <= LIMITS["CONTEXT_SUMMARY_TOKENS"]
+            if previous:
+                # Messages are folded in once and never taken back out
+                assert summary["session_covered"] >= previous["session_covered"]
+            # Everything before the verbatim part is covered by the summary
+            assert summary["session_covered"] == total - context["context_messages"]
+
+            session += _session(2, start=len(session))
+
+        # The stored conversation was folded in long ago; the oldest lines have rolled off
+        assert summary["history_covered"] == summary["history_total"] == 6
+        assert not any(line.startswith("User: Old message") for line in summary["lines"])
+        assert summary["lines"][-1].startswith("Assistant: Answer") or summary["lines"][-1].startswith("User: Question")
+
+
+def test_unchanged_summary_is_not_rewritten():
+    with _limits():
+        session = _session(2)
+        _, summary = build_context(session, 0, 2, _history(0), None)
+        _, update = build_context(session, 0, 2, _history(0), summary)
+    assert update is None
+
+
+if __name__ == "__main__":
+    test_summary_line_is_first_sentence_without_emojis()
+    test_summary_round_trip()
+    test_empty_conversation()
+    test_short_session_uses_stored_history()
+    test_history_read_only_while_needed()
+    test_first_unread_catch_up()
+    test_rolling_summary_keeps_context_within_budget()
+    test_unchanged_summary_is_not_rewritten()
+    print("✅ Context builder tests passed")
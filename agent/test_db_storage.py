@@ -3,7 +3,8 @@ import redis
 import json
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from functions import manage_session_chat_history, _cleanup_old_conversations, _save_chat_to_db
+from functions import manage_session_chat_history, _session_keys, SESSION_ACTIVITY_KEY
+from archiver import archive_idle_sessions
 import psycopg2
 
 load_dotenv()
@@ -23,11 +24,11 @@ def test_chat_to_db_storage():
     manage_session_chat_history(test_phone, "Size 42", "Perfect! Order placed.")
     
     # 2. Check if it's in Redis
-    redis_key = f"chat_session:{test_phone}"
-    chat_data = redis_client.get(redis_key)
-    if chat_data:
-        chat_history = json.loads(chat_data)
-        print(f"✅ Chat in Redis: {len(chat_history['messages'])} messages")
+    session_keys = _session_keys(test_phone)
+    raw_messages = redis_client.lrange(session_keys["messages"], 0, -1)
+    if raw_messages:
+        messages = [json.loads(msg) for msg in raw_messages]
+        print(f"✅ Chat in Redis: {len(messages)} messages")
     else:
         print("❌ No chat found in Redis")
         return
@@ -35,15 +36,18 @@ def test_chat_to_db_storage():
     # 3. FORCE the chat to be old (modify timestamp)
     print("\n2. Making chat appear old (30+ minutes)...")
     old_time = (datetime.now() - timedelta(minutes=35)).isoformat()
-    chat_history["started_at"] = old_time
-    chat_history["last_activity"] = old_time
     
     # Update all message timestamps to be old
-    for msg in chat_history["messages"]:
+    for msg in messages:
         msg["timestamp"] = old_time
     
-    # Save the modified chat back to Redis
-    redis_client.setex(redis_key, 1800, json.dumps(chat_history))
+    # Save the modified chat back to Redis and age its entry in the archiver's index
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(session_keys["messages"])
+    pipe.rpush(session_keys["messages"], *[json.dumps(msg) for msg in messages])
+    pipe.hset(session_keys["meta"], mapping={"started_at": old_time, "last_activity": old_time})
+    pipe.zadd(SESSION_ACTIVITY_KEY, {test_phone: datetime.fromisoformat(old_time).timestamp()})
+    pipe.execute()
     print("✅ Chat timestamps modified to appear 35 minutes old")
     
     # 4. Check DB before cleanup
@@ -57,26 +61,18 @@ def test_chat_to_db_storage():
     # 5. Force cleanup
     print("\n4. Running cleanup (should move chat to DB)...")
 
-    # Debug: Check what cleanup function sees
-    redis_client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
-    chat_keys = redis_client.keys("chat_session:*")
-    print(f"   Found {len(chat_keys)} chat sessions in Redis")
-
-    for key in chat_keys:
-        chat_data = redis_client.get(key)
-        if chat_data:
-            chat_history = json.loads(chat_data)
-            last_activity = datetime.fromisoformat(chat_history.get("last_activity", chat_history["started_at"]))
-            age_minutes = (datetime.now() - last_activity).total_seconds() / 60
-            print(f"   Key: {key.decode()}, Age: {age_minutes:.1f} minutes")
+    # Debug: Check what the archiver's index sees
+    last_activity = redis_client.zscore(SESSION_ACTIVITY_KEY, test_phone)
+    age_minutes = (datetime.now().timestamp() - last_activity) / 60
+    print(f"   Indexed sessions: {redis_client.zcard(SESSION_ACTIVITY_KEY)}, test session age: {age_minutes:.1f} minutes")
 
-    # Now run cleanup
-    _cleanup_old_conversations()
+    # Now run the archiver
+    archive_stats = archive_idle_sessions()
+    print(f"   Archiver stats: {archive_stats}")
     
     # 6. Check Redis after cleanup
     print("\n5. Checking Redis after cleanup...")
-    chat_data_after = redis_client.get(redis_key)
-    if chat_data_after:
+    if redis_client.exists(session_keys["messages"]):
         print("❌ Chat still in Redis (cleanup failed)")
     else:
         print("✅ Chat removed from Redis")
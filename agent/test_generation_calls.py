@@ -0,0 +1,160 @@
+import os
+from types import SimpleNamespace
+from unittest.mock import patch
+
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+
+import ai_agents
+import intent_router
+from intent_router import IntentRouter
+from intent_cache import IntentCache
+
+PHONE_NO = "+1234567890"
+WHATSAPP_NAME = "Test User"
+
+# Every workflow runs these once, whatever the intent
+WORKFLOW_NODES = {"user_checker": 1, "load_conversations": 1, "message_analyzer": 1, "dispatch": 1}
+
+# message -> (specialist node, whether the message needs the LLM classifier)
+SCENARIOS = {
+    "Show me your Nike products": ("product_details_agent", False),
+    "What is my order status?": ("inventory_management_agent", False),
+    "Compare iPhone vs Samsung Galaxy": ("product_comparison_agent", False),
+    # No rule matches: one classifier generation, then the specialist
+    "Tell me about the nike air": ("product_details_agent", True),
+}
+
+
+class StubLLM:
+    """Stands in for ChatGoogleGenerativeAI: a fixed reply, and a count of calls"""
+
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        return SimpleNamespace(content=self.reply)
+
+
+class StubSerperCache:
+    def fetch(self, query, search):
+        return search(query)
+
+
+def _stubbed_router():
+    """An IntentRouter whose LLMs are stubs; the classifier answers PRODUCT_DETAILS"""
+    router = IntentRouter()
+    router.llm = StubLLM("PRODUCT_DETAILS")
+    for agent in router.specialists.values():
+        agent.llm = StubLLM("stub answer")
+    return router
+
+
+def _stubbed_services(customer=None, speculative=False, calls=None):
+    """Patch the DB, Redis and Serper calls the workflow makes; `calls` collects the fetches made"""
+    customer = customer or {"found": True, "created": False, "phone_no": PHONE_NO, "customer_name": WHATSAPP_NAME}
+    products = {"found": True, "products": [], "total_products": 0, "total_matches": 0}
+    calls = calls if calls is not None else []
+
+    def check_order_status(*args, **kwargs):
+        calls.append("order_status")
+        return {"found": False, "message": "No orders found"}
+
+    def compare_products_serper(query):
+        calls.append("serper")
+        return {"success": False, "message": "stubbed"}
+
+    return [
+        patch.multiple(
+            intent_router,
+            get_or_create_customer=lambda phone_no, whatsapp_name=None: customer,
+            manage_session_chat_history=lambda *args, **kwargs: {"success": True, "context": "No previous conversation history."},
+            intent_cache=IntentCache(shared=False),
+            SPECULATIVE_PREFETCH=speculative,
+        ),
+        patch.multiple(
+            ai_agents,
+            retrieve_products=lambda *args, **kwargs: products,
+            get_products=lambda *args, **kwargs: products,
+            check_order_status=check_order_status,
+            compare_products_serper=compare_products_serper,
+            serper_cache=StubSerperCache(),
+        ),
+    ]
+
+
+def _run(router, message):
+    """(generation calls, node calls) the message added"""
+    before = router.call_stats()
+    result = router.process_user_message(PHONE_NO, message, WHATSAPP_NAME)
+    after = router.call_stats()
+
+    generations = {node: calls - before["generation_calls"].get(node, 0) for node, calls in after["generation_calls"].items()}
+    nodes = {node: calls - before["node_calls"].get(node, 0) for node, calls in after["node_calls"].items()}
+    return result, {node: n for node, n in generations.items() if n}, {node: n for node, n in nodes.items() if n}
+
+
+def test_generation_calls():
+    patches = _stubbed_services()
+    for p in patches:
+        p.start()
+    try:
+        router = _stubbed_router()
+
+        for message, (node, needs_classifier) in SCENARIOS.items():
+            result, generations, nodes = _run(router, message)
+
+            expected_generations = {node: 1}
+            if needs_classifier:
+                expected_generations["message_analyzer"] = 1
+            assert generations == expected_generations, (message, generations)
+            assert nodes == {**WORKFLOW_NODES, node: 1}, (message, nodes)
+            assert result["agent_response"] == "stub answer", (message, result)
+
+        # A repeated unclear message is answered from the intent cache: no classifier generation
+        _, generations, _ = _run(router, "Tell me about the nike air")
+        assert generations == {"product_details_agent": 1}, generations
+
+        assert router.llm.calls == 1
+    finally:
+        for p in patches:
+            p.stop()
+
+    print("✅ One generation per answer, plus one per uncached LLM classification")
+
+
+def _run_speculative(message, customer=None):
+    """(speculation outcome, fetches made) for one message with speculative prefetch on"""
+    calls = []
+    patches = _stubbed_services(customer, speculative=True, calls=calls)
+    for p in patches:
+        p.start()
+    try:
+        result = _stubbed_router().process_user_message(PHONE_NO, message, WHATSAPP_NAME)
+    finally:
+        for p in patches:
+            p.stop()
+    return result["speculation"], calls
+
+
+def test_speculative_prefetch():
+    # A returning customer's order status is fetched once, ahead of the classification
+    assert _run_speculative("What is my order status?") == ("used", ["order_status"])
+
+    # A new customer didn't exist when the prefetch ran: the result is dropped and fetched again
+    new_customer = {"found": True, "created": True, "phone_no": PHONE_NO, "customer_name": WHATSAPP_NAME}
+    assert _run_speculative("What is my order status?", new_customer) == ("wasted", ["order_status", "order_status"])
+    failed_lookup = {"found": False, "message": "Error: stubbed"}
+    assert _run_speculative("What is my order status?", failed_lookup)[0] == "wasted"
+
+    # Comparisons only speculate on our own catalog; Serper is searched once, after routing
+    assert _run_speculative("Compare iPhone vs Samsung Galaxy") == ("used", ["serper"])
+    assert _run_speculative("Compare nike vs puma") == ("skipped", ["serper"])
+
+    print("✅ Speculative fetches are reused only when they still apply")
+
+
+if __name__ == "__main__":
+    test_generation_calls()
+    test_speculative_prefetch()
@@ -0,0 +1,142 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import patch
+
+import functions
+from functions import _conversation_snapshot, _history_result, _history_key, load_previous_conversations_to_redis
+
+STARTED_AT = datetime(2025, 1, 1, 10, 0)
+
+
+def _rows(count):
+    return [("user" if i % 2 == 0 else "bot", f"message {i}", datetime(2025, 1, 1, 10, i)) for i in range(count)]
+
+
+class FakeRedis:
+    """The two calls load_previous_conversations_to_redis makes on redis_client"""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+
+class FakeCursor:
+    """The stored conversation (conversation_id 8) and its messages"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchone(self):
+        return (8, STARTED_AT)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def _fake_db(rows, connections):
+    @contextmanager
+    def get_db_connection():
+        connections.append(1)
+        yield type("FakeConnection", (), {"cursor": lambda self: FakeCursor(rows)})()
+    return get_db_connection
+
+
+def _load(redis_data, refresh=False):
+    """(result, DB connections taken, Redis contents) for one load of +1234567890's history"""
+    connections = []
+    fake_redis = FakeRedis(redis_data)
+    with patch.multiple(
+        functions,
+        redis_client=fake_redis,
+        get_db_connection=_fake_db(_rows(5), connections),
+        _lookup_customer=lambda cursor, phone_no: {"phone_no": phone_no, "customer_name": "Test User"},
+    ):
+        result = load_previous_conversations_to_redis("+1234567890", refresh=refresh)
+    return result, len(connections), fake_redis.data
+
+
+def test_snapshot_keeps_rows_in_order():
+    snapshot = _conversation_snapshot("+1234567890", "Test User", STARTED_AT, _rows(3), conversation_id=7)
+
+    assert snapshot["conversation_id"] == 7
+    assert snapshot["started_at"] == STARTED_AT.isoformat()
+    assert [msg["message_text"] for msg in snapshot["messages"]] == ["message 0", "message 1", "message 2"]
+    assert snapshot["messages"][1]["sender"] == "bot"
+
+
+def test_history_result_for_stored_conversation():
+    snapshot = _conversation_snapshot("+1234567890", "Test User", STARTED_AT, _rows(4), conversation_id=7)
+    result = _history_result("+1234567890", snapshot)
+
+    assert result["found"] and result["loaded"]
+    assert not result["cached"]
+    assert result["messages_loaded"] == 4
+    assert result["history"] is snapshot
+
+
+def test_no_history_is_a_cacheable_result():
+    # Customers without history get an empty snapshot, cached so the DB isn't asked again
+    snapshot = _conversation_snapshot("+1234567890", "Unknown", None, [])
+    result = _history_result("+1234567890", snapshot, cached=True)
+
+    assert snapshot["started_at"] is None
+    assert not result["found"] and not result["loaded"]
+    assert result["cached"]
+    assert result["message"] == "No previous conversations found in database"
+
+
+def test_conversation_without_messages():
+    snapshot = _conversation_snapshot("+1234567890", "Test User", STARTED_AT, [], conversation_id=7)
+    result = _history_result("+1234567890", snapshot)
+
+    assert result["found"] and not result["loaded"]
+    assert result["message"] == "Conversation found but no messages"
+
+
+def test_warm_history_skips_postgres():
+    snapshot = _conversation_snapshot("+1234567890", "Test User", STARTED_AT, _rows(3), conversation_id=7)
+    result, connections, _ = _load({_history_key("+1234567890"): json.dumps(snapshot)})
+
+    assert connections == 0
+    assert result["cached"] and result["conversation_id"] == 7
+    assert result["messages_loaded"] == 3
+
+
+def test_cold_history_is_loaded_and_cached():
+    result, connections, redis_data = _load({})
+
+    assert connections == 1
+    assert not result["cached"] and result["messages_loaded"] == 5
+    assert json.loads(redis_data[_history_key("+1234567890")])["conversation_id"] == 8
+
+
+def test_refresh_reloads_warm_history():
+    snapshot = _conversation_snapshot("+1234567890", "Test User", STARTED_AT, _rows(3), conversation_id=7)
+    result, connections, redis_data = _load({_history_key("+1234567890"): json.dumps(snapshot)}, refresh=True)
+
+    assert connections == 1
+    assert not result["cached"] and result["conversation_id"] == 8
+    assert json.loads(redis_data[_history_key("+1234567890")])["conversation_id"] == 8
+
+
+if __name__ == "__main__":
+    test_snapshot_keeps_rows_in_order()
+    test_history_result_for_stored_conversation()
+    test_no_history_is_a_cacheable_result()
+    test_conversation_without_messages()
+    test_warm_history_skips_postgres()
+    test_cold_history_is_loaded_and_cached()
+    test_refresh_reloads_warm_history()
+    print("✅ History hydration tests passed")
@@ -0,0 +1,43 @@
+from http_clients import record_latency, timed_hop, http_client_stats, http_session, HTTP_TIMEOUT, HTTP_POOL_SIZE
+
+
+def test_record_latency_aggregates_per_hop():
+    record_latency("test_hop", 10.0)
+    record_latency("test_hop", 30.0, error=True)
+
+    stats = http_client_stats()["hops"]["test_hop"]
+    assert stats["calls"] == 2
+    assert stats["errors"] == 1
+    assert stats["total_ms"] == 40.0
+    assert stats["max_ms"] == 30.0
+    assert stats["avg_ms"] == 20.0
+
+
+def test_timed_hop_records_errors_and_reraises():
+    try:
+        with timed_hop("test_failing_hop"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("timed_hop swallowed the exception")
+
+    with timed_hop("test_failing_hop"):
+        pass
+
+    stats = http_client_stats()["hops"]["test_failing_hop"]
+    assert (stats["calls"], stats["errors"]) == (2, 1)
+
+
+def test_session_pool_and_timeouts():
+    # Every outbound call gets a (connect, read) timeout; the pool is sized by HTTP_POOL_SIZE
+    assert len(HTTP_TIMEOUT) == 2 and all(timeout > 0 for timeout in HTTP_TIMEOUT)
+    adapter = http_session.get_adapter("https://google.serper.dev/search")
+    assert adapter._pool_maxsize == HTTP_POOL_SIZE
+
+
+if __name__ == "__main__":
+    test_record_latency_aggregates_per_hop()
+    test_timed_hop_records_errors_and_reraises()
+    test_session_pool_and_timeouts()
+    print("✅ HTTP client tests passed")
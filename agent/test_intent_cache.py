@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+import intent_cache
+from intent_cache import IntentCache, normalize_message
+
+
+class Clock:
+    """Controllable time.monotonic()"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_message():
+    assert normalize_message("  Where is my ORDER?? ") == "where is my order"
+    assert normalize_message("where is   my order") == normalize_message("Where is my order!")
+
+
+def test_hit_after_put_ignores_case_and_punctuation():
+    cache = IntentCache(max_entries=10, ttl=60, shared=False)
+    assert cache.get("Tell me about nike") is None
+
+    cache.put("Tell me about nike", "PRODUCT_DETAILS")
+    assert cache.get("tell me about NIKE!") == "PRODUCT_DETAILS"
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_lru_eviction():
+    cache = IntentCache(max_entries=2, ttl=60, shared=False)
+    cache.put("a", "PRODUCT_DETAILS")
+    cache.put("b", "INVENTORY_MANAGEMENT")
+    # Touch "a" so "b" is the least recently used
+    assert cache.get("a") == "PRODUCT_DETAILS"
+    cache.put("c", "PRODUCT_COMPARISON")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "PRODUCT_DETAILS"
+    assert cache.get("c") == "PRODUCT_COMPARISON"
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+
+def test_ttl_expiry():
+    clock = Clock()
+    with patch.object(intent_cache.time, "monotonic", clock):
+        cache = IntentCache(max_entries=10, ttl=60, shared=False)
+        cache.put("where is my parcel", "INVENTORY_MANAGEMENT")
+
+        clock.now += 59
+        assert cache.get("where is my parcel") == "INVENTORY_MANAGEMENT"
+
+        clock.now += 2
+        assert cache.get("where is my parcel") is None
+        assert cache.stats()["expired"] == 1
+        assert cache.stats()["size"] == 0
+
+
+if __name__ == "__main__":
+    test_normalize_message()
+    test_hit_after_put_ignores_case_and_punctuation()
+    test_lru_eviction()
+    test_ttl_expiry()
+    print("✅ Intent cache tests passed")
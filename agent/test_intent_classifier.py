@@ -0,0 +1,71 @@
+from intent_classifier import IntentClassifier
+
+# message -> category the fast path must answer without the LLM
+FAST_PATH = {
+    "Where is my order?": "INVENTORY_MANAGEMENT",
+    "What is my order status?": "INVENTORY_MANAGEMENT",
+    "I want to return my shoes": "INVENTORY_MANAGEMENT",
+    "cancel my order": "INVENTORY_MANAGEMENT",
+    "order the levi t-shirt M": "INVENTORY_MANAGEMENT",
+    "Can I buy the nike shoes size 42": "INVENTORY_MANAGEMENT",
+    "Do you have iPhone 15?": "PRODUCT_DETAILS",
+    "What's the price of airpods?": "PRODUCT_DETAILS",
+    "Is the macbook available to order?": "PRODUCT_DETAILS",
+    "what is your return policy?": "PRODUCT_DETAILS",
+    "Show me your Nike products": "PRODUCT_DETAILS",
+    "iPhone vs Samsung Galaxy": "PRODUCT_COMPARISON",
+    "Compare the MacBook Air with Dell XPS": "PRODUCT_COMPARISON",
+}
+
+# Unclear or conflicting messages go to the LLM
+FALLBACK = [
+    "hello",
+    "Tell me about the nike air",
+    "how much is shipping?",
+    "which is better to buy, nike or puma?",
+]
+
+
+def test_fast_path_categories():
+    classifier = IntentClassifier(threshold=0.75)
+    for message, category in FAST_PATH.items():
+        assert classifier.fast_path(message) == category, (message, classifier.classify(message))
+
+
+def test_fallback_to_llm():
+    classifier = IntentClassifier(threshold=0.75)
+    for message in FALLBACK:
+        assert classifier.fast_path(message) is None, (message, classifier.classify(message))
+
+
+def test_classify_confidence():
+    classifier = IntentClassifier()
+    assert classifier.classify("hello") == (None, 0.0)
+
+    # One strong cue: 1.0 / (1.0 + smoothing)
+    assert classifier.classify("Do you have iPhone 15?") == ("PRODUCT_DETAILS", 0.8)
+
+    # A weak cue alone is never confident
+    category, confidence = classifier.classify("nike shoes purchase")
+    assert category == "INVENTORY_MANAGEMENT" and confidence < 0.75
+
+
+def test_stats():
+    classifier = IntentClassifier(threshold=0.75)
+    classifier.fast_path("Where is my order?")
+    classifier.fast_path("hello")
+
+    stats = classifier.stats()
+    assert stats["classified"] == 2
+    assert stats["fast_path"] == 1
+    assert stats["fallback"] == 1
+    assert stats["fast_path_by_category"]["INVENTORY_MANAGEMENT"] == 1
+    assert stats["fallback_rate"] == 0.5
+
+
+if __name__ == "__main__":
+    test_fast_path_categories()
+    test_fallback_to_llm()
+    test_classify_confidence()
+    test_stats()
+    print("✅ Intent classifier tests passed")
@@ -0,0 +1,83 @@
+import time
+import threading
+from unittest.mock import patch
+
+import serper_cache
+from serper_cache import SerperCache
+
+
+def _search(results):
+    """Fake Serper search that records its queries"""
+    def search(query):
+        results.append(query)
+        return {"success": True, "query": query, "results": []}
+    return search
+
+
+def test_cached_by_normalized_query():
+    calls = []
+    cache = SerperCache(max_entries=10, ttl=60, shared=False)
+
+    cache.fetch("iPhone 15 vs Galaxy S24", _search(calls))
+    cache.fetch("iphone 15 VS galaxy s24!", _search(calls))
+    assert calls == ["iPhone 15 vs Galaxy S24"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_failures_are_not_cached():
+    cache = SerperCache(max_entries=10, ttl=60, shared=False)
+    cache.fetch("nike vs puma", lambda query: {"success": False, "message": "timeout"})
+
+    calls = []
+    cache.fetch("nike vs puma", _search(calls))
+    assert calls == ["nike vs puma"]
+
+
+def test_lru_and_ttl():
+    now = [1000.0]
+    with patch.object(serper_cache.time, "monotonic", lambda: now[0]):
+        calls = []
+        cache = SerperCache(max_entries=2, ttl=60, shared=False)
+        for query in ["a vs b", "c vs d", "e vs f"]:
+            cache.fetch(query, _search(calls))
+        assert cache.stats()["evictions"] == 1
+
+        # The oldest query was evicted; the newest expires after the TTL
+        cache.fetch("a vs b", _search(calls))
+        assert calls[-1] == "a vs b"
+        now[0] += 61
+        cache.fetch("e vs f", _search(calls))
+        assert calls[-1] == "e vs f"
+        assert cache.stats()["expired"] == 1
+
+
+def test_concurrent_identical_queries_share_one_search():
+    calls = []
+    release = threading.Event()
+    cache = SerperCache(max_entries=10, ttl=60, shared=False)
+
+    def slow_search(query):
+        calls.append(query)
+        release.wait(5)
+        return {"success": True, "query": query, "results": []}
+
+    threads = [threading.Thread(target=cache.fetch, args=("macbook vs dell", slow_search)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["macbook vs dell"]
+    # Callers that arrived after the search finished got the cached result instead
+    stats = cache.stats()
+    assert stats["coalesced"] + stats["hits"] == 4
+
+
+if __name__ == "__main__":
+    test_cached_by_normalized_query()
+    test_failures_are_not_cached()
+    test_lru_and_ttl()
+    test_concurrent_identical_queries_share_one_search()
+    print("✅ Serper cache tests passed")
@@ -0,0 +1,21 @@
+from typing import List, Tuple
+
+# Gemini averages roughly four characters of English per token; close enough for budgeting
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate prompt tokens for `text` (no tokenizer round trip)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def take_within_budget(blocks: List[str], budget: int) -> Tuple[List[str], int]:
+    """The leading blocks whose combined estimate fits `budget`, and the tokens they use"""
+    taken, used = [], 0
+    for block in blocks:
+        tokens = estimate_tokens(block)
+        if used + tokens > budget:
+            break
+        taken.append(block)
+        used += tokens
+    return taken, used
@@ -7,6 +7,8 @@ require('dotenv').config({ path: path.join(__dirname, '../.env') });
 
 const app = express();
 const PORT = process.env.NODE_PORT || 3000;
+// Set QUEUE_WORKERS_IN_PROCESS=0 when the queue is drained by separate `node worker.js` processes
+const QUEUE_WORKERS_IN_PROCESS = (process.env.QUEUE_WORKERS_IN_PROCESS || '1') === '1';
 
 // Middleware - Add URL-encoded parser for Twilio
 app.use(express.json());
@@ -23,6 +25,9 @@ app.use('/api/whatsapp', whatsappRoutes);
 async function startServer() {
   try {
     await connectRedis();
+    if (QUEUE_WORKERS_IN_PROCESS) {
+      await whatsappRoutes.startMessageWorkers();
+    }
     
     app.listen(PORT, () => {
       console.log(`🚀 Backend server running on port ${PORT}`);
@@ -34,4 +39,10 @@ async function startServer() {
   }
 }
 
-startServer();
\ No newline at end of file
+startServer();
+
+process.on('SIGTERM', async () => {
+  // Let in-flight messages finish; anything unacked is reclaimed by another worker
+  await whatsappRoutes.stopMessageWorkers();
+  process.exit(0);
+});
@@ -1,8 +1,24 @@
 const express = require('express');
-const axios = require('axios');
 const twilio = require('twilio');
+const { callAgent, streamAgent, timedHop, hopStats } = require('../services/agent_client');
+const MessageChunker = require('../services/message_chunker');
+const { startWorkers, stopWorkers, queueStats } = require('../services/message_queue');
+const { bufferMessage, startBurstFlusher, stopBurstFlusher, burstStats } = require('../services/burst_buffer');
+const {
+  claimMessage,
+  getMessageRecord,
+  touchMessages,
+  markProcessing,
+  markCompleted,
+  releaseMessage,
+  recordSkippedCompleted,
+  dedupStats
+} = require('../services/message_dedup');
 const router = express.Router();
 
+// Stream agent replies (POST /agent/stream) and send each finished sentence/paragraph as it's ready
+const STREAM_REPLIES = process.env.STREAM_REPLIES === '1';
+
 // Initialize Twilio client lazily (after env is loaded)
 let twilioClient;
 
@@ -23,6 +39,7 @@ router.post('/webhook', async (req, res) => {
     const from = req.body.From || req.body.from;
     const messageBody = req.body.Body || req.body.body || '';
     const profileName = req.body.ProfileName || req.body.profileName || 'WhatsApp User';
+    const messageSid = req.body.MessageSid || req.body.messageSid || '';
     
     if (!from) {
       console.log('❌ No From field found in request');
@@ -32,10 +49,30 @@ router.post('/webhook', async (req, res) => {
     // Clean phone number (remove whatsapp: prefix)
     const phoneNumber = from.replace('whatsapp:', '');
     
-    console.log(`📱 Processing WhatsApp message from ${phoneNumber}: "${messageBody}"`);
+    // A Twilio retry of a message we already queued or answered is acked without reprocessing
+    if (messageSid && !(await claimMessage(messageSid))) {
+      const record = await getMessageRecord(messageSid);
+      console.log(`🔁 Duplicate webhook for ${messageSid} (${record ? record.status : 'unknown'}), not reprocessing`);
+      return res.sendStatus(200);
+    }
     
-    // Process message through your existing pipeline
-    await processWhatsAppMessage(phoneNumber, messageBody, profileName);
+    // Ack Twilio right away; the message waits briefly for the rest of the customer's burst
+    // (services/burst_buffer.js), then queue workers call the agent and reply (services/message_queue.js)
+    let entryId;
+    try {
+      entryId = await bufferMessage({
+        phone_number: phoneNumber,
+        message_text: messageBody,
+        sender_name: profileName,
+        message_sid: messageSid
+      });
+    } catch (error) {
+      if (messageSid) {
+        await releaseMessage(messageSid).catch(() => {});
+      }
+      throw error;
+    }
+    console.log(`📥 Queued WhatsApp message from ${phoneNumber} as ${entryId}: "${messageBody}"`);
     
     res.sendStatus(200);
   } catch (error) {
@@ -49,41 +86,148 @@ router.get('/webhook', (req, res) => {
   res.status(200).send('Twilio WhatsApp webhook is ready!');
 });
 
+// Queue depth and worker counters
+router.get('/queue', async (req, res) => {
+  try {
+    res.json({ ...(await queueStats()), bursts: await burstStats(), dedup: dedupStats(), hops: hopStats() });
+  } catch (error) {
+    console.error('❌ Error reading queue stats:', error);
+    res.sendStatus(500);
+  }
+});
+
+// Throws when the agent can't be reached so the queue retries the message
 async function processWhatsAppMessage(phone_number, message_text, sender_name) {
+  console.log(`🔄 Processing message: ${message_text} from ${phone_number}`);
+  
+  if (STREAM_REPLIES) {
+    return streamWhatsAppReply(phone_number, message_text, sender_name);
+  }
+  
+  console.log('🤖 Calling Python agent...');
+  const agentResponse = await callAgent({
+    query: message_text,
+    phone_number: phone_number,
+    whatsapp_name: sender_name  // Add this line
+  });
+  
+  const botResponse = agentResponse.response;
+  console.log(`🤖 Agent response: ${botResponse}`);
+  
+  // Send response back to WhatsApp
+  if (botResponse && botResponse.trim() !== '') {
+    await sendTwilioWhatsAppMessage(phone_number, botResponse);
+  }
+  return botResponse;
+}
+
+// Streaming variant: the first sentence reaches the customer while the rest is still being generated
+async function streamWhatsAppReply(phone_number, message_text, sender_name) {
+  const chunker = new MessageChunker();
+  let sent = 0;
+  // Sends are chained so the parts arrive in order
+  let sending = Promise.resolve();
+  const send = parts => {
+    for (const part of parts) {
+      sent++;
+      sending = sending.then(() => sendTwilioWhatsAppMessage(phone_number, part));
+    }
+  };
+  
+  console.log('🤖 Streaming from Python agent...');
+  let result;
   try {
-    console.log(`🔄 Processing message: ${message_text} from ${phone_number}`);
-    
-    console.log('🤖 Calling Python agent...');
-    const agentResponse = await axios.post('http://localhost:5000/agent', {
+    result = await streamAgent({
       query: message_text,
       phone_number: phone_number,
-      whatsapp_name: sender_name  // Add this line
-    });
-    
-    const botResponse = agentResponse.data.response;
-    console.log(`🤖 Agent response: ${botResponse}`);
-    
-    // Send response back to WhatsApp
-    if (botResponse && botResponse.trim() !== '') {
-      await sendTwilioWhatsAppMessage(phone_number, botResponse);
+      whatsapp_name: sender_name
+    }, text => send(chunker.push(text)));
+    // The agent failed mid-answer: its apology is not the reply, handle it like a broken stream
+    if (result.error) {
+      throw new Error(`Agent stream error: ${result.response || 'no details'}`);
     }
-    
   } catch (error) {
-    console.error('❌ Error processing message:', error);
-    await sendTwilioWhatsAppMessage(phone_number, "Sorry, I'm having trouble processing your request right now.");
+    // Nothing reached the customer yet: let the queue retry the whole message
+    if (sent === 0) {
+      throw error;
+    }
+    // Part of the answer is out; retrying would repeat it
+    console.error(`❌ Agent stream broke after ${sent} messages:`, error.message || error);
+    send(chunker.finish());
+    send(["Sorry, I couldn't finish that answer. Please ask again."]);
+    await sending;
+    return null;
+  }
+  
+  send(chunker.finish());
+  // Replies that never streamed come as one final response
+  if (sent === 0 && result.response && result.response.trim() !== '') {
+    send([result.response]);
   }
+  await sending;
+  
+  console.log(`🤖 Agent response streamed in ${sent} messages`);
+  return result.response;
+}
+
+// A coalesced burst carries the MessageSids of all its messages, comma separated
+function queuedMessageSids(message) {
+  return (message.message_sid || '').split(',').filter(Boolean);
 }
 
+// Queue handler: a redelivered message that was already answered is not sent to the agent again
+async function processQueuedMessage(message) {
+  const messageSids = queuedMessageSids(message);
+  if (messageSids.length > 0) {
+    const records = await Promise.all(messageSids.map(getMessageRecord));
+    if (records.every(record => record && record.status === 'completed')) {
+      recordSkippedCompleted();
+      console.log(`🔁 ${message.message_sid} already answered, skipping`);
+      return;
+    }
+    await Promise.all(messageSids.map(markProcessing));
+  }
+
+  if (message.burst_size && message.burst_size !== '1') {
+    console.log(`🧩 ${message.burst_size} messages from ${message.phone_number} merged into one agent call`);
+  }
+  const botResponse = await processWhatsAppMessage(message.phone_number, message.message_text, message.sender_name);
+
+  await Promise.all(messageSids.map(messageSid => markCompleted(messageSid, botResponse)));
+}
+
+// Start the workers that drain the inbound queue into the agent
+async function startMessageWorkers() {
+  startBurstFlusher();
+  await startWorkers(
+    processQueuedMessage,
+    {
+      // Keep Twilio's retries deduplicated however long the message waited in the queue
+      onReceive: message => touchMessages(queuedMessageSids(message)),
+      // Out of retries: tell the customer instead of staying silent
+      onDeadLetter: message => sendTwilioWhatsAppMessage(
+        message.phone_number,
+        "Sorry, I'm having trouble processing your request right now."
+      )
+    }
+  );
+}
+
+
+async function stopMessageWorkers() {
+  await stopBurstFlusher();
+  await stopWorkers();
+}
 
 // Add this new function to send messages via Twilio
 async function sendTwilioWhatsAppMessage(phone_number, message) {
   try {
     const client = getTwilioClient(); // Use lazy initialization
-    const response = await client.messages.create({
+    const response = await timedHop('twilio', () => client.messages.create({
       body: message,
       from: process.env.TWILIO_PHONE_NUMBER,
       to: `whatsapp:${phone_number}`
-    });
+    }));
     
     console.log(`✅ Twilio message sent to ${phone_number}: ${response.sid}`);
   } catch (error) {
@@ -92,4 +236,6 @@ async function sendTwilioWhatsAppMessage(phone_number, message) {
   }
 }
 
-module.exports = router;
\ No newline at end of file
+module.exports = router;
+module.exports.startMessageWorkers = startMessageWorkers;
+module.exports.stopMessageWorkers = stopMessageWorkers;
\ No newline at end of file
@@ -0,0 +1,118 @@
+const http = require('http');
+const https = require('https');
+const axios = require('axios');
+
+// Keep-alive connections to the Python agent instead of a new TCP connection per message
+const AGENT_URL = process.env.AGENT_URL || 'http://localhost:5000';
+const AGENT_POOL_SIZE = parseInt(process.env.AGENT_POOL_SIZE || '50', 10);
+// Must cover a full LangGraph run; a timed-out call is retried by the queue
+const AGENT_TIMEOUT_MS = parseInt(process.env.AGENT_TIMEOUT_MS || '60000', 10);
+
+const agentOptions = { keepAlive: true, maxSockets: AGENT_POOL_SIZE, maxFreeSockets: AGENT_POOL_SIZE };
+
+const agentHttp = axios.create({
+  baseURL: AGENT_URL,
+  timeout: AGENT_TIMEOUT_MS,
+  httpAgent: new http.Agent(agentOptions),
+  httpsAgent: new https.Agent(agentOptions)
+});
+
+// Per-hop latency: calls, errors, total/max ms
+const hops = {};
+
+function recordLatency(hop, elapsedMs, error = false) {
+  const stats = hops[hop] || (hops[hop] = { calls: 0, errors: 0, totalMs: 0, maxMs: 0 });
+  stats.calls++;
+  stats.errors += error ? 1 : 0;
+  stats.totalMs += elapsedMs;
+  stats.maxMs = Math.max(stats.maxMs, elapsedMs);
+}
+
+// Runs `call` and records its latency under `hop`, failed calls included
+async function timedHop(hop, call) {
+  const start = process.hrtime.bigint();
+  let error = false;
+  try {
+    return await call();
+  } catch (err) {
+    error = true;
+    throw err;
+  } finally {
+    recordLatency(hop, Number(process.hrtime.bigint() - start) / 1e6, error);
+  }
+}
+
+async function callAgent(payload) {
+  const response = await timedHop('agent', () => agentHttp.post('/agent', payload));
+  return response.data;
+}
+
+// Parses the SSE stream of POST /agent/stream: calls onChunk(text) for each `chunk` event and
+// resolves with the `done` (or `error`) event's data
+async function streamAgent(payload, onChunk) {
+  const start = process.hrtime.bigint();
+  const elapsedMs = () => Number(process.hrtime.bigint() - start) / 1e6;
+  let firstChunk = true;
+
+  try {
+    const response = await agentHttp.post('/agent/stream', payload, { responseType: 'stream' });
+    let buffer = '';
+    let result = null;
+
+    // Decode as a string stream so multi-byte characters split across packets stay intact
+    response.data.setEncoding('utf8');
+    for await (const data of response.data) {
+      buffer += data;
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = 'message';
+        let body = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+          } else if (line.startsWith('data:')) {
+            body += line.slice(5).trim();
+          }
+        }
+        const eventData = body ? JSON.parse(body) : {};
+
+        if (event === 'chunk') {
+          if (firstChunk) {
+            recordLatency('agent_first_chunk', elapsedMs());
+            firstChunk = false;
+          }
+          onChunk(eventData.text);
+        } else if (event === 'done' || event === 'error') {
+          result = { ...eventData, error: event === 'error' };
+        }
+      }
+    }
+
+    if (!result) {
+      throw new Error('Agent stream ended without a done event');
+    }
+    recordLatency('agent_stream', elapsedMs(), result.error);
+    return result;
+  } catch (error) {
+    recordLatency('agent_stream', elapsedMs(), true);
+    throw error;
+  }
+}
+
+function hopStats() {
+  const result = {};
+  for (const [hop, stats] of Object.entries(hops)) {
+    result[hop] = {
+      ...stats,
+      totalMs: Math.round(stats.totalMs * 100) / 100,
+      maxMs: Math.round(stats.maxMs * 100) / 100,
+      avgMs: stats.calls ? Math.round((stats.totalMs / stats.calls) * 100) / 100 : 0
+    };
+  }
+  return result;
+}
+
+module.exports = { callAgent, streamAgent, timedHop, hopStats };
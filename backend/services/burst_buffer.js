@@ -0,0 +1,151 @@
+const { getRedisClient } = require('../utils/redis_client');
+const { enqueueMessage, recordEnqueued, SHARD_PREFIX, QUEUE_SHARDS, QUEUE_MAXLEN } = require('./message_queue');
+
+// Messages from one phone arriving within BURST_WINDOW_MS of each other become one queue entry
+// (one agent run, one reply); 0 queues every message on its own
+const BURST_WINDOW_MS = parseInt(process.env.BURST_WINDOW_MS || '1500', 10);
+// Upper bound on how long a burst that keeps growing is held back
+const BURST_MAX_WAIT_MS = parseInt(process.env.BURST_MAX_WAIT_MS || '5000', 10);
+const BURST_POLL_MS = parseInt(process.env.BURST_POLL_MS || '100', 10);
+
+// whatsapp:burst:{phone}   list of buffered messages (JSON)
+// whatsapp:burst:first     hash phone -> arrival of the burst's first message (ms)
+// whatsapp:burst:due       zset phone -> when the burst is flushed to the stream (ms)
+const FIRST_KEY = 'whatsapp:burst:first';
+const DUE_KEY = 'whatsapp:burst:due';
+
+function burstKey(phoneNumber) {
+  return `whatsapp:burst:${phoneNumber}`;
+}
+
+// Returns the burst size so far
+const APPEND_SCRIPT = `
+local size = redis.call('RPUSH', KEYS[1], ARGV[2])
+local now = tonumber(ARGV[3])
+local first = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '')
+if not first then
+  first = now
+  redis.call('HSET', KEYS[2], ARGV[1], now)
+end
+redis.call('ZADD', KEYS[3], math.min(now + tonumber(ARGV[4]), first + tonumber(ARGV[5])), ARGV[1])
+redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[5]) * 10)
+return size
+`;
+
+// Moves due bursts onto the phone's queue shard (same hash as shardFor() in message_queue.js)
+// as one merged entry each; returns {bursts, messages}
+const FLUSH_SCRIPT = `
+local phones = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local messages = 0
+for _, phone in ipairs(phones) do
+  local key = ARGV[3] .. phone
+  local items = redis.call('LRANGE', key, 0, -1)
+  redis.call('DEL', key)
+  redis.call('ZREM', KEYS[1], phone)
+  redis.call('HDEL', KEYS[2], phone)
+  if #items > 0 then
+    local texts, sids, sender, received = {}, {}, 'WhatsApp User', ''
+    for i, item in ipairs(items) do
+      local message = cjson.decode(item)
+      table.insert(texts, message.message_text)
+      if message.message_sid ~= '' then
+        table.insert(sids, message.message_sid)
+      end
+      sender = message.sender_name
+      if i == 1 then
+        received = message.received_at
+      end
+    end
+    local shard = tonumber(string.sub(redis.sha1hex(phone), 1, 8), 16) % tonumber(ARGV[6])
+    redis.call('XADD', ARGV[5] .. shard, 'MAXLEN', '~', ARGV[4], '*',
+      'phone_number', phone,
+      'message_text', table.concat(texts, '\\n'),
+      'sender_name', sender,
+      'message_sid', table.concat(sids, ','),
+      'attempts', '0',
+      'received_at', received,
+      'burst_size', tostring(#items))
+    messages = messages + #items
+  end
+end
+return {#phones, messages}
+`;
+
+const stats = {
+  buffered: 0,
+  bursts: 0,
+  merged: 0
+};
+
+let flushing = false;
+let flusher = null;
+
+async function bufferMessage(message) {
+  if (BURST_WINDOW_MS <= 0) {
+    return enqueueMessage(message);
+  }
+
+  const item = JSON.stringify({
+    message_text: message.message_text,
+    sender_name: message.sender_name || 'WhatsApp User',
+    message_sid: message.message_sid || '',
+    received_at: new Date().toISOString()
+  });
+  const size = await getRedisClient().eval(APPEND_SCRIPT, {
+    keys: [burstKey(message.phone_number), FIRST_KEY, DUE_KEY],
+    arguments: [message.phone_number, item, String(Date.now()), String(BURST_WINDOW_MS), String(BURST_MAX_WAIT_MS)]
+  });
+  stats.buffered++;
+  return `burst:${message.phone_number}:${size}`;
+}
+
+async function flushDueBursts() {
+  const [bursts, messages] = await getRedisClient().eval(FLUSH_SCRIPT, {
+    keys: [DUE_KEY, FIRST_KEY],
+    arguments: [String(Date.now()), '100', burstKey(''), String(QUEUE_MAXLEN), SHARD_PREFIX, String(QUEUE_SHARDS)]
+  });
+  stats.bursts += Number(bursts);
+  recordEnqueued(Number(bursts));
+  stats.merged += Number(messages) - Number(bursts);
+  return Number(bursts);
+}
+
+// Polls whatsapp:burst:due; safe to run in several processes (the flush is one Lua script)
+function startBurstFlusher() {
+  if (BURST_WINDOW_MS <= 0 || flushing) {
+    return;
+  }
+  flushing = true;
+  flusher = (async () => {
+    while (flushing) {
+      try {
+        // Keep going without sleeping while there is a backlog of due bursts
+        if (await flushDueBursts() < 100) {
+          await new Promise(resolve => setTimeout(resolve, BURST_POLL_MS));
+        }
+      } catch (error) {
+        console.error('❌ Burst flush error:', error);
+        await new Promise(resolve => setTimeout(resolve, 1000));
+      }
+    }
+  })();
+  console.log(`⏱️ Coalescing message bursts (window ${BURST_WINDOW_MS}ms, max wait ${BURST_MAX_WAIT_MS}ms)`);
+}
+
+async function stopBurstFlusher() {
+  flushing = false;
+  if (flusher) {
+    await flusher;
+    flusher = null;
+  }
+}
+
+async function burstStats() {
+  return {
+    ...stats,
+    windowMs: BURST_WINDOW_MS,
+    waiting: BURST_WINDOW_MS > 0 ? await getRedisClient().zCard(DUE_KEY) : 0
+  };
+}
+
+module.exports = { bufferMessage, startBurstFlusher, stopBurstFlusher, burstStats };
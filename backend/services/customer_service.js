@@ -1,7 +1,11 @@
 const { Pool } = require('pg');
 const path = require('path');
+const { getRedisClient } = require('../utils/redis_client');
 require('dotenv').config({ path: path.join(__dirname, '../../.env') });
 
+// Same customer:{phone} entries the Python agent reads and writes (agent/customer_cache.py)
+const CUSTOMER_CACHE_TTL = parseInt(process.env.CUSTOMER_CACHE_TTL || '900', 10);
+
 class CustomerService {
   constructor() {
     console.log('Database URL:', process.env.DATABASE_URL);
@@ -14,8 +18,38 @@ class CustomerService {
     });
   }
 
+  customerKey(phoneNumber) {
+    return `customer:${phoneNumber}`;
+  }
+
+  // Redis is optional here: scripts that never call connectRedis() go straight to the DB
+  async getCachedCustomer(phoneNumber) {
+    try {
+      const cached = await getRedisClient().get(this.customerKey(phoneNumber));
+      return cached ? JSON.parse(cached) : null;
+    } catch (error) {
+      return null;
+    }
+  }
+
+  async cacheCustomer(customer) {
+    try {
+      const record = { phone_no: customer.phone_no, customer_name: customer.customer_name };
+      await getRedisClient().set(this.customerKey(customer.phone_no), JSON.stringify(record), { EX: CUSTOMER_CACHE_TTL });
+    } catch (error) {
+      // Cache writes are best effort
+    }
+  }
+
   async getOrCreateCustomer(phoneNumber, whatsappName = null) {
     try {
+      const cachedCustomer = await this.getCachedCustomer(phoneNumber);
+      if (cachedCustomer) {
+        console.log(`✅ Existing customer found (cache): ${phoneNumber}`);
+        cachedCustomer.customer_id = cachedCustomer.phone_no;
+        return cachedCustomer;
+      }
+
       // Check if customer exists
       const result = await this.pool.query(
         'SELECT * FROM customers WHERE phone_no = $1',
@@ -27,6 +61,7 @@ class CustomerService {
         // Add customer_id field for compatibility
         const customer = result.rows[0];
         customer.customer_id = customer.phone_no; // Use phone_no as customer_id
+        await this.cacheCustomer(customer);
         return customer;
       }
 
@@ -42,6 +77,7 @@ class CustomerService {
       // Add customer_id field for compatibility
       const customer = newCustomer.rows[0];
       customer.customer_id = customer.phone_no; // Use phone_no as customer_id
+      await this.cacheCustomer(customer);
       return customer;
 
     } catch (error) {
@@ -51,4 +87,4 @@ class CustomerService {
   }
 }
 
-module.exports = CustomerService;
\ No newline at end of file
+module.exports = CustomerService;
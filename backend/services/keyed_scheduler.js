@@ -0,0 +1,69 @@
+// Runs tasks one at a time per key (in submission order) and different keys in parallel.
+// Only orders tasks within this process; the queue keeps a phone's messages in one process
+// by routing each phone to a shard that a single process reads (services/message_queue.js).
+class KeyedScheduler {
+  constructor(name = 'whatsapp') {
+    this.name = name;
+    this.queues = new Map();
+    this.stats = {
+      scheduled: 0,
+      completed: 0,
+      queuedBehind: 0,
+      maxDepth: 0
+    };
+  }
+
+  run(key, task) {
+    return new Promise((resolve, reject) => {
+      let queue = this.queues.get(key);
+      const idle = !queue;
+      if (idle) {
+        queue = [];
+        this.queues.set(key, queue);
+      } else {
+        this.stats.queuedBehind++;
+      }
+      queue.push({ task, resolve, reject });
+      this.stats.scheduled++;
+      this.stats.maxDepth = Math.max(this.stats.maxDepth, queue.length);
+
+      if (idle) {
+        this.drain(key);
+      }
+    });
+  }
+
+  async drain(key) {
+    const queue = this.queues.get(key);
+    while (queue.length > 0) {
+      const { task, resolve, reject } = queue[0];
+      try {
+        resolve(await task());
+      } catch (error) {
+        reject(error);
+      }
+      queue.shift();
+      this.stats.completed++;
+    }
+    this.queues.delete(key);
+  }
+
+  // Tasks per key, running one included; the deepest keys first
+  depths(limit = 20) {
+    return Array.from(this.queues, ([key, queue]) => ({ key, depth: queue.length }))
+      .sort((a, b) => b.depth - a.depth)
+      .slice(0, limit);
+  }
+
+  schedulerStats() {
+    const depths = this.depths();
+    return {
+      ...this.stats,
+      activeKeys: this.queues.size,
+      queued: Array.from(this.queues.values()).reduce((total, queue) => total + queue.length, 0),
+      deepestKeys: depths
+    };
+  }
+}
+
+module.exports = KeyedScheduler;
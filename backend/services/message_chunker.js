@@ -0,0 +1,106 @@
+// Splits a reply that arrives as a token stream into WhatsApp-sized messages:
+// the first message goes out as soon as its first sentence is complete, later
+// ones at paragraph breaks once they are long enough to be worth a message.
+const STREAM_FIRST_MIN_CHARS = parseInt(process.env.STREAM_FIRST_MIN_CHARS || '20', 10);
+const STREAM_MIN_CHUNK_CHARS = parseInt(process.env.STREAM_MIN_CHUNK_CHARS || '300', 10);
+// Twilio rejects WhatsApp bodies over 1600 characters
+const STREAM_MAX_CHUNK_CHARS = parseInt(process.env.STREAM_MAX_CHUNK_CHARS || '1500', 10);
+
+// A sentence ends at . ! ? or … followed by whitespace (so "3.5" and "v2.0" don't split)
+const SENTENCE_END = /[.!?…](?=\s)/g;
+
+class MessageChunker {
+  constructor({
+    firstMinChars = STREAM_FIRST_MIN_CHARS,
+    minChunkChars = STREAM_MIN_CHUNK_CHARS,
+    maxChunkChars = STREAM_MAX_CHUNK_CHARS
+  } = {}) {
+    this.firstMinChars = firstMinChars;
+    this.minChunkChars = minChunkChars;
+    this.maxChunkChars = maxChunkChars;
+    this.buffer = '';
+    this.chunks = 0;
+  }
+
+  // Add streamed text; returns the messages that are complete now
+  push(text) {
+    this.buffer += text;
+    return this.drain();
+  }
+
+  // End of stream; returns whatever is left
+  finish() {
+    const ready = this.drain();
+    while (this.buffer.trim()) {
+      const cut = this.buffer.length > this.maxChunkChars ? this.forcedCut() : this.buffer.length;
+      this.take(cut, ready);
+    }
+    this.buffer = '';
+    return ready;
+  }
+
+  drain() {
+    const ready = [];
+    let cut;
+    while ((cut = this.nextCut()) > 0) {
+      this.take(cut, ready);
+    }
+    return ready;
+  }
+
+  take(cut, ready) {
+    const chunk = this.buffer.slice(0, cut).trim();
+    this.buffer = this.buffer.slice(cut);
+    if (chunk) {
+      ready.push(chunk);
+      this.chunks++;
+    }
+  }
+
+  nextCut() {
+    if (this.chunks === 0) {
+      const paragraph = this.buffer.indexOf('\n\n');
+      const sentence = this.sentenceEndAfter(this.firstMinChars);
+      const cuts = [paragraph >= this.firstMinChars ? paragraph + 2 : -1, sentence].filter(cut => cut > 0);
+      if (cuts.length > 0) {
+        return Math.min(...cuts);
+      }
+    } else {
+      const paragraph = this.buffer.lastIndexOf('\n\n');
+      if (paragraph >= this.minChunkChars) {
+        return Math.min(paragraph + 2, this.maxChunkChars);
+      }
+    }
+
+    return this.buffer.length > this.maxChunkChars ? this.forcedCut() : 0;
+  }
+
+  // Index just past the first sentence end at or after `minChars`, or -1
+  sentenceEndAfter(minChars) {
+    SENTENCE_END.lastIndex = minChars > 0 ? minChars - 1 : 0;
+    const match = SENTENCE_END.exec(this.buffer);
+    return match ? match.index + 1 : -1;
+  }
+
+  // Too long without a break: cut at the last line, sentence or word boundary that fits
+  forcedCut() {
+    const window = this.buffer.slice(0, this.maxChunkChars);
+    const line = window.lastIndexOf('\n');
+    if (line > this.maxChunkChars / 2) {
+      return line + 1;
+    }
+    let sentence = -1;
+    let match;
+    SENTENCE_END.lastIndex = 0;
+    while ((match = SENTENCE_END.exec(window)) !== null) {
+      sentence = match.index + 1;
+    }
+    if (sentence > this.maxChunkChars / 2) {
+      return sentence;
+    }
+    const space = window.lastIndexOf(' ');
+    return space > 0 ? space + 1 : this.maxChunkChars;
+  }
+}
+
+module.exports = MessageChunker;
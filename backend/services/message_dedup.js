@@ -0,0 +1,98 @@
+const { getRedisClient } = require('../utils/redis_client');
+
+// Twilio retries a webhook it considers failed; MessageSid identifies the retries of one message.
+// The claim must outlive the message's wait in the queue: it is renewed when a worker picks the
+// message up and again when the agent call starts, so this only has to cover a queue backlog
+const DEDUP_INFLIGHT_TTL = parseInt(process.env.DEDUP_INFLIGHT_TTL || '3600', 10);
+// Completed messages are remembered (with the reply that was sent) for this long
+const DEDUP_COMPLETED_TTL = parseInt(process.env.DEDUP_COMPLETED_TTL || '86400', 10);
+
+// Renews the claims of messages that aren't completed yet; a claim that expired while the
+// message was queued is taken again
+const TOUCH_SCRIPT = `
+for _, key in ipairs(KEYS) do
+  local record = redis.call('GET', key)
+  if not record then
+    redis.call('SET', key, ARGV[2], 'EX', ARGV[1])
+  elseif cjson.decode(record).status ~= 'completed' then
+    redis.call('EXPIRE', key, ARGV[1])
+  end
+end
+return #KEYS
+`;
+
+const stats = {
+  claimed: 0,
+  duplicates: 0,
+  completed: 0,
+  touched: 0,
+  skippedCompleted: 0
+};
+
+function messageKey(messageSid) {
+  return `whatsapp:message:${messageSid}`;
+}
+
+async function getMessageRecord(messageSid) {
+  const record = await getRedisClient().get(messageKey(messageSid));
+  return record ? JSON.parse(record) : null;
+}
+
+// True if this is the first time we see messageSid; false for a retry of a known message
+async function claimMessage(messageSid) {
+  const record = JSON.stringify({ status: 'queued', at: new Date().toISOString() });
+  const claimed = await getRedisClient().set(messageKey(messageSid), record, { NX: true, EX: DEDUP_INFLIGHT_TTL });
+  if (claimed) {
+    stats.claimed++;
+  } else {
+    stats.duplicates++;
+  }
+  return Boolean(claimed);
+}
+
+async function touchMessages(messageSids) {
+  if (messageSids.length === 0) {
+    return;
+  }
+  const record = JSON.stringify({ status: 'queued', at: new Date().toISOString() });
+  await getRedisClient().eval(TOUCH_SCRIPT, {
+    keys: messageSids.map(messageKey),
+    arguments: [String(DEDUP_INFLIGHT_TTL), record]
+  });
+  stats.touched += messageSids.length;
+}
+
+async function markProcessing(messageSid) {
+  const record = JSON.stringify({ status: 'processing', at: new Date().toISOString() });
+  await getRedisClient().set(messageKey(messageSid), record, { EX: DEDUP_INFLIGHT_TTL });
+}
+
+async function markCompleted(messageSid, response) {
+  const record = JSON.stringify({ status: 'completed', response: response || '', at: new Date().toISOString() });
+  await getRedisClient().set(messageKey(messageSid), record, { EX: DEDUP_COMPLETED_TTL });
+  stats.completed++;
+}
+
+// Forget a claim that never made it onto the queue so Twilio's retry is processed
+async function releaseMessage(messageSid) {
+  await getRedisClient().del(messageKey(messageSid));
+}
+
+function recordSkippedCompleted() {
+  stats.skippedCompleted++;
+}
+
+function dedupStats() {
+  return { ...stats };
+}
+
+module.exports = {
+  claimMessage,
+  getMessageRecord,
+  touchMessages,
+  markProcessing,
+  markCompleted,
+  releaseMessage,
+  recordSkippedCompleted,
+  dedupStats
+};
@@ -0,0 +1,457 @@
+const crypto = require('crypto');
+const os = require('os');
+const { getRedisClient } = require('../utils/redis_client');
+const KeyedScheduler = require('./keyed_scheduler');
+
+// Inbound WhatsApp messages: the webhook appends, workers drain into the Python agent.
+// The queue is QUEUE_SHARDS streams ({STREAM_KEY}:{n}); a phone always hashes to the same one
+// and each shard is read by one process at a time (a leased owner), so a phone's messages
+// are never handled by two processes at once and stay in arrival order.
+const STREAM_KEY = process.env.QUEUE_STREAM_KEY || 'whatsapp:inbound';
+const SHARD_PREFIX = `${STREAM_KEY}:`;
+const DEAD_LETTER_KEY = `${STREAM_KEY}:dead`;
+// zset consumer -> last heartbeat (ms); shards are split evenly across live consumers
+const CONSUMERS_KEY = `${STREAM_KEY}:consumers`;
+const GROUP = process.env.QUEUE_GROUP || 'agent-workers';
+
+const QUEUE_SHARDS = parseInt(process.env.QUEUE_SHARDS || '16', 10);
+// Handler calls running at once in this process
+const QUEUE_CONCURRENCY = parseInt(process.env.QUEUE_CONCURRENCY || '10', 10);
+// Entries read but not finished yet (running, or waiting behind the same phone)
+const QUEUE_PREFETCH = parseInt(process.env.QUEUE_PREFETCH || String(QUEUE_CONCURRENCY * 10), 10);
+const QUEUE_MAX_ATTEMPTS = parseInt(process.env.QUEUE_MAX_ATTEMPTS || '3', 10);
+// Backoff before retry n is n * QUEUE_RETRY_DELAY_MS
+const QUEUE_RETRY_DELAY_MS = parseInt(process.env.QUEUE_RETRY_DELAY_MS || '1000', 10);
+// A shard lease not renewed for this long belongs to a crashed process and is taken over
+const QUEUE_SHARD_LEASE_MS = parseInt(process.env.QUEUE_SHARD_LEASE_MS || '15000', 10);
+const QUEUE_BLOCK_MS = parseInt(process.env.QUEUE_BLOCK_MS || '2000', 10);
+// Approximate cap per shard so an outage downstream can't grow the streams without bound
+const QUEUE_MAXLEN = parseInt(process.env.QUEUE_MAXLEN || '100000', 10);
+
+// Only the holder (same consumer) may release or extend a lease
+const RELEASE_SCRIPT = `
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+`;
+
+const EXTEND_SCRIPT = `
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+`;
+
+// Moves entries of the single pre-sharding stream to their shards, 100 per call; returns the count
+const MIGRATE_SCRIPT = `
+local entries = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', 100)
+for _, entry in ipairs(entries) do
+  local fields = entry[2]
+  local phone = ''
+  for i = 1, #fields, 2 do
+    if fields[i] == 'phone_number' then
+      phone = fields[i + 1]
+    end
+  end
+  local shard = tonumber(string.sub(redis.sha1hex(phone), 1, 8), 16) % tonumber(ARGV[2])
+  redis.call('XADD', ARGV[1] .. shard, 'MAXLEN', '~', ARGV[3], '*', unpack(fields))
+  redis.call('XDEL', KEYS[1], entry[1])
+end
+if #entries == 0 then
+  redis.call('DEL', KEYS[1])
+end
+return #entries
+`;
+
+const stats = {
+  enqueued: 0,
+  processed: 0,
+  failures: 0,
+  retried: 0,
+  deadLettered: 0,
+  reclaimed: 0,
+  inFlight: 0,
+  shardsAcquired: 0,
+  shardsReleased: 0,
+  shardsLost: 0
+};
+
+const consumer = `${os.hostname()}-${process.pid}`;
+
+// shard -> { recovering, releasing, inFlight }
+const owned = new Map();
+let running = false;
+let reader = null;
+let balancer = null;
+let onReceive = null;
+
+// Messages from one phone are handled one at a time and in order; different phones in parallel
+const scheduler = new KeyedScheduler('whatsapp');
+
+// Handler slots (QUEUE_CONCURRENCY) and read-ahead (QUEUE_PREFETCH)
+let concurrencyLimit = QUEUE_CONCURRENCY;
+let active = 0;
+const slotWaiters = [];
+let outstanding = 0;
+let readAheadWaiter = null;
+
+function sleep(ms) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+// Same hash as the Lua scripts: first 32 bits of sha1(phone)
+function shardFor(phoneNumber) {
+  const hash = crypto.createHash('sha1').update(phoneNumber || '').digest('hex');
+  return parseInt(hash.slice(0, 8), 16) % QUEUE_SHARDS;
+}
+
+function shardKey(shard) {
+  return `${SHARD_PREFIX}${shard}`;
+}
+
+function leaseKey(shard) {
+  return `${STREAM_KEY}:lease:${shard}`;
+}
+
+async function enqueueMessage(message) {
+  const entry = {
+    phone_number: message.phone_number,
+    message_text: message.message_text,
+    sender_name: message.sender_name || 'WhatsApp User',
+    message_sid: message.message_sid || '',
+    attempts: String(message.attempts || 0),
+    received_at: message.received_at || new Date().toISOString()
+  };
+
+  const id = await getRedisClient().xAdd(shardKey(shardFor(message.phone_number)), '*', entry, {
+    TRIM: { strategy: 'MAXLEN', strategyModifier: '~', threshold: QUEUE_MAXLEN }
+  });
+  stats.enqueued++;
+  return id;
+}
+
+// For entries appended to the stream by other writers (the burst flush script)
+function recordEnqueued(count) {
+  stats.enqueued += count;
+}
+
+async function ensureGroups(client) {
+  for (let shard = 0; shard < QUEUE_SHARDS; shard++) {
+    try {
+      await client.xGroupCreate(shardKey(shard), GROUP, '0', { MKSTREAM: true });
+    } catch (error) {
+      if (!String(error.message).includes('BUSYGROUP')) {
+        throw error;
+      }
+    }
+  }
+}
+
+async function migrateLegacyStream(client) {
+  if (await client.type(STREAM_KEY) !== 'stream') {
+    return;
+  }
+  let moved = 0;
+  let batch;
+  do {
+    batch = await client.eval(MIGRATE_SCRIPT, {
+      keys: [STREAM_KEY],
+      arguments: [SHARD_PREFIX, String(QUEUE_SHARDS), String(QUEUE_MAXLEN)]
+    });
+    moved += batch;
+  } while (batch > 0);
+  console.log(`📦 Moved ${moved} queued messages from ${STREAM_KEY} to its ${QUEUE_SHARDS} shards`);
+}
+
+async function acquireSlot() {
+  if (active < concurrencyLimit) {
+    active++;
+    return;
+  }
+  await new Promise(resolve => slotWaiters.push(resolve));
+}
+
+function releaseSlot() {
+  const next = slotWaiters.shift();
+  if (next) {
+    next();
+  } else {
+    active--;
+  }
+}
+
+function wakeReader() {
+  if (readAheadWaiter) {
+    readAheadWaiter();
+    readAheadWaiter = null;
+  }
+}
+
+async function deadLetter(key, entry, attempts, error, onDeadLetter) {
+  await getRedisClient().multi()
+    .xAdd(DEAD_LETTER_KEY, '*', {
+      ...entry.message,
+      attempts: String(attempts),
+      error: String(error && error.message ? error.message : error),
+      source_id: entry.id
+    })
+    .xAck(key, GROUP, entry.id)
+    .exec();
+  stats.deadLettered++;
+
+  console.error(`☠️ Message ${entry.id} dead-lettered after ${attempts} attempts:`, error.message || error);
+  if (onDeadLetter) {
+    await onDeadLetter(entry.message).catch(err => console.error('❌ Dead-letter handler failed:', err));
+  }
+}
+
+// A failed message is retried in place, after a backoff: the phone's later messages wait
+// behind it, so a retry never overtakes (or is overtaken by) the customer's next message.
+async function handleEntry(key, entry, handler, onDeadLetter) {
+  let attempts = parseInt(entry.message.attempts || '0', 10);
+  stats.inFlight++;
+  try {
+    for (;;) {
+      // The slot is only held while the handler runs, not through the backoff
+      await acquireSlot();
+      try {
+        await handler(entry.message);
+        break;
+      } catch (error) {
+        attempts++;
+        stats.failures++;
+        console.error(`❌ Queue handler failed for ${entry.id} (attempt ${attempts}):`, error.message || error);
+        if (attempts >= QUEUE_MAX_ATTEMPTS) {
+          await deadLetter(key, entry, attempts, error, onDeadLetter);
+          return;
+        }
+        stats.retried++;
+      } finally {
+        releaseSlot();
+      }
+      await sleep(QUEUE_RETRY_DELAY_MS * attempts);
+    }
+    await getRedisClient().xAck(key, GROUP, entry.id);
+    stats.processed++;
+  } finally {
+    stats.inFlight--;
+  }
+}
+
+// Queue the entry behind its phone's earlier messages without waiting for it
+function dispatch(shard, state, entry, handler, onDeadLetter) {
+  state.inFlight++;
+  outstanding++;
+  if (onReceive) {
+    onReceive(entry.message).catch(error => console.error(`❌ Receive hook failed for ${entry.id}:`, error.message || error));
+  }
+  scheduler.run(entry.message.phone_number, () => handleEntry(shardKey(shard), entry, handler, onDeadLetter))
+    .catch(error => console.error(`❌ Queue entry ${entry.id} failed:`, error.message || error))
+    .finally(() => {
+      state.inFlight--;
+      outstanding--;
+      wakeReader();
+    });
+}
+
+// A newly acquired shard first finishes what its previous owner had read but not acked,
+// in stream order, before anything new is read from it
+async function recoverShard(client, shard, state, handler, onDeadLetter) {
+  let cursor = '0-0';
+  do {
+    const claimed = await client.xAutoClaim(shardKey(shard), GROUP, consumer, 0, cursor, { COUNT: 100 });
+    cursor = claimed.nextId;
+    // Entries trimmed from the stream meanwhile come back as null
+    const entries = (claimed.messages || []).filter(Boolean);
+    stats.reclaimed += entries.length;
+    for (const entry of entries) {
+      dispatch(shard, state, entry, handler, onDeadLetter);
+    }
+  } while (cursor !== '0-0');
+  state.recovering = false;
+}
+
+async function runReader(handler, onDeadLetter) {
+  // Blocking reads need their own connection
+  const client = getRedisClient().duplicate();
+  client.on('error', err => console.error('Queue reader Redis error:', err));
+  await client.connect();
+
+  while (running) {
+    try {
+      if (outstanding >= QUEUE_PREFETCH) {
+        await new Promise(resolve => { readAheadWaiter = resolve; });
+        continue;
+      }
+
+      for (const [shard, state] of owned) {
+        if (state.recovering && !state.releasing) {
+          await recoverShard(client, shard, state, handler, onDeadLetter);
+        }
+      }
+
+      const streams = Array.from(owned)
+        .filter(([, state]) => !state.recovering && !state.releasing)
+        .map(([shard]) => ({ key: shardKey(shard), id: '>' }));
+      if (streams.length === 0) {
+        await sleep(QUEUE_BLOCK_MS);
+        continue;
+      }
+
+      const count = Math.max(1, Math.floor((QUEUE_PREFETCH - outstanding) / streams.length));
+      const response = await client.xReadGroup(GROUP, consumer, streams, { COUNT: count, BLOCK: QUEUE_BLOCK_MS });
+      for (const stream of response || []) {
+        const shard = parseInt(stream.name.slice(SHARD_PREFIX.length), 10);
+        const state = owned.get(shard);
+        // Lease lost, being handed back or re-acquired during the read: whoever recovers
+        // the shard next claims these, after the entries before them
+        if (!state || state.releasing || state.recovering) {
+          continue;
+        }
+        for (const entry of stream.messages) {
+          dispatch(shard, state, entry, handler, onDeadLetter);
+        }
+      }
+    } catch (error) {
+      console.error('❌ Queue reader error:', error);
+      await sleep(1000);
+    }
+  }
+
+  await client.quit();
+}
+
+// Heartbeat, renew our leases, hand back shards above our fair share once their entries are
+// done, and take free shards up to it
+async function rebalance() {
+  const client = getRedisClient();
+  const now = Date.now();
+  await client.zAdd(CONSUMERS_KEY, { score: now, value: consumer });
+  await client.zRemRangeByScore(CONSUMERS_KEY, '-inf', now - QUEUE_SHARD_LEASE_MS);
+  const share = Math.ceil(QUEUE_SHARDS / Math.max(await client.zCard(CONSUMERS_KEY), 1));
+
+  for (const shard of Array.from(owned.keys())) {
+    const kept = await client.eval(EXTEND_SCRIPT, { keys: [leaseKey(shard)], arguments: [consumer, String(QUEUE_SHARD_LEASE_MS)] });
+    if (!kept) {
+      owned.delete(shard);
+      stats.shardsLost++;
+      console.warn(`⚠️ Lease on queue shard ${shard} expired; another worker takes it over`);
+    }
+  }
+
+  let keeping = Array.from(owned.values()).filter(state => !state.releasing).length;
+  for (const [shard, state] of owned) {
+    if (!state.releasing && keeping > share) {
+      state.releasing = true;
+      keeping--;
+    }
+    if (state.releasing && state.inFlight === 0) {
+      owned.delete(shard);
+      stats.shardsReleased++;
+      await client.eval(RELEASE_SCRIPT, { keys: [leaseKey(shard)], arguments: [consumer] });
+    }
+  }
+
+  // Start at a per-consumer offset so processes don't all race for the same free shards
+  const offset = shardFor(consumer);
+  for (let i = 0; i < QUEUE_SHARDS && keeping < share && running; i++) {
+    const shard = (offset + i) % QUEUE_SHARDS;
+    if (owned.has(shard)) {
+      continue;
+    }
+    if (await client.set(leaseKey(shard), consumer, { NX: true, PX: QUEUE_SHARD_LEASE_MS })) {
+      owned.set(shard, { recovering: true, releasing: false, inFlight: 0 });
+      stats.shardsAcquired++;
+      keeping++;
+    }
+  }
+}
+
+async function runBalancer() {
+  while (running) {
+    try {
+      await rebalance();
+    } catch (error) {
+      console.error('❌ Queue rebalance error:', error);
+    }
+    await sleep(Math.floor(QUEUE_SHARD_LEASE_MS / 3));
+  }
+}
+
+// Read the queue and call `handler(message)` for each message, up to `concurrency` at a time;
+// a throwing handler is retried, and `onDeadLetter(message)` runs when it gives up.
+// `onReceive(message)` runs as soon as a message is read, before it waits for its turn.
+async function startWorkers(handler, { concurrency = QUEUE_CONCURRENCY, onDeadLetter = null, onReceive: receiveHook = null } = {}) {
+  const client = getRedisClient();
+  await ensureGroups(client);
+  await migrateLegacyStream(client);
+
+  concurrencyLimit = concurrency;
+  onReceive = receiveHook;
+  running = true;
+  await rebalance();
+  balancer = runBalancer();
+  reader = runReader(handler, onDeadLetter);
+  console.log(`📥 Consuming ${QUEUE_SHARDS} shards of ${STREAM_KEY} (group ${GROUP}, ${concurrency} at a time, ${owned.size} shards owned)`);
+}
+
+// Finish what was read, then hand the shards back so other workers take them over right away
+async function stopWorkers() {
+  running = false;
+  wakeReader();
+  await Promise.allSettled([reader, balancer]);
+  reader = null;
+  balancer = null;
+
+  while (outstanding > 0) {
+    await sleep(100);
+  }
+
+  const client = getRedisClient();
+  for (const shard of Array.from(owned.keys())) {
+    owned.delete(shard);
+    await client.eval(RELEASE_SCRIPT, { keys: [leaseKey(shard)], arguments: [consumer] }).catch(() => null);
+  }
+  await client.zRem(CONSUMERS_KEY, consumer).catch(() => null);
+}
+
+async function queueStats() {
+  const client = getRedisClient();
+  const keys = Array.from({ length: QUEUE_SHARDS }, (_, shard) => shardKey(shard));
+  const [lengths, pending, deadLetters, consumers] = await Promise.all([
+    Promise.all(keys.map(key => client.xLen(key))),
+    Promise.all(keys.map(key => client.xPending(key, GROUP).catch(() => null))),
+    client.xLen(DEAD_LETTER_KEY),
+    client.zCard(CONSUMERS_KEY)
+  ]);
+
+  return {
+    ...stats,
+    stream: STREAM_KEY,
+    shards: QUEUE_SHARDS,
+    ownedShards: Array.from(owned.keys()).sort((a, b) => a - b),
+    consumers,
+    length: lengths.reduce((total, length) => total + length, 0),
+    pending: pending.reduce((total, info) => total + (info ? info.pending : 0), 0),
+    deadLetters,
+    concurrency: concurrencyLimit,
+    running: active,
+    readAhead: outstanding,
+    scheduler: scheduler.schedulerStats()
+  };
+}
+
+module.exports = {
+  enqueueMessage,
+  recordEnqueued,
+  startWorkers,
+  stopWorkers,
+  queueStats,
+  shardFor,
+  STREAM_KEY,
+  SHARD_PREFIX,
+  QUEUE_SHARDS,
+  DEAD_LETTER_KEY,
+  QUEUE_MAXLEN
+};
@@ -0,0 +1,40 @@
+const axios = require('axios');
+
+const BASE_URL = 'http://localhost:3000/api/whatsapp';
+
+// Sends a typical burst of short messages and checks that they became one queue entry
+async function testBurstCoalescing() {
+  try {
+    const burst = ['hi', 'I want nike shoes', 'size 42'];
+    const before = (await axios.get(`${BASE_URL}/queue`)).data;
+    
+    for (const [i, body] of burst.entries()) {
+      await axios.post(`${BASE_URL}/webhook`, {
+        MessageSid: `SMburst${Date.now()}${i}`,
+        From: 'whatsapp:+9971720258',
+        To: 'whatsapp:+14155238886',
+        Body: body,
+        ProfileName: 'Test User'
+      });
+    }
+    
+    // Wait for the burst window (and max wait) to pass
+    await new Promise(resolve => setTimeout(resolve, 6000));
+    
+    const after = (await axios.get(`${BASE_URL}/queue`)).data;
+    const bursts = after.bursts.bursts - before.bursts.bursts;
+    const merged = after.bursts.merged - before.bursts.merged;
+    
+    console.log(`Messages sent: ${burst.length}, queue entries: ${bursts}, merged away: ${merged}`);
+    
+    if (bursts === 1 && merged === burst.length - 1) {
+      console.log('✅ Burst coalesced into one agent call');
+    } else {
+      console.log('❌ Burst was not coalesced (is BURST_WINDOW_MS > 0?)');
+    }
+  } catch (error) {
+    console.error('❌ Burst test failed:', error.response?.status, error.response?.data || error.message);
+  }
+}
+
+testBurstCoalescing();
@@ -0,0 +1,37 @@
+const axios = require('axios');
+
+const AGENT_URL = process.env.AGENT_URL || 'http://localhost:5000';
+
+// Compares time to first chunk with total time for a streamed agent reply
+async function testAgentStream(query) {
+  const start = Date.now();
+  let firstChunkMs = null;
+  let chunks = 0;
+  
+  try {
+    const response = await axios.post(`${AGENT_URL}/agent/stream`, {
+      query,
+      phone_number: '+9971720258',
+      whatsapp_name: 'Test User'
+    }, { responseType: 'stream' });
+    
+    response.data.setEncoding('utf8');
+    for await (const data of response.data) {
+      if (data.includes('event: chunk')) {
+        chunks++;
+        if (firstChunkMs === null) {
+          firstChunkMs = Date.now() - start;
+        }
+      }
+    }
+    
+    console.log(`"${query}": first chunk after ${firstChunkMs} ms, done after ${Date.now() - start} ms (${chunks} packets)`);
+  } catch (error) {
+    console.error('❌ Stream test failed:', error.response?.status || error.message);
+  }
+}
+
+(async () => {
+  await testAgentStream('Show me all products');
+  await testAgentStream('Compare iPhone 15 vs Samsung Galaxy S24');
+})();
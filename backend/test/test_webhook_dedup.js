@@ -0,0 +1,41 @@
+const axios = require('axios');
+
+const BASE_URL = 'http://localhost:3000/api/whatsapp';
+
+async function testDuplicateWebhook() {
+  try {
+    // Same MessageSid twice, as Twilio does when it retries a webhook
+    const twilioPayload = {
+      MessageSid: `SMtest${Date.now()}`,
+      From: 'whatsapp:+9971720258',
+      To: 'whatsapp:+14155238886',
+      Body: 'Where is my order?',
+      ProfileName: 'Test User'
+    };
+    
+    const before = (await axios.get(`${BASE_URL}/queue`)).data;
+    
+    const first = await axios.post(`${BASE_URL}/webhook`, twilioPayload);
+    const retry = await axios.post(`${BASE_URL}/webhook`, twilioPayload);
+    
+    // The message is queued once its burst window closes
+    await new Promise(resolve => setTimeout(resolve, before.bursts.windowMs + 1000));
+    
+    const after = (await axios.get(`${BASE_URL}/queue`)).data;
+    const queued = after.enqueued - before.enqueued;
+    const duplicates = after.dedup.duplicates - before.dedup.duplicates;
+    
+    console.log(`Responses: ${first.status}, ${retry.status}`);
+    console.log(`Queued: ${queued}, duplicates detected: ${duplicates}`);
+    
+    if (queued === 1 && duplicates === 1) {
+      console.log('✅ Retry was acked without being queued again');
+    } else {
+      console.log('❌ Retry was processed again');
+    }
+  } catch (error) {
+    console.error('❌ Dedup test failed:', error.response?.status, error.response?.data || error.message);
+  }
+}
+
+testDuplicateWebhook();
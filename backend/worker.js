@@ -0,0 +1,23 @@
+const path = require('path');
+const { connectRedis } = require('./utils/redis_client');
+const { startMessageWorkers, stopMessageWorkers } = require('./routes/whatsapp');
+
+require('dotenv').config({ path: path.join(__dirname, '../.env') });
+
+// Standalone queue consumer: `node worker.js` (pair with QUEUE_WORKERS_IN_PROCESS=0 on the server)
+async function startWorker() {
+  try {
+    await connectRedis();
+    await startMessageWorkers();
+  } catch (error) {
+    console.error('Failed to start queue worker:', error);
+    process.exit(1);
+  }
+}
+
+process.on('SIGTERM', async () => {
+  await stopMessageWorkers();
+  process.exit(0);
+});
+
+startWorker();